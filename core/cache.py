@@ -0,0 +1,310 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+# ===== CACHÉ PERSISTENTE DE RESPUESTAS DE LA IA =====
+#
+# Las respuestas se guardan por un hash del (modelo, prompt, parámetros), así
+# un prompt idéntico para un proyecto sin cambios no vuelve a llamar a Gemini.
+# El backend se elige con settings.IA_CACHE["BACKEND"]:
+#   - "django":   usa una caché de Django (settings.CACHES)
+#   - "sqlite":   tabla propia en un archivo SQLite (compartido entre workers)
+#   - "archivos": un archivo por respuesta en un directorio local
+#   - "ninguno":  desactiva la caché
+
+TTL_POR_DEFECTO = 60 * 60 * 24 * 7  # una semana
+MAX_ENTRADAS_POR_DEFECTO = 1000
+
+
+def clave_cache(modelo: str, prompt: str, parametros: Optional[dict] = None) -> str:
+    datos = json.dumps([modelo, prompt, parametros or {}], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(datos.encode("utf-8")).hexdigest()
+
+
+class BackendCache:
+    """Interfaz común de los backends de caché."""
+
+    def __init__(self, ttl: int = TTL_POR_DEFECTO, max_entradas: int = MAX_ENTRADAS_POR_DEFECTO):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+
+    def obtener(self, clave: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def guardar(self, clave: str, valor: str) -> None:
+        raise NotImplementedError
+
+    def eliminar(self, clave: str) -> None:
+        raise NotImplementedError
+
+    def limpiar(self) -> None:
+        raise NotImplementedError
+
+
+class PrefijoVersionado:
+    """
+    Prefijo de claves dentro de una caché de Django compartida con el resto
+    de la aplicación. Vaciarlo no borra nada: sube la versión guardada en la
+    propia caché y las claves viejas dejan de leerse (caducan o las expulsa
+    el LRU). La versión inicial es la hora en ms, no 1: si el backend expulsa
+    la clave de versión, la nueva no coincide con ninguna anterior.
+    """
+
+    def __init__(self, alias: str, prefijo: str):
+        self.alias = alias
+        self.base = prefijo
+        self.clave_version = f"{prefijo}version"
+
+    @property
+    def cache(self):
+        from django.core.cache import caches
+        return caches[self.alias]
+
+    def prefijo(self) -> str:
+        version = self.cache.get(self.clave_version)
+        if version is None:
+            self.cache.add(self.clave_version, int(time.time() * 1000), timeout=None)
+            version = self.cache.get(self.clave_version)
+        return f"{self.base}{version}:"
+
+    def vaciar(self) -> None:
+        try:
+            self.cache.incr(self.clave_version)
+        except ValueError:  # no existía: la próxima lectura crea una versión nueva
+            pass
+
+
+class CacheDjango(BackendCache):
+    """
+    Delega en una caché de Django. La expulsión LRU la hace el propio backend
+    de Django (LocMemCache es LRU; el resto recorta según MAX_ENTRIES).
+    """
+
+    PREFIJO = "ia:"
+
+    def __init__(self, alias: str = "default", **kwargs: Any):
+        super().__init__(**kwargs)
+        self.alias = alias
+        self._prefijo = PrefijoVersionado(alias, self.PREFIJO)
+
+    @property
+    def _cache(self):
+        return self._prefijo.cache
+
+    def obtener(self, clave: str) -> Optional[str]:
+        return self._cache.get(self._prefijo.prefijo() + clave)
+
+    def guardar(self, clave: str, valor: str) -> None:
+        self._cache.set(self._prefijo.prefijo() + clave, valor, timeout=self.ttl)
+
+    def eliminar(self, clave: str) -> None:
+        self._cache.delete(self._prefijo.prefijo() + clave)
+
+    def limpiar(self) -> None:
+        """Solo las respuestas de la IA: el resto de la caché de Django no se toca."""
+        self._prefijo.vaciar()
+
+
+class CacheSQLite(BackendCache):
+    """
+    Tabla en un archivo SQLite independiente de la base de datos de Django.
+    Guarda la fecha de último uso de cada entrada para expulsar por LRU.
+    """
+
+    def __init__(self, ruta: Any, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.ruta = str(ruta)
+        self._local = threading.local()
+        self._pid = os.getpid()
+
+    def _conexion(self) -> sqlite3.Connection:
+        # Una conexión por hilo; tras un fork se abre una nueva
+        conexion = getattr(self._local, "conexion", None)
+        if conexion is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            conexion = sqlite3.connect(self.ruta, timeout=10, isolation_level=None)
+            conexion.execute(
+                "CREATE TABLE IF NOT EXISTS respuestas_ia ("
+                " clave TEXT PRIMARY KEY,"
+                " valor TEXT NOT NULL,"
+                " creado REAL NOT NULL,"
+                " usado REAL NOT NULL)"
+            )
+            conexion.execute("CREATE INDEX IF NOT EXISTS respuestas_ia_usado ON respuestas_ia (usado)")
+            self._local.conexion = conexion
+        return conexion
+
+    def obtener(self, clave: str) -> Optional[str]:
+        ahora = time.time()
+        conexion = self._conexion()
+        fila = conexion.execute(
+            "SELECT valor, creado FROM respuestas_ia WHERE clave = ?", (clave,)
+        ).fetchone()
+        if fila is None:
+            return None
+        valor, creado = fila
+        if self.ttl and creado + self.ttl < ahora:
+            self.eliminar(clave)
+            return None
+        conexion.execute("UPDATE respuestas_ia SET usado = ? WHERE clave = ?", (ahora, clave))
+        return valor
+
+    def guardar(self, clave: str, valor: str) -> None:
+        ahora = time.time()
+        conexion = self._conexion()
+        conexion.execute(
+            "INSERT OR REPLACE INTO respuestas_ia (clave, valor, creado, usado) VALUES (?, ?, ?, ?)",
+            (clave, valor, ahora, ahora),
+        )
+        self._expulsar(conexion, ahora)
+
+    def _expulsar(self, conexion: sqlite3.Connection, ahora: float) -> None:
+        if self.ttl:
+            conexion.execute("DELETE FROM respuestas_ia WHERE creado < ?", (ahora - self.ttl,))
+        if self.max_entradas:
+            conexion.execute(
+                "DELETE FROM respuestas_ia WHERE clave IN ("
+                " SELECT clave FROM respuestas_ia ORDER BY usado DESC LIMIT -1 OFFSET ?)",
+                (self.max_entradas,),
+            )
+
+    def eliminar(self, clave: str) -> None:
+        self._conexion().execute("DELETE FROM respuestas_ia WHERE clave = ?", (clave,))
+
+    def limpiar(self) -> None:
+        self._conexion().execute("DELETE FROM respuestas_ia")
+
+
+class CacheArchivos(BackendCache):
+    """
+    Un archivo JSON por respuesta. La fecha de modificación del archivo se usa
+    como fecha de último uso para la expulsión LRU.
+    """
+
+    def __init__(self, directorio: Any, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.directorio = Path(directorio)
+
+    def _ruta(self, clave: str) -> Path:
+        return self.directorio / clave[:2] / f"{clave}.json"
+
+    def obtener(self, clave: str) -> Optional[str]:
+        ruta = self._ruta(clave)
+        try:
+            datos = json.loads(ruta.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if self.ttl and datos["creado"] + self.ttl < time.time():
+            self.eliminar(clave)
+            return None
+        try:
+            os.utime(ruta)
+        except OSError:
+            pass
+        return datos["valor"]
+
+    def guardar(self, clave: str, valor: str) -> None:
+        ruta = self._ruta(clave)
+        ruta.parent.mkdir(parents=True, exist_ok=True)
+        temporal = ruta.with_suffix(f".{os.getpid()}.tmp")
+        temporal.write_text(json.dumps({"creado": time.time(), "valor": valor}), encoding="utf-8")
+        os.replace(temporal, ruta)
+        self._expulsar()
+
+    def _expulsar(self) -> None:
+        if not self.max_entradas:
+            return
+        archivos = list(self.directorio.glob("*/*.json"))
+        if len(archivos) <= self.max_entradas:
+            return
+
+        def ultimo_uso(ruta: Path) -> float:
+            try:
+                return ruta.stat().st_mtime
+            except OSError:
+                return 0.0
+
+        archivos.sort(key=ultimo_uso)
+        for ruta in archivos[:len(archivos) - self.max_entradas]:
+            try:
+                ruta.unlink()
+            except OSError:
+                pass
+
+    def eliminar(self, clave: str) -> None:
+        try:
+            self._ruta(clave).unlink()
+        except OSError:
+            pass
+
+    def limpiar(self) -> None:
+        for ruta in self.directorio.glob("*/*.json"):
+            try:
+                ruta.unlink()
+            except OSError:
+                pass
+
+
+BACKENDS = {
+    "django": CacheDjango,
+    "sqlite": CacheSQLite,
+    "archivos": CacheArchivos,
+}
+
+_backend: Optional[BackendCache] = None
+_backend_cargado = False
+_lock = threading.Lock()
+
+
+def _configuracion() -> dict:
+    try:
+        from django.conf import settings
+        if settings.configured:
+            return dict(getattr(settings, "IA_CACHE", {}))
+    except ImportError:
+        pass
+    return {}
+
+
+def construir_backend(configuracion: dict) -> Optional[BackendCache]:
+    nombre = configuracion.get("BACKEND", "ninguno")
+    if not nombre or nombre == "ninguno":
+        return None
+    if nombre not in BACKENDS:
+        raise ValueError(f"Backend de caché desconocido: {nombre}")
+
+    opciones = {
+        "ttl": configuracion.get("TTL", TTL_POR_DEFECTO),
+        "max_entradas": configuracion.get("MAX_ENTRADAS", MAX_ENTRADAS_POR_DEFECTO),
+    }
+    if nombre == "django":
+        opciones["alias"] = configuracion.get("ALIAS", "default")
+    elif nombre == "sqlite":
+        opciones["ruta"] = configuracion["RUTA"]
+    else:
+        opciones["directorio"] = configuracion["RUTA"]
+    return BACKENDS[nombre](**opciones)
+
+
+def obtener_cache() -> Optional[BackendCache]:
+    """Devuelve el backend configurado (o None si la caché está desactivada)."""
+    global _backend, _backend_cargado
+    if not _backend_cargado:
+        with _lock:
+            if not _backend_cargado:
+                _backend = construir_backend(_configuracion())
+                _backend_cargado = True
+    return _backend
+
+
+def reiniciar_cache() -> None:
+    """Olvida el backend construido; se vuelve a leer la configuración al usarlo."""
+    global _backend, _backend_cargado
+    with _lock:
+        _backend = None
+        _backend_cargado = False
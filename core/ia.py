@@ -1,384 +1,680 @@
+import asyncio
+import contextvars
+import json
+import logging
+import math
 import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
 from dotenv import load_dotenv
-import google.generativeai as genai
+from core.cache import clave_cache, obtener_cache
+from core.limites import Decision, obtener_limitador
+from core.prompts import PARCHE, PROMPTS, Plantilla
+from core.proveedores import (BackendIA, BackendNoDisponible, CARACTERES_POR_TOKEN, MODELO_POR_DEFECTO,
+                              obtener_backend)
+
+logger = logging.getLogger(__name__)
 
 # Cargar variables de entorno
 load_dotenv()
 
-api_key = os.getenv("GEMINI_API_KEY")
-if not api_key:
-    raise ValueError("La clave de API GEMINI_API_KEY no está configurada.")
-
-genai.configure(api_key=api_key)
-MODEL = "models/gemini-2.0-flash"
-
-# ===== PROMPTS PERSONALIZADOS =====
-
-PROMPTS = {
-    "Historia de Usuario": lambda nombre_proyecto, descripcion: (
-        f"Dame historias de usuario enumeradas con HU y el número secuencial para un proyecto de software llamado '{nombre_proyecto}' y con la siguiente descripción '{descripcion}'. "
-        "Con la estructura: Como, Quiero, Para. No le des formato a la respuesta. Ni uses lenguaje técnico."
-    ),
-
-    "Diagrama de flujo": lambda texto: (
-        "Genera un diagrama de flujo único en sintaxis Mermaid (Markdown) que cumpla con:\n"
-        "1. Incluir TODOS los usuarios/actores en el mismo flujo\n"
-        "2. Usar estructura flowchart TD con nodos concisos (máximo 3 palabras)\n"
-        "3. Decisiones con formato: {¿Pregunta?} y flechas -->|sí|/-->|no|\n"
-        "4. Un solo nodo inicial [Inicio] y final [Fin]\n"
-        "5. Conexiones lógicas sin bucles infinitos\n\n"
-        "Instrucciones técnicas:\n"
-        "- Usar IDs únicos en inglés para nodos (Ej: A, B, C1)\n"
-        "- Evitar caracteres especiales en IDs\n"
-        "- Alinear con espacios: '  ' para indentación\n"
-        "- Validar sintaxis en Mermaid Live Editor\n\n"
-        f"Historias de usuario:\n{texto}\n\n"
-        "Formato de salida (solo código, sin explicaciones):\n"
-        "flowchart TD\n"
-        "  A[Inicio] --> B[Acción 1]\n"
-        "  B --> C{¿Decisión?}\n"
-        "  C -->|sí| D[Acción 2]\n"
-        "  C -->|no| E[Acción 3]\n"
-        "  D --> F[Fin]\n"
-        "  E --> F"
-    ),
-
-    "Diagrama de clases": lambda texto: (
-        "Genera un diagrama de clases en sintaxis Mermaid basado en el siguiente texto:\n\n"
-        f"{texto}\n\n"
-        "Incluye las siguientes características:\n"
-        "- Clases con nombres claros.\n"
-        "- Atributos con tipo y visibilidad (+ público, - privado, # protegido).\n"
-        "- Métodos con parámetros y visibilidad.\n"
-        "- Relaciones entre clases: herencia (<|--), asociación (--), composición (*--), agregación (o--).\n"
-        "- Multiplicidades cuando correspondan.\n"
-        "-no utilices explicaciones del diagrama.\n"
-        "classDiagram\n"
-        "    class Usuario {\n"
-        "        +nombre: String\n"
-        "        +login()\n"
-        "    }\n"
-        "    class Cliente {\n"
-        "        +id: Int\n"
-        "        +realizarCompra()\n"
-        "    }\n"
-        "    Usuario <|-- Cliente\n"
-        "    Cliente *-- Pedido : realiza\n"
-        "    Pedido o-- Producto : contiene"
-    ),
-
-    "Diagrama de Entidad-Relacion": lambda texto: (
-        "Genera un diagrama entidad-relación (ER) en sintaxis Mermaid basado en el siguiente texto:\n\n"
-        f"{texto}\n\n"
-        "Indicaciones claras para la generación:\n"
-        "- Usa la palabra clave erDiagram para iniciar el diagrama.\n"
-        "- Define solo entidades relevantes con atributos dentro de llaves {}, indicando tipo y clave primaria (PK) si aplica.\n"
-        "- No generes entidades sin atributos o sin relaciones, para evitar cuadros vacíos.\n"
-        "- Usa cardinalidades con los símbolos ||, |o, }o, }| según notación crow's foot.\n"
-        "- Define relaciones con la sintaxis: ENTIDAD1 <cardinalidad>--<cardinalidad> ENTIDAD2 : descripción\n"
-        "- Usa direccion TB o LR.\n"
-        "- Usa nombres de entidades en mayúsculas y sin espacios ni caracteres especiales.\n"
-        "- Limita los nombres de atributos a un máximo de 3 palabras para mejor legibilidad.\n"
-        "- Devuelve solo el bloque de código completo en Mermaid, sin explicaciones ni texto adicional.\n\n"
-        "Ejemplo:\n"
-        "erDiagram\n"
-        "    CLIENTE {\n"
-        "        int id PK\n"
-        "        string nombre\n"
-        "    }\n"
-        "    PEDIDO {\n"
-        "        int id PK\n"
-        "        date fecha\n"
-        "    }\n"
-        "    CLIENTE ||--o{ PEDIDO : realiza\n"
-        "    PEDIDO }o--|| PRODUCTO : contiene"
-    ),
-
-    "Diagrama de secuencia": lambda texto: (
-        "Genera un diagrama de secuencia en sintaxis Mermaid basado en el siguiente texto:\n\n"
-        f"{texto}\n\n"
-        "Incluye actores, objetos, mensajes y retornos.\n"
-        "-no utilices explicaciones del diagrama.\n"
-        "Ejemplo:\n"
-        "sequenceDiagram\n"
-        "    participant Usuario\n"
-        "    participant Sistema\n"
-        "    Usuario->>Sistema: Solicita iniciar sesión\n"
-        "    Sistema-->>Usuario: Muestra pantalla principal"
-    ),
-
-    "Diagrama de estado": lambda texto: (
-        "Genera un diagrama de estados en sintaxis Mermaid basado en el siguiente texto:\n\n"
-        "-no utilices explicaciones del diagrama.\n"
-        f"{texto}\n\n"
-        "Ejemplo:\n"
-        "stateDiagram-v2\n"
-        "    [*] --> Estado1\n"
-        "    Estado1 --> Estado2: eventoA\n"
-        "    Estado2 --> Estado3: eventoB\n"
-        "    Estado3 --> [*]"
-    ),
-
-    "Diagrama de C4-contexto": lambda texto: (
-        "Genera un diagrama C4 de tipo contexto (c4Context) en sintaxis Mermaid basado en la siguiente descripción del sistema:\n\n"
-        f"{texto}\n\n"
-        "Sigue cuidadosamente estas indicaciones para la sintaxis del diagrama Mermaid:\n\n"
-        "- Se empieza con C4Context para definir el tipo de diagrama.\n\n"
-        "Estructura y elementos obligatorios:\n"
-        "- Usa Person(alias, nombre, descripción) para representar actores humanos internos.\n"
-        "- Usa Person_Ext(alias, nombre, descripción) para representar actores externos.\n"
-        "- Usa System(alias, nombre, descripción) para representar el sistema principal.\n"
-        "- Usa System_Ext(alias, nombre, descripción) para sistemas externos conectados."
-        "- Usa SystemDb(alias, nombre, descripción) para bases de datos internas del sistema."
-        "- Usa SystemDb_Ext(alias, nombre, descripción) para bases de datos externas."
-        "- Usa SystemQueue o SystemQueue_Ext si el sistema involucra colas de mensajes."
-
-        "- Agrupa sistemas internos usando Enterprise_Boundary(alias, nombre).\n"
-        "- Puedes anidar límites usando System_Boundary y Boundary si es necesario.\n\n"
-        "Relaciones:\n"
-        "- Usa Rel(origen, destino, etiqueta) para relaciones unidireccionales.\n"
-        "- Usa BiRel(origen, destino, etiqueta) para relaciones bidireccionales.\n"
-        "- Puedes añadir un protocolo como cuarto parámetro en Rel (ej. 'SMTP').\n\n"
-        "Estilos personalizados (opcionales pero recomendados para enriquecer el diagrama):\n"
-        "- Usa UpdateElementStyle(alias, $fontColor=, $bgColor=, $borderColor=) para personalizar elementos.\n"
-        "- Usa UpdateRelStyle(from, to, $textColor=, $lineColor=) para personalizar relaciones.\n"
-        "Devuelve únicamente el código Mermaid completo y válido, sin usar la palabra 'mermaid' ni comillas ni backticks. El código debe comenzar directamente con las líneas %%{ init ... }%%.\n\n"
-        "Ojo, tiene que empezar si o si con la siguiente linea: C4Context"
-        "Ejemplo:\n"
-        "C4Context\n"
-        "    title \"System Context diagram for Internet Banking System\"\n"
-        "    Enterprise_Boundary(b0, \"BankBoundary0\") {\n"
-        "        Person(customerA, \"Banking Customer A\", \"A customer of the bank, with personal bank accounts.\")\n"
-        "        Person(customerB, \"Banking Customer B\")\n"
-        "        Person_Ext(customerC, \"Banking Customer C\", \"desc\")\n"
-        "        Person(customerD, \"Banking Customer D\", \"A customer of the bank, <br/> with personal bank accounts.\")\n"
-        "        System(SystemAA, \"Internet Banking System\", \"Allows customers to view information about their bank accounts, and make payments.\")\n"
-        "\n"
-        "        Enterprise_Boundary(b1, \"BankBoundary\") {\n"
-        "            SystemDb_Ext(SystemE, \"Mainframe Banking System\", \"Stores all of the core banking information about customers, accounts, transactions, etc.\")\n"
-        "\n"
-        "            System_Boundary(b2, \"BankBoundary2\") {\n"
-        "                System(SystemA, \"Banking System A\")\n"
-        "                System(SystemB, \"Banking System B\", \"A system of the bank, with personal bank accounts. next line.\")\n"
-        "            }\n"
-        "\n"
-        "            System_Ext(SystemC, \"E-mail system\", \"The internal Microsoft Exchange e-mail system.\")\n"
-        "            SystemDb(SystemD, \"Banking System D Database\", \"A system of the bank, with personal bank accounts.\")\n"
-        "\n"
-        "            Boundary(b3, \"BankBoundary3\", \"boundary\") {\n"
-        "                SystemQueue(SystemF, \"Banking System F Queue\", \"A system of the bank.\")\n"
-        "                SystemQueue_Ext(SystemG, \"Banking System G Queue\", \"A system of the bank, with personal bank accounts.\")\n"
-        "            }\n"
-        "        }\n"
-        "    }\n"
-        "\n"
-        "    BiRel(customerA, SystemAA, \"Uses\")\n"
-        "    BiRel(SystemAA, SystemE, \"Uses\")\n"
-        "    Rel(SystemAA, SystemC, \"Sends e-mails\", \"SMTP\")\n"
-        "    Rel(SystemC, customerA, \"Sends e-mails to\")\n"
-        "\n"
-        "    UpdateElementStyle(customerA, $fontColor=\"red\", $bgColor=\"grey\", $borderColor=\"red\")\n"
-        "    UpdateRelStyle(customerA, SystemAA, $textColor=\"blue\", $lineColor=\"blue\", $offsetX=\"5\")\n"
-        "    UpdateRelStyle(SystemAA, SystemE, $textColor=\"blue\", $lineColor=\"blue\", $offsetY=\"-10\")\n"
-        "    UpdateRelStyle(SystemAA, SystemC, $textColor=\"blue\", $lineColor=\"blue\", $offsetY=\"-40\", $offsetX=\"-50\")\n"
-        "    UpdateRelStyle(SystemC, customerA, $textColor=\"red\", $lineColor=\"red\", $offsetX=\"-50\", $offsetY=\"20\")\n"
-        "\n"
-        "    UpdateLayoutConfig($c4ShapeInRow=\"3\", $c4BoundaryInRow=\"1\")"
-    ),
-    
-    "Diagrama de C4-contenedor": lambda texto: (
-        "Genera un diagrama C4 de tipo contenedor (C4Container) en sintaxis Mermaid basado en la siguiente descripción del sistema:\n\n"
-        f"{texto}\n\n"
-        "Sigue cuidadosamente estas indicaciones para la sintaxis del diagrama Mermaid:\n\n"
-        "- Se empieza con C4Container para definir el tipo de diagrama.\n\n"
-        "- Trata de sea en español las especificaciones y descripciones"
-        "- Los diagramas deben tener un orden entendible"
-        "Estructura y elementos obligatorios:\n"
-        "- Usa Container(alias, nombre, tecnología, descripción) para representar contenedores principales.\n"
-        "- Usa ContainerDb(alias, nombre, tecnología, descripción) para bases de datos internas.\n"
-        "- Usa ContainerQueue(alias, nombre, tecnología, descripción) para colas internas.\n"
-        "- Usa Container_Ext(alias, nombre, tecnología, descripción) para contenedores externos.\n"
-        "- Usa ContainerDb_Ext(alias, nombre, tecnología, descripción) y ContainerQueue_Ext(alias, nombre, tecnología, descripción) para bases de datos y colas externas.\n"
-        "- Usa Container_Boundary(alias, nombre) para agrupar contenedores del sistema.\n\n"
-
-        "Otros elementos permitidos:\n"
-        "- Usa Person(alias, nombre, descripción) para actores internos.\n"
-        "- Usa Person_Ext(alias, nombre, descripción) para actores externos.\n"
-        "- Usa System_Ext(alias, nombre, descripción) para sistemas externos.\n\n"
-
-        "Relaciones:\n"
-        "- Usa Rel(origen, destino, etiqueta, protocolo) para relaciones unidireccionales.\n"
-        "- Usa BiRel(origen, destino, etiqueta, protocolo) para relaciones bidireccionales.\n"
-        "- Usa Rel_Back(origen, destino, etiqueta, protocolo) para relaciones desde bases de datos u otros componentes al contenedor.\n\n"
-
-        "Estilos personalizados (opcionales pero recomendados):\n"
-        "- Usa UpdateElementStyle(alias, $fontColor=\"\", $bgColor=\"\", $borderColor=\"\") para personalizar elementos.\n"
-        "- Usa UpdateRelStyle(origen, destino, $textColor=\"\", $lineColor=\"\", $offsetX=\"\", $offsetY=\"\") para personalizar relaciones.\n"
-        "- Usa UpdateLayoutConfig($c4ShapeInRow=\"\", $c4BoundaryInRow=\"\") para modificar la distribución del diagrama.\n\n"
-
-        "Devuelve únicamente el código Mermaid completo y válido, sin usar la palabra 'mermaid', sin comillas ni backticks. El código debe comenzar directamente con las líneas C4Container.\n\n"
-        "Te doy un ejemplo de como podria ser la estructura:\n"
-        "C4Container\n"
-        "    title \"Container diagram for Internet Banking System\"\n"
-        "\n"
-        "    System_Ext(email_system, \"E-Mail System\", \"The internal Microsoft Exchange system\", $tags=\"v1.0\")\n"
-        "    Person(customer, \"Customer\", \"A customer of the bank, with personal bank accounts\", $tags=\"v1.0\")\n"
-        "\n"
-        "    Container_Boundary(c1, \"Internet Banking\") {\n"
-        "        Container(spa, \"Single-Page App\", \"JavaScript, Angular\", \"Provides all the Internet banking functionality to customers via their web browser\")\n"
-        "        Container_Ext(mobile_app, \"Mobile App\", \"C#, Xamarin\", \"Provides a limited subset of the Internet banking functionality to customers via their mobile device\")\n"
-        "        Container(web_app, \"Web Application\", \"Java, Spring MVC\", \"Delivers the static content and the Internet banking SPA\")\n"
-        "        ContainerDb(database, \"Database\", \"SQL Database\", \"Stores user registration information, hashed auth credentials, access logs, etc.\")\n"
-        "        ContainerDb_Ext(backend_api, \"API Application\", \"Java, Docker Container\", \"Provides Internet banking functionality via API\")\n"
-        "    }\n"
-        "\n"
-        "    System_Ext(banking_system, \"Mainframe Banking System\", \"Stores all of the core banking information about customers, accounts, transactions, etc.\")\n"
-        "\n"
-        "    Rel(customer, web_app, \"Uses\", \"HTTPS\")\n"
-        "    UpdateRelStyle(customer, web_app, $offsetY=\"60\", $offsetX=\"90\")\n"
-        "    Rel(customer, spa, \"Uses\", \"HTTPS\")\n"
-        "    UpdateRelStyle(customer, spa, $offsetY=\"-40\")\n"
-        "    Rel(customer, mobile_app, \"Uses\")\n"
-        "    UpdateRelStyle(customer, mobile_app, $offsetY=\"-30\")\n"
-        "\n"
-        "    Rel(web_app, spa, \"Delivers\")\n"
-        "    UpdateRelStyle(web_app, spa, $offsetX=\"130\")\n"
-        "    Rel(spa, backend_api, \"Uses\", \"async, JSON/HTTPS\")\n"
-        "    Rel(mobile_app, backend_api, \"Uses\", \"async, JSON/HTTPS\")\n"
-        "    Rel_Back(database, backend_api, \"Reads from and writes to\", \"sync, JDBC\")\n"
-        "\n"
-        "    Rel(email_system, customer, \"Sends e-mails to\")\n"
-        "    UpdateRelStyle(email_system, customer, $offsetX=\"-45\")\n"
-        "    Rel(backend_api, email_system, \"Sends e-mails using\", \"sync, SMTP\")\n"
-        "    UpdateRelStyle(backend_api, email_system, $offsetY=\"-60\")\n"
-        "    Rel(backend_api, banking_system, \"Uses\", \"sync/async, XML/HTTPS\")\n"
-        "    UpdateRelStyle(backend_api, banking_system, $offsetY=\"-50\", $offsetX=\"-140\")"
-    ),
-
-    "Diagrama de C4-implementación": lambda texto: (
-        "Genera un diagrama C4 de tipo implementación (C4Deployment) en sintaxis Mermaid basado en la siguiente descripción del sistema:\n\n"
-        f"{texto}\n\n"
-        "Sigue cuidadosamente estas indicaciones para la sintaxis del diagrama Mermaid:\n\n"
-        "- Comienza el código con:\n"
-        "  C4Deployment\n\n"
-        "- Trata de sea en español las especificaciones y descripciones"
-        "- Los diagramas deben tener un orden entendible"
-        "Estructura y elementos obligatorios:\n"
-        "- Usa Deployment_Node(alias, nombre, tipo, descripción) para representar nodos físicos o virtuales.\n"
-        "- También puedes usar:\n"
-        "  - Node(): versión corta de Deployment_Node()\n"
-        "  - Node_L(): alineado a la izquierda\n"
-        "  - Node_R(): alineado a la derecha\n"
-        "- Dentro de los nodos se colocan:\n"
-        "  - Container(alias, nombre, tecnología, descripción) para aplicaciones.\n"
-        "  - ContainerDb(alias, nombre, tecnología, descripción) para bases de datos.\n"
-
-        "Relaciones:\n"
-        "- Usa Rel(origen, destino, descripción, protocolo) para relaciones unidireccionales.\n"
-        "- Usa Rel_U(), Rel_D(), Rel_L(), Rel_R() si quieres controlar la dirección de la flecha.\n"
-
-        "Estilos personalizados:\n"
-        "- Usa UpdateRelStyle(origen, destino, $textColor=\"\", $lineColor=\"\", $offsetX=\"\", $offsetY=\"\") para personalizar relaciones.\n"
-        "- Usa UpdateLayoutConfig($c4ShapeInRow=\"\", $c4BoundaryInRow=\"\") para controlar la distribución visual.\n\n"
-
-        "Devuelve solo el código Mermaid. No uses la palabra 'mermaid', comillas ni backticks.\n\n"
-
-        "Ejemplo:\n"
-
-        "C4Deployment\n"
-        "    title Deployment Diagram for Internet Banking System - Live\n\n"
-        "    Deployment_Node(mob, \"Customer's mobile device\", \"Apple IOS or Android\") {\n"
-        "        Container(mobile, \"Mobile App\", \"Xamarin\", \"Provides a limited subset of the Internet Banking functionality to customers via their mobile device.\")\n"
-        "    }\n\n"
-        "    Deployment_Node(comp, \"Customer's computer\", \"Microsoft Windows or Apple macOS\") {\n"
-        "        Deployment_Node(browser, \"Web Browser\", \"Google Chrome, Mozilla Firefox,<br/> Apple Safari or Microsoft Edge\") {\n"
-        "            Container(spa, \"Single Page Application\", \"JavaScript and Angular\", \"Provides all of the Internet Banking functionality to customers via their web browser.\")\n"
-        "        }\n"
-        "    }\n\n"
-        "    Deployment_Node(plc, \"Big Bank plc\", \"Big Bank plc data center\") {\n"
-        "        Deployment_Node(dn, \"bigbank-api*** x8\", \"Ubuntu 16.04 LTS\") {\n"
-        "            Deployment_Node(apache, \"Apache Tomcat\", \"Apache Tomcat 8.x\") {\n"
-        "                Container(api, \"API Application\", \"Java and Spring MVC\", \"Provides Internet Banking functionality via a JSON/HTTPS API.\")\n"
-        "            }\n"
-        "        }\n"
-        "        Deployment_Node(bb2, \"bigbank-web*** x4\", \"Ubuntu 16.04 LTS\") {\n"
-        "            Deployment_Node(apache2, \"Apache Tomcat\", \"Apache Tomcat 8.x\") {\n"
-        "                Container(web, \"Web Application\", \"Java and Spring MVC\", \"Delivers the static content and the Internet Banking single page application.\")\n"
-        "            }\n"
-        "        }\n"
-        "        Deployment_Node(bigbankdb01, \"bigbank-db01\", \"Ubuntu 16.04 LTS\") {\n"
-        "            Deployment_Node(oracle, \"Oracle - Primary\", \"Oracle 12c\") {\n"
-        "                ContainerDb(db, \"Database\", \"Relational Database Schema\", \"Stores user registration information, hashed authentication credentials, access logs, etc.\")\n"
-        "            }\n"
-        "        }\n"
-        "        Deployment_Node(bigbankdb02, \"bigbank-db02\", \"Ubuntu 16.04 LTS\") {\n"
-        "            Deployment_Node(oracle2, \"Oracle - Secondary\", \"Oracle 12c\") {\n"
-        "                ContainerDb(db2, \"Database\", \"Relational Database Schema\", \"Stores user registration information, hashed authentication credentials, access logs, etc.\")\n"
-        "            }\n"
-        "        }\n"
-        "    }\n\n"
-        "    Rel(mobile, api, \"Makes API calls to\", \"json/HTTPS\")\n"
-        "    Rel(spa, api, \"Makes API calls to\", \"json/HTTPS\")\n"
-        "    Rel_U(web, spa, \"Delivers to the customer's web browser\")\n"
-        "    Rel(api, db, \"Reads from and writes to\", \"JDBC\")\n"
-        "    Rel(api, db2, \"Reads from and writes to\", \"JDBC\")\n"
-        "    Rel_R(db, db2, \"Replicates data to\")\n\n"
-        "    UpdateRelStyle(spa, api, $offsetY=\"-40\")\n"
-        "    UpdateRelStyle(web, spa, $offsetY=\"-40\")\n"
-        "    UpdateRelStyle(api, db, $offsetY=\"-20\", $offsetX=\"5\")\n"
-        "    UpdateRelStyle(api, db2, $offsetX=\"-40\", $offsetY=\"-20\")\n"
-        "    UpdateRelStyle(db, db2, $offsetY=\"-10\")"
-    ),
-
-
-    "caja negra": lambda nombre_proyecto, descripcion: (
-        "Genera casos de prueba de caja negra detallados basados en el siguiente texto o historias de usuario:\n\n"
-        f"{nombre_proyecto, descripcion}\n\n"
-        "Para cada caso de prueba, estructura la información de la siguiente forma sin ningún formato enriquecido" 
-        "(sin negritas, sin cursivas, sin listas con viñetas, solo texto plano):\n"
-        "- Identificador: con formato PCN-01, PCN-02, PCN-03, ...\n"
-        "- Nombre de la prueba de caja negra\n"
-        "- Propósito\n"
-        "- Prerrequisito\n"
-        "- Datos de entrada\n"
-        "- Pasos para realizar la prueba\n"
-        "- Resultado esperado\n"
-        "Devuelve sólo el texto claro y estructurado siguiendo este formato para cada caso de prueba, sin numeraciones o texto adicional fuera de la estructura."
-    ),
-
-    "smoke": lambda nombre_proyecto, descripcion: (
-        "Genera pruebas smoke (pruebas rápidas y mínimas) para validar la funcionalidad esencial según el siguiente texto:\n\n"
-        f"Proyecto: {nombre_proyecto}\nDescripción: {descripcion}\n\n"
-        "Devuelve sólo texto claro y estructurado con el siguiente formato para cada prueba:\n"
-        "- Nombre de la prueba\n"
-        "- Propósito\n"
-        "- Pasos mínimos\n"
-        "- Resultado esperado\n\n"
-        "No incluyas numeraciones ni texto adicional fuera de esta estructura."
-    ),
+GENERATION_CONFIG: dict = {}  # parámetros de generación; forman parte de la clave de caché
+
+
+def _ajuste(nombre: str, defecto: Any) -> Any:
+    """Lee un ajuste de Django si está disponible; si no, devuelve el valor por defecto."""
+    try:
+        from django.conf import settings
+        if settings.configured:
+            return getattr(settings, nombre, defecto)
+    except ImportError:
+        pass
+    return defecto
+
+
+# Modelo con el que se generan las respuestas; forma parte de la clave de caché
+MODEL = _ajuste("IA_BACKEND", {}).get("MODELO", MODELO_POR_DEFECTO)
+
+# ===== RESILIENCIA: TIEMPOS, REINTENTOS Y CORTACIRCUITOS =====
+#
+# Cada llamada a Gemini tiene un tiempo máximo. Los errores pasajeros
+# (429, 500, 503, tiempo agotado) se reintentan con espera exponencial y
+# aleatoria. Si se acumulan fallos seguidos el circuito se abre y las
+# llamadas fallan al instante durante IA_RESILIENCIA["ENFRIAMIENTO"]
+# segundos; después se deja pasar una llamada de prueba.
+# Los errores se lanzan como excepciones (ErrorIA), nunca como texto.
+
+
+class ErrorIA(Exception):
+    """No se pudo generar contenido con la IA."""
+
 
+class ErrorIATransitorio(ErrorIA):
+    """Error pasajero del servicio (cuota, sobrecarga); se puede reintentar."""
+
+
+class TiempoAgotadoIA(ErrorIATransitorio):
+    """La llamada superó el tiempo máximo configurado."""
+
+
+class CircuitoAbierto(ErrorIA):
+    """El servicio está fallando: se rechaza la llamada sin intentarla."""
+
+
+ERRORES_TIEMPO = (TimeoutError, asyncio.TimeoutError)
+
+RESILIENCIA_POR_DEFECTO = {
+    "TIMEOUT": 60,           # segundos por llamada
+    "REINTENTOS": 3,         # reintentos tras el primer intento
+    "ESPERA_BASE": 1.0,      # segundos; se duplica en cada reintento
+    "ESPERA_MAXIMA": 20.0,
+    "UMBRAL_FALLOS": 5,      # fallos seguidos que abren el circuito
+    "ENFRIAMIENTO": 30,      # segundos con el circuito abierto
 }
 
-# ===== FUNCIONES DE GENERACIÓN =====
 
-def _generar_contenido(prompt: str) -> str:
+def _config_resiliencia() -> dict:
+    return {**RESILIENCIA_POR_DEFECTO, **_ajuste("IA_RESILIENCIA", {})}
+
+
+def _backend() -> BackendIA:
+    try:
+        return obtener_backend()
+    except BackendNoDisponible as e:
+        raise ErrorIA(str(e)) from e
+
+
+def clasificar_error(error: Exception) -> ErrorIA:
+    """Convierte una excepción del backend en la ErrorIA correspondiente."""
+    if isinstance(error, ErrorIA):
+        return error
+    mensaje = f"No se pudo generar contenido: {error}"
+    backend = _backend()
+    if isinstance(error, ERRORES_TIEMPO + backend.errores_tiempo):
+        return TiempoAgotadoIA(mensaje)
+    if isinstance(error, backend.errores_transitorios):
+        return ErrorIATransitorio(mensaje)
+    return ErrorIA(mensaje)
+
+
+class Cortacircuitos:
+    """Cortacircuitos por proceso: cerrado → abierto → semiabierto (una prueba) → cerrado."""
+
+    CERRADO = "cerrado"
+    ABIERTO = "abierto"
+    SEMIABIERTO = "semiabierto"
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.estado = self.CERRADO
+        self.fallos = 0
+        self.abierto_hasta = 0.0
+
+    def permitir(self) -> None:
+        """Lanza CircuitoAbierto si la llamada no debe intentarse."""
+        with self._lock:
+            if self.estado == self.CERRADO:
+                return
+            if self.estado == self.ABIERTO and time.monotonic() >= self.abierto_hasta:
+                self.estado = self.SEMIABIERTO  # esta llamada es la prueba
+                return
+            restante = max(0, int(self.abierto_hasta - time.monotonic()))
+        raise CircuitoAbierto(f"El servicio de IA no está disponible; reintenta en {restante} s.")
+
+    def registrar_exito(self) -> None:
+        with self._lock:
+            self.estado = self.CERRADO
+            self.fallos = 0
+
+    def registrar_fallo(self) -> None:
+        config = _config_resiliencia()
+        with self._lock:
+            self.fallos += 1
+            if self.estado == self.SEMIABIERTO or self.fallos >= config["UMBRAL_FALLOS"]:
+                self.estado = self.ABIERTO
+                self.abierto_hasta = time.monotonic() + config["ENFRIAMIENTO"]
+
+    def reiniciar(self) -> None:
+        with self._lock:
+            self.estado = self.CERRADO
+            self.fallos = 0
+            self.abierto_hasta = 0.0
+
+
+cortacircuitos = Cortacircuitos()
+
+
+def _reiniciar_en_hijo() -> None:
+    # El estado del circuito es por proceso: el hijo de un fork empieza cerrado
+    global cortacircuitos
+    cortacircuitos = Cortacircuitos()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reiniciar_en_hijo)
+
+
+def opciones_llamada() -> dict:
+    # Sin el reintento propio del SDK: los reintentos los controla _con_reintentos
+    return {"timeout": _config_resiliencia()["TIMEOUT"], "retry": None}
+
+
+def _espera(intento: int, config: dict) -> float:
+    """Espera exponencial con jitter completo."""
+    return random.uniform(0, min(config["ESPERA_MAXIMA"], config["ESPERA_BASE"] * 2 ** intento))
+
+
+def _con_reintentos(llamada: Callable[[], Any]) -> Any:
+    config = _config_resiliencia()
+    for intento in range(config["REINTENTOS"] + 1):
+        cortacircuitos.permitir()
+        try:
+            resultado = llamada()
+        except Exception as e:
+            error = clasificar_error(e)
+            if not isinstance(error, ErrorIATransitorio):
+                # El servicio respondió (p. ej. petición inválida): no cuenta como caída
+                cortacircuitos.registrar_exito()
+                raise error from e
+            cortacircuitos.registrar_fallo()
+            if intento == config["REINTENTOS"]:
+                raise error from e
+            time.sleep(_espera(intento, config))
+        else:
+            cortacircuitos.registrar_exito()
+            return resultado
+
+
+async def _con_reintentos_async(llamada: Callable[[], Awaitable[Any]]) -> Any:
+    config = _config_resiliencia()
+    for intento in range(config["REINTENTOS"] + 1):
+        cortacircuitos.permitir()
+        try:
+            resultado = await asyncio.wait_for(llamada(), timeout=config["TIMEOUT"])
+        except Exception as e:
+            error = clasificar_error(e)
+            if not isinstance(error, ErrorIATransitorio):
+                # El servicio respondió (p. ej. petición inválida): no cuenta como caída
+                cortacircuitos.registrar_exito()
+                raise error from e
+            cortacircuitos.registrar_fallo()
+            if intento == config["REINTENTOS"]:
+                raise error from e
+            await asyncio.sleep(_espera(intento, config))
+        else:
+            cortacircuitos.registrar_exito()
+            return resultado
+
+
+def _texto_respuesta(response: Any) -> str:
+    # response.text lanza ValueError si la respuesta fue bloqueada o está vacía
     try:
-        model = genai.GenerativeModel(MODEL)
-        response = model.generate_content(prompt)
         return response.text.strip()
-    except Exception as e:
-        return f"[ERROR] No se pudo generar contenido: {e}"
+    except ValueError as e:
+        raise ErrorIA(f"La IA no devolvió contenido: {e}") from e
+
+# ===== CUOTA DE USO (PETICIONES Y TOKENS POR MINUTO) =====
+#
+# Antes de cada llamada se reserva cuota en el limitador compartido entre
+# procesos (core.limites, settings.IA_LIMITES): si falta poco se espera (la
+# llamada queda en cola) y si no se lanza LimiteExcedido. La llamada se carga
+# también al usuario indicado con `en_nombre_de(usuario_id)`.
+
+
+class LimiteExcedido(ErrorIA):
+    """Se alcanzó el límite de uso (global o del usuario)."""
+
+    def __init__(self, mensaje: str, espera: float):
+        super().__init__(mensaje)
+        self.espera = espera
+
+
+usuario_ia: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("usuario_ia", default=None)
+
+
+@contextmanager
+def en_nombre_de(usuario_id: Optional[int]) -> Iterator[None]:
+    """Carga las llamadas a la IA hechas dentro del bloque a la cuota de este usuario."""
+    token = usuario_ia.set(usuario_id)
+    try:
+        yield
+    finally:
+        usuario_ia.reset(token)
+
 
-def generar_subartefacto_con_prompt(tipo: str, **kwargs) -> str:
+
+def estimar_tokens(prompt: str) -> int:
+    """Tokens de entrada (unos 4 caracteres por token) más la salida esperada."""
+    return len(prompt) // CARACTERES_POR_TOKEN + _ajuste("IA_LIMITES", {}).get("TOKENS_SALIDA", 1024)
+
+
+def estimar_tokens_tipo(tipo: str, **kwargs) -> int:
+    if tipo not in PROMPTS:
+        raise ValueError(f"[ERROR] Tipo de artefacto desconocido: {tipo}")
+    return estimar_tokens(PROMPTS[tipo](**kwargs))
+
+
+def consultar_cuota(tokens: int, usuario: Optional[int] = None) -> Decision:
+    """Decide, sin consumir cuota, si una generación puede hacerse ya, debe esperar o se rechaza."""
+    limitador = obtener_limitador()
+    if limitador is None:
+        return Decision(Decision.PERMITIR)
+    return limitador.consultar(tokens, usuario)
+
+
+def _limite_excedido(decision: Decision) -> LimiteExcedido:
+    if math.isinf(decision.espera):
+        return LimiteExcedido("La llamada supera la cuota de uso de la IA.", decision.espera)
+    return LimiteExcedido(
+        f"Se alcanzó el límite de uso de la IA; reintenta en {math.ceil(decision.espera)} s.", decision.espera
+    )
+
+
+def _reservar_cuota(prompt: str) -> int:
+    """Reserva cuota para el prompt esperando si hace falta; devuelve los tokens reservados."""
+    limitador = obtener_limitador()
+    if limitador is None:
+        return 0
+    tokens = estimar_tokens(prompt)
+    limite = time.monotonic() + limitador.espera_maxima
+    while True:
+        decision = limitador.intentar(tokens, usuario_ia.get())
+        if decision.permitida:
+            return tokens
+        if decision.accion == Decision.RECHAZAR or time.monotonic() + decision.espera > limite:
+            raise _limite_excedido(decision)
+        time.sleep(decision.espera)
+
+
+async def _reservar_cuota_async(prompt: str) -> int:
+    limitador = obtener_limitador()
+    if limitador is None:
+        return 0
+    tokens = estimar_tokens(prompt)
+    usuario = usuario_ia.get()
+    limite = time.monotonic() + limitador.espera_maxima
+    while True:
+        decision = await asyncio.to_thread(limitador.intentar, tokens, usuario)
+        if decision.permitida:
+            return tokens
+        if decision.accion == Decision.RECHAZAR or time.monotonic() + decision.espera > limite:
+            raise _limite_excedido(decision)
+        await asyncio.sleep(decision.espera)
+
+
+def _ajustar_cuota(response: Any, reservados: int) -> None:
+    """Corrige la cuota reservada con los tokens que informó la respuesta."""
+    limitador = obtener_limitador()
+    uso = getattr(response, "usage_metadata", None)
+    reales = getattr(uso, "total_token_count", 0) or 0
+    if limitador is not None and reservados and reales:
+        limitador.ajustar(reales - reservados, usuario_ia.get())
+
+# ===== INSTRUMENTACIÓN =====
+#
+# Cada llamada (o acierto de caché) produce un LlamadaIA con su duración y
+# los tokens que informó Gemini. Los observadores registrados lo reciben al
+# terminar; documentacion lo guarda en LLMCallLog (ver documentacion/apps.py).
+# Un observador no debe bloquear: puede llamarse desde el bucle de eventos.
+
+@dataclass
+class LlamadaIA:
+    tipo: str
+    modelo: str = MODEL
+    usuario: Optional[int] = None
+    cache: bool = False
+    tokens_entrada: int = 0
+    tokens_salida: int = 0
+    latencia: float = 0.0  # segundos
+    error: str = ""        # clase de la excepción si la llamada falló
+
+
+_observadores: List[Callable[[LlamadaIA], None]] = []
+
+
+def registrar_observador(observador: Callable[[LlamadaIA], None]) -> None:
+    if observador not in _observadores:
+        _observadores.append(observador)
+
+
+def quitar_observador(observador: Callable[[LlamadaIA], None]) -> None:
+    if observador in _observadores:
+        _observadores.remove(observador)
+
+
+def _notificar(llamada: LlamadaIA) -> None:
+    for observador in list(_observadores):
+        try:
+            observador(llamada)
+        except Exception:
+            logger.exception("Falló un observador de llamadas a la IA")
+
+
+@contextmanager
+def _medir(tipo: str) -> Iterator[LlamadaIA]:
+    """Mide el bloque y notifica el resultado, haya ido bien o no."""
+    llamada = LlamadaIA(tipo=tipo, usuario=usuario_ia.get())
+    inicio = time.perf_counter()
+    try:
+        yield llamada
+    except BaseException as e:
+        llamada.error = type(e).__name__
+        raise
+    finally:
+        llamada.latencia = time.perf_counter() - inicio
+        _notificar(llamada)
+
+
+def _anotar_uso(llamada: LlamadaIA, response: Any) -> None:
+    uso = getattr(response, "usage_metadata", None)
+    llamada.tokens_entrada = getattr(uso, "prompt_token_count", 0) or 0
+    llamada.tokens_salida = getattr(uso, "candidates_token_count", 0) or 0
+
+
+def _tipo_llamada(tipo: Optional[str], plantilla: Optional[Plantilla]) -> str:
+    return tipo or (plantilla.nombre if plantilla is not None else "otro")
+
+# ===== FUNCIONES DE GENERACIÓN =====
+
+def _generar_contenido(prompt: str, forzar: bool = False, generation_config: Optional[dict] = None,
+                       plantilla: Optional[Plantilla] = None, variables: Optional[dict] = None,
+                       tipo: Optional[str] = None) -> str:
+    """
+    Genera contenido con Gemini. Las respuestas se guardan en la caché
+    configurada; con forzar=True se ignora la entrada guardada y se
+    reemplaza por la nueva respuesta (regeneración explícita).
+    Lanza ErrorIA si no se pudo generar (tras los reintentos).
+    """
+    config = GENERATION_CONFIG if generation_config is None else generation_config
+    cache = obtener_cache()
+    clave = clave_cache(MODEL, prompt, config)
+    with _medir(_tipo_llamada(tipo, plantilla)) as llamada:
+        if cache is not None and not forzar:
+            guardado = cache.obtener(clave)
+            if guardado is not None:
+                llamada.cache = True
+                return guardado
+
+        backend = _backend()
+        reservados = _reservar_cuota(prompt)
+        response = _con_reintentos(
+            lambda: backend.generar(prompt, config, opciones_llamada(), plantilla, variables)
+        )
+        _anotar_uso(llamada, response)
+        texto = _texto_respuesta(response)
+        _ajustar_cuota(response, reservados)
+
+    if cache is not None:
+        cache.guardar(clave, texto)
+    return texto
+
+async def _generar_contenido_async(prompt: str, forzar: bool = False, generation_config: Optional[dict] = None,
+                                   plantilla: Optional[Plantilla] = None, variables: Optional[dict] = None,
+                                   tipo: Optional[str] = None) -> str:
+    """
+    Versión asíncrona de _generar_contenido (generate_content_async). Pensada
+    para vistas async bajo ASGI: la espera de Gemini no ocupa un hilo.
+    """
+    config = GENERATION_CONFIG if generation_config is None else generation_config
+    cache = obtener_cache()
+    clave = clave_cache(MODEL, prompt, config)
+    with _medir(_tipo_llamada(tipo, plantilla)) as llamada:
+        if cache is not None and not forzar:
+            guardado = await asyncio.to_thread(cache.obtener, clave)
+            if guardado is not None:
+                llamada.cache = True
+                return guardado
+
+        backend = _backend()
+        reservados = await _reservar_cuota_async(prompt)
+        response = await _con_reintentos_async(
+            lambda: backend.generar_async(prompt, config, opciones_llamada(), plantilla, variables)
+        )
+        _anotar_uso(llamada, response)
+        texto = _texto_respuesta(response)
+        await asyncio.to_thread(_ajustar_cuota, response, reservados)
+
+    if cache is not None:
+        await asyncio.to_thread(cache.guardar, clave, texto)
+    return texto
+
+def generar_contenido_stream(prompt: str, forzar: bool = False, plantilla: Optional[Plantilla] = None,
+                             variables: Optional[dict] = None) -> Iterator[str]:
+    """
+    Igual que _generar_contenido, pero devuelve el texto por fragmentos a
+    medida que llega del modelo. Al terminar guarda la respuesta completa
+    en la caché; si ya estaba guardada se entrega de una sola vez.
+    Solo se reintenta el inicio de la llamada: si falla a mitad de la
+    respuesta se lanza ErrorIA.
+    """
+    cache = obtener_cache()
+    clave = clave_cache(MODEL, prompt, GENERATION_CONFIG)
+    with _medir(_tipo_llamada(None, plantilla)) as llamada:
+        if cache is not None and not forzar:
+            guardado = cache.obtener(clave)
+            if guardado is not None:
+                llamada.cache = True
+                yield guardado
+                return
+
+        partes = []
+        backend = _backend()
+        reservados = _reservar_cuota(prompt)
+        response = _con_reintentos(
+            lambda: backend.stream(prompt, GENERATION_CONFIG, opciones_llamada(), plantilla, variables)
+        )
+        try:
+            for chunk in response:
+                texto = chunk.text
+                if texto:
+                    partes.append(texto)
+                    yield texto
+        except Exception as e:
+            error = clasificar_error(e)
+            if isinstance(error, ErrorIATransitorio):
+                cortacircuitos.registrar_fallo()
+            raise error from e
+
+        _anotar_uso(llamada, response)
+        _ajustar_cuota(response, reservados)
+        if cache is not None:
+            cache.guardar(clave, "".join(partes).strip())
+
+async def generar_contenido_stream_async(prompt: str, forzar: bool = False, plantilla: Optional[Plantilla] = None,
+                                         variables: Optional[dict] = None) -> AsyncIterator[str]:
+    """Versión asíncrona de generar_contenido_stream."""
+    cache = obtener_cache()
+    clave = clave_cache(MODEL, prompt, GENERATION_CONFIG)
+    with _medir(_tipo_llamada(None, plantilla)) as llamada:
+        if cache is not None and not forzar:
+            guardado = await asyncio.to_thread(cache.obtener, clave)
+            if guardado is not None:
+                llamada.cache = True
+                yield guardado
+                return
+
+        partes = []
+        backend = _backend()
+        reservados = await _reservar_cuota_async(prompt)
+        response = await _con_reintentos_async(
+            lambda: backend.stream_async(prompt, GENERATION_CONFIG, opciones_llamada(), plantilla, variables)
+        )
+        try:
+            async for chunk in response:
+                texto = chunk.text
+                if texto:
+                    partes.append(texto)
+                    yield texto
+        except Exception as e:
+            error = clasificar_error(e)
+            if isinstance(error, ErrorIATransitorio):
+                cortacircuitos.registrar_fallo()
+            raise error from e
+
+        _anotar_uso(llamada, response)
+        await asyncio.to_thread(_ajustar_cuota, response, reservados)
+        if cache is not None:
+            await asyncio.to_thread(cache.guardar, clave, "".join(partes).strip())
+
+def _plantilla(tipo: str) -> Plantilla:
     if tipo not in PROMPTS:
         raise ValueError (f"[ERROR] Tipo de artefacto desconocido: {tipo}")
+    return PROMPTS[tipo]
+
+def generar_subartefacto_con_prompt(tipo: str, forzar: bool = False, **kwargs) -> str:
+    plantilla = _plantilla(tipo)
+    return _generar_contenido(plantilla(**kwargs), forzar=forzar, plantilla=plantilla, variables=kwargs)
+
+async def generar_subartefacto_con_prompt_async(tipo: str, forzar: bool = False, **kwargs) -> str:
+    plantilla = _plantilla(tipo)
+    return await _generar_contenido_async(plantilla(**kwargs), forzar=forzar, plantilla=plantilla, variables=kwargs)
+
+def generar_subartefacto_stream(tipo: str, forzar: bool = False, **kwargs) -> Iterator[str]:
+    plantilla = _plantilla(tipo)
+    return generar_contenido_stream(plantilla(**kwargs), forzar=forzar, plantilla=plantilla, variables=kwargs)
+
+def generar_subartefacto_stream_async(tipo: str, forzar: bool = False, **kwargs) -> AsyncIterator[str]:
+    plantilla = _plantilla(tipo)
+    return generar_contenido_stream_async(plantilla(**kwargs), forzar=forzar, plantilla=plantilla, variables=kwargs)
+
+def version_plantilla(tipo: str) -> str:
+    """Id versionado de la plantilla con la que se genera este tipo de artefacto."""
+    return PROMPTS[tipo].id if tipo in PROMPTS else ""
+
+# ===== GENERACIÓN EN LOTE =====
+#
+# Los artefactos de un mismo proyecto comparten el contexto (descripción y
+# requisitos). En vez de enviarlo una vez por artefacto, se piden varios en
+# una sola llamada con salida JSON (un campo por artefacto); cada resultado
+# se valida y los que fallan se generan por separado.
+
+# Palabra clave con la que debe empezar cada diagrama
+ENCABEZADOS_MERMAID = {
+    "Diagrama de flujo": ("flowchart", "graph"),
+    "Diagrama de clases": ("classDiagram",),
+    "Diagrama de Entidad-Relacion": ("erDiagram",),
+    "Diagrama de secuencia": ("sequenceDiagram",),
+    "Diagrama de estado": ("stateDiagram", "stateDiagram-v2"),
+    "Diagrama de C4-contexto": ("C4Context",),
+    "Diagrama de C4-contenedor": ("C4Container",),
+    "Diagrama de C4-implementación": ("C4Deployment",),
+}
+
+
+def contenido_valido(tipo: str, contenido: str) -> bool:
+    """Comprueba que el contenido no esté vacío y, si es un diagrama, que sea del tipo pedido."""
+    if not contenido:
+        return False
+    encabezados = ENCABEZADOS_MERMAID.get(tipo)
+    if not encabezados:
+        return True
+    for linea in contenido.replace("```mermaid", "").splitlines():
+        linea = linea.strip()
+        if linea and not linea.startswith("%%"):
+            return linea.split()[0] in encabezados
+    return False
+
+
+def _prompt_lote(tipos: List[str], kwargs: Dict[str, str]) -> str:
+    # Los argumentos comunes van una sola vez; cada prompt los cita por su marcador
+    marcadores = {nombre: f"<<{nombre.upper()}>>" for nombre in kwargs}
+    partes = [
+        "Vas a generar varios artefactos de software para el mismo proyecto.\n"
+        "Datos comunes (las instrucciones de cada artefacto se refieren a ellos por su marcador):"
+    ]
+    partes += [f"{marcadores[nombre]}:\n{valor}" for nombre, valor in kwargs.items()]
+    partes += [f"=== a{i}: {tipo} ===\n{PROMPTS[tipo](**marcadores)}" for i, tipo in enumerate(tipos, 1)]
+    partes.append(
+        "Responde en JSON con un campo por artefacto (a1, a2, ...). El valor de cada campo es únicamente "
+        "el contenido que piden sus instrucciones, sin explicaciones ni bloques de código."
+    )
+    return "\n\n".join(partes)
+
+
+def _config_lote(cantidad: int) -> dict:
+    campos = [f"a{i}" for i in range(1, cantidad + 1)]
+    return {
+        "response_mime_type": "application/json",
+        "response_schema": {
+            "type": "object",
+            "properties": {campo: {"type": "string"} for campo in campos},
+            "required": campos,
+        },
+    }
+
+
+def _generar_lote(tipos: List[str], forzar: bool, kwargs: Dict[str, str]) -> Dict[str, str]:
+    """Una llamada para todo el lote; devuelve solo los artefactos válidos."""
+    try:
+        respuesta = _generar_contenido(_prompt_lote(tipos, kwargs), forzar=forzar,
+                                       generation_config=_config_lote(len(tipos)), tipo="lote")
+    except (ErrorIATransitorio, CircuitoAbierto, LimiteExcedido):
+        raise
+    except ErrorIA:
+        # p. ej. respuesta bloqueada: se intenta cada artefacto por separado
+        return {}
+    try:
+        datos = json.loads(respuesta)
+    except ValueError:
+        return {}
+    if not isinstance(datos, dict):
+        return {}
+
+    cache = obtener_cache()
+    validos = {}
+    for i, tipo in enumerate(tipos, 1):
+        contenido = datos.get(f"a{i}")
+        if isinstance(contenido, str) and contenido_valido(tipo, contenido.strip()):
+            validos[tipo] = contenido.strip()
+            # Queda guardado como si se hubiera pedido por separado
+            if cache is not None:
+                cache.guardar(clave_cache(MODEL, PROMPTS[tipo](**kwargs), GENERATION_CONFIG), validos[tipo])
+    return validos
+
+
+def generar_subartefactos_en_lote(tipos: List[str], forzar: bool = False, tamano: Optional[int] = None,
+                                  **kwargs) -> Dict[str, str]:
+    """
+    Genera varios tipos de PROMPTS que reciben los mismos argumentos, en
+    lotes de `tamano` (settings.IA_LOTE_TAMANO). Devuelve {tipo: contenido};
+    los que faltan o no son válidos en la respuesta del lote se generan uno a uno.
+    """
+    for tipo in tipos:
+        if tipo not in PROMPTS:
+            raise ValueError(f"[ERROR] Tipo de artefacto desconocido: {tipo}")
+    tamano = _ajuste("IA_LOTE_TAMANO", 4) if tamano is None else tamano
+
+    resultados: Dict[str, str] = {}
+    cache = obtener_cache()
+    pendientes = []
+    for tipo in tipos:
+        guardado = None
+        if cache is not None and not forzar:
+            guardado = cache.obtener(clave_cache(MODEL, PROMPTS[tipo](**kwargs), GENERATION_CONFIG))
+        if guardado is not None:
+            resultados[tipo] = guardado
+            _notificar(LlamadaIA(tipo=PROMPTS[tipo].nombre, usuario=usuario_ia.get(), cache=True))
+        else:
+            pendientes.append(tipo)
+
+    if tamano > 1:
+        for inicio in range(0, len(pendientes), tamano):
+            lote = pendientes[inicio:inicio + tamano]
+            if len(lote) > 1:
+                resultados.update(_generar_lote(lote, forzar, kwargs))
+
+    for tipo in pendientes:
+        if tipo not in resultados:
+            resultados[tipo] = generar_subartefacto_con_prompt(tipo, forzar=forzar, **kwargs)
+    return {tipo: resultados[tipo] for tipo in tipos}
 
-    prompt_func = PROMPTS[tipo]
-    prompt = prompt_func(**kwargs)
-    return _generar_contenido(prompt)
 #=====  codigo de extrae reqquisitos de la HU=======
-def extraer_requisitos(historia_texto: str) -> str:
-    prompt = (
+def _prompt_requisitos(historia_texto: str) -> str:
+    return (
         "Eres un ingeniero de software especializado en análisis de requisitos.\n"
         "Dada la siguiente lista de historias de usuario, cada una identificada con HU y su número secuencial:\n"
         f"{historia_texto}\n"
@@ -387,5 +683,114 @@ def extraer_requisitos(historia_texto: str) -> str:
         "Cada requisito debe ser claro, específico y estar redactado en tercera persona.\n"
         "Devuelve únicamente la lista de requisitos, uno por línea, sin títulos, numeración adicional ni explicaciones."
     )
-    return _generar_contenido(prompt)
 
+def extraer_requisitos(historia_texto: str, forzar: bool = False) -> str:
+    return _generar_contenido(_prompt_requisitos(historia_texto), forzar=forzar, tipo="requisitos")
+
+async def extraer_requisitos_async(historia_texto: str, forzar: bool = False) -> str:
+    return await _generar_contenido_async(_prompt_requisitos(historia_texto), forzar=forzar, tipo="requisitos")
+
+# ===== ACTUALIZACIÓN POR REQUISITOS =====
+
+def actualizar_subartefacto(tipo: str, contenido: str, anadidos: List[str], eliminados: List[str],
+                            forzar: bool = False) -> Optional[str]:
+    """
+    Ajusta un artefacto ya generado a los requisitos añadidos y eliminados
+    (plantilla PARCHE). Devuelve None si la respuesta no es del tipo pedido:
+    en ese caso hay que generarlo de cero.
+    """
+    variables = {
+        "tipo": tipo,
+        "contenido": contenido,
+        "anadidos": "\n".join(anadidos) or "(ninguno)",
+        "eliminados": "\n".join(eliminados) or "(ninguno)",
+    }
+    texto = _generar_contenido(PARCHE(**variables), forzar=forzar, plantilla=PARCHE, variables=variables)
+    return texto if contenido_valido(tipo, texto.strip()) else None
+
+# ===== HISTORIA DE USUARIO + REQUISITOS =====
+
+# Salida estructurada: historias y requisitos en una sola respuesta JSON
+CONFIG_HU_ESTRUCTURADA = {
+    "response_mime_type": "application/json",
+    "response_schema": {
+        "type": "object",
+        "properties": {
+            "historias": {"type": "string"},
+            "requisitos": {"type": "string"},
+        },
+        "required": ["historias", "requisitos"],
+    },
+}
+
+
+def _prompt_hu_con_requisitos(nombre_proyecto: str, descripcion: str) -> str:
+    return (
+        PROMPTS["Historia de Usuario"](nombre_proyecto=nombre_proyecto, descripcion=descripcion) + "\n\n"
+        "Después, como ingeniero de software especializado en análisis de requisitos, extrae los requisitos "
+        "funcionales clave de esas historias de usuario. Enumera cada requisito como RF seguido del número "
+        "secuencial (RF1, RF2, etc.), uno por línea, claro, específico y redactado en tercera persona.\n"
+        "Responde en JSON con dos campos de texto: 'historias' (las historias de usuario, una por línea) "
+        "y 'requisitos' (la lista de requisitos, uno por línea, sin títulos ni explicaciones)."
+    )
+
+
+def _separar_hu_con_requisitos(respuesta: str) -> Optional[Tuple[str, str]]:
+    try:
+        datos = json.loads(respuesta)
+        historias = datos["historias"].strip()
+        requisitos = datos["requisitos"].strip()
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return None
+    if not historias or not requisitos:
+        return None
+    return historias, requisitos
+
+
+def _hu_estructurada(estructurado: Optional[bool]) -> bool:
+    return _ajuste("IA_HU_ESTRUCTURADA", True) if estructurado is None else estructurado
+
+
+def generar_hu_con_requisitos(nombre_proyecto: str, descripcion: str, forzar: bool = False,
+                              estructurado: Optional[bool] = None) -> Tuple[str, str]:
+    """
+    Genera las historias de usuario y sus requisitos funcionales.
+    En modo estructurado (settings.IA_HU_ESTRUCTURADA) se piden ambas
+    secciones en una sola llamada con salida JSON; si la respuesta no es
+    válida se vuelve al flujo de dos llamadas (HU y luego requisitos).
+    """
+    if _hu_estructurada(estructurado):
+        respuesta = _generar_contenido(
+            _prompt_hu_con_requisitos(nombre_proyecto, descripcion),
+            forzar=forzar,
+            generation_config=CONFIG_HU_ESTRUCTURADA,
+            tipo="historia-usuario+requisitos",
+        )
+        secciones = _separar_hu_con_requisitos(respuesta)
+        if secciones:
+            return secciones
+
+    historias = generar_subartefacto_con_prompt(
+        "Historia de Usuario", forzar=forzar, nombre_proyecto=nombre_proyecto, descripcion=descripcion
+    )
+    return historias, extraer_requisitos(historias, forzar=forzar)
+
+
+async def generar_hu_con_requisitos_async(nombre_proyecto: str, descripcion: str, forzar: bool = False,
+                                          estructurado: Optional[bool] = None) -> Tuple[str, str]:
+    """Versión asíncrona de generar_hu_con_requisitos."""
+    if _hu_estructurada(estructurado):
+        respuesta = await _generar_contenido_async(
+            _prompt_hu_con_requisitos(nombre_proyecto, descripcion),
+            forzar=forzar,
+            generation_config=CONFIG_HU_ESTRUCTURADA,
+            tipo="historia-usuario+requisitos",
+        )
+        secciones = _separar_hu_con_requisitos(respuesta)
+        if secciones:
+            return secciones
+
+    historias = await generar_subartefacto_con_prompt_async(
+        "Historia de Usuario", forzar=forzar, nombre_proyecto=nombre_proyecto, descripcion=descripcion
+    )
+    return historias, await extraer_requisitos_async(historias, forzar=forzar)
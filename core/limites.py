@@ -0,0 +1,288 @@
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from .cache import PrefijoVersionado
+
+# ===== LÍMITE DE USO DE LA IA (TOKEN BUCKET) =====
+#
+# Cada cubeta se llena de forma continua hasta su capacidad (RPM peticiones o
+# TPM tokens por minuto) y cada llamada a Gemini consume de la cubeta global y
+# de la del usuario. El estado se comparte entre procesos (workers de
+# gunicorn, procesar_generaciones) con settings.IA_LIMITES["BACKEND"]:
+#   - "sqlite":  tabla propia en un archivo SQLite (BEGIN IMMEDIATE, atómico)
+#   - "django":  una caché de Django compartida (Redis, Memcached, base de datos)
+#   - "ninguno": sin límites
+
+ESPERA_MAXIMA_POR_DEFECTO = 30
+
+
+@dataclass
+class Cubeta:
+    clave: str
+    capacidad: float
+    por_segundo: float
+    costo: float
+
+
+@dataclass
+class Decision:
+    """Resultado de consultar la cuota: permitir, encolar (esperar) o rechazar."""
+    PERMITIR = "permitir"
+    ENCOLAR = "encolar"
+    RECHAZAR = "rechazar"
+
+    accion: str
+    espera: float = 0.0
+    motivo: str = ""
+
+    @property
+    def permitida(self) -> bool:
+        return self.accion == self.PERMITIR
+
+
+def cubetas_para(limites: dict, tokens: int, usuario: Optional[Any] = None) -> List[Cubeta]:
+    """Cubetas (global y del usuario) que consume una llamada de `tokens` tokens."""
+    cubetas = []
+    ambitos = [("global", limites.get("GLOBAL", {}))]
+    if usuario is not None:
+        ambitos.append((f"usuario:{usuario}", limites.get("USUARIO", {})))
+    for ambito, cuotas in ambitos:
+        if cuotas.get("RPM"):
+            cubetas.append(Cubeta(f"{ambito}:rpm", cuotas["RPM"], cuotas["RPM"] / 60, 1))
+        if cuotas.get("TPM"):
+            cubetas.append(Cubeta(f"{ambito}:tpm", cuotas["TPM"], cuotas["TPM"] / 60, tokens))
+    return cubetas
+
+
+def _rellenar(cubeta: Cubeta, estado: Optional[Tuple[float, float]], ahora: float) -> float:
+    if estado is None:
+        return cubeta.capacidad
+    tokens, actualizado = estado
+    return min(cubeta.capacidad, tokens + max(0.0, ahora - actualizado) * cubeta.por_segundo)
+
+
+def _espera_necesaria(cubetas: List[Cubeta], disponibles: Dict[str, float]) -> Tuple[float, str]:
+    """Segundos hasta que todas las cubetas tengan saldo (inf si nunca lo tendrán)."""
+    espera, motivo = 0.0, ""
+    for cubeta in cubetas:
+        if cubeta.costo > cubeta.capacidad:
+            return math.inf, cubeta.clave
+        faltan = cubeta.costo - disponibles[cubeta.clave]
+        if faltan > 0 and faltan / cubeta.por_segundo > espera:
+            espera, motivo = faltan / cubeta.por_segundo, cubeta.clave
+    return espera, motivo
+
+
+class BackendLimites:
+    """Interfaz común: consulta y consume varias cubetas de forma atómica."""
+
+    def tomar(self, cubetas: List[Cubeta], consumir: bool = True,
+              forzar: bool = False) -> Tuple[float, str]:
+        """
+        Devuelve (espera, motivo). Si no hay que esperar y `consumir` es True
+        descuenta el costo de todas las cubetas. Con `forzar` descuenta siempre
+        (el saldo puede quedar negativo: se usa para ajustar con el uso real).
+        """
+        raise NotImplementedError
+
+    def limpiar(self) -> None:
+        raise NotImplementedError
+
+
+class LimitesSQLite(BackendLimites):
+    def __init__(self, ruta: Any):
+        self.ruta = str(ruta)
+        self._local = threading.local()
+        self._pid = os.getpid()
+
+    def _conexion(self) -> sqlite3.Connection:
+        # Una conexión por hilo; tras un fork se abre una nueva
+        conexion = getattr(self._local, "conexion", None)
+        if conexion is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            conexion = sqlite3.connect(self.ruta, timeout=10, isolation_level=None)
+            conexion.execute(
+                "CREATE TABLE IF NOT EXISTS limites_ia ("
+                " clave TEXT PRIMARY KEY,"
+                " tokens REAL NOT NULL,"
+                " actualizado REAL NOT NULL)"
+            )
+            self._local.conexion = conexion
+        return conexion
+
+    def tomar(self, cubetas: List[Cubeta], consumir: bool = True,
+              forzar: bool = False) -> Tuple[float, str]:
+        conexion = self._conexion()
+        ahora = time.time()
+        conexion.execute("BEGIN IMMEDIATE")
+        try:
+            disponibles = {}
+            for cubeta in cubetas:
+                fila = conexion.execute(
+                    "SELECT tokens, actualizado FROM limites_ia WHERE clave = ?", (cubeta.clave,)
+                ).fetchone()
+                disponibles[cubeta.clave] = _rellenar(cubeta, fila, ahora)
+
+            espera, motivo = (0.0, "") if forzar else _espera_necesaria(cubetas, disponibles)
+            if espera == 0 and (consumir or forzar):
+                conexion.executemany(
+                    "INSERT OR REPLACE INTO limites_ia (clave, tokens, actualizado) VALUES (?, ?, ?)",
+                    [(c.clave, disponibles[c.clave] - c.costo, ahora) for c in cubetas],
+                )
+            conexion.execute("COMMIT")
+        except BaseException:
+            conexion.execute("ROLLBACK")
+            raise
+        return espera, motivo
+
+    def limpiar(self) -> None:
+        self._conexion().execute("DELETE FROM limites_ia")
+
+
+class LimitesDjango(BackendLimites):
+    """
+    Guarda las cubetas en una caché de Django. Como la caché no tiene
+    transacciones, se serializa con un cerrojo creado con cache.add(). El
+    cerrojo caduca solo a los 5 s (por si su dueño murió); guarda un testigo
+    propio para no soltar después el que ya haya tomado otro proceso.
+    """
+
+    PREFIJO = "ia-limite:"
+    CADUCIDAD_CERROJO = 5
+
+    def __init__(self, alias: str = "default"):
+        self.alias = alias
+        self._prefijo = PrefijoVersionado(alias, self.PREFIJO)
+
+    @property
+    def _cache(self):
+        return self._prefijo.cache
+
+    def tomar(self, cubetas: List[Cubeta], consumir: bool = True,
+              forzar: bool = False) -> Tuple[float, str]:
+        cache = self._cache
+        cerrojo = self.PREFIJO + "cerrojo"
+        testigo = uuid.uuid4().hex
+        limite = time.monotonic() + self.CADUCIDAD_CERROJO
+        while not cache.add(cerrojo, testigo, timeout=self.CADUCIDAD_CERROJO):
+            if time.monotonic() > limite:
+                testigo = None  # cerrojo huérfano: se sigue sin él y no se suelta
+                break
+            time.sleep(0.01)
+        try:
+            ahora = time.time()
+            prefijo = self._prefijo.prefijo()
+            claves = [prefijo + c.clave for c in cubetas]
+            guardado = cache.get_many(claves)
+            disponibles = {
+                c.clave: _rellenar(c, tuple(json.loads(guardado[k])) if k in guardado else None, ahora)
+                for c, k in zip(cubetas, claves)
+            }
+            espera, motivo = (0.0, "") if forzar else _espera_necesaria(cubetas, disponibles)
+            if espera == 0 and (consumir or forzar):
+                cache.set_many({
+                    k: json.dumps([disponibles[c.clave] - c.costo, ahora]) for c, k in zip(cubetas, claves)
+                }, timeout=None)
+        finally:
+            # La caché no compara y borra a la vez: queda una ventana mínima entre get y delete
+            if testigo is not None and cache.get(cerrojo) == testigo:
+                cache.delete(cerrojo)
+        return espera, motivo
+
+    def limpiar(self) -> None:
+        """Solo las cubetas: el resto de la caché de Django no se toca."""
+        self._prefijo.vaciar()
+
+
+class Limitador:
+    """Aplica IA_LIMITES sobre un backend compartido."""
+
+    def __init__(self, backend: BackendLimites, limites: dict):
+        self.backend = backend
+        self.limites = limites
+        self.espera_maxima = limites.get("ESPERA_MAXIMA", ESPERA_MAXIMA_POR_DEFECTO)
+
+    def consultar(self, tokens: int, usuario: Optional[Any] = None) -> Decision:
+        """Decide sin consumir: permitir ya, encolar (esperar) o rechazar."""
+        espera, motivo = self.backend.tomar(cubetas_para(self.limites, tokens, usuario), consumir=False)
+        if espera == 0:
+            return Decision(Decision.PERMITIR)
+        if espera <= self.espera_maxima:
+            return Decision(Decision.ENCOLAR, espera, motivo)
+        return Decision(Decision.RECHAZAR, espera, motivo)
+
+    def intentar(self, tokens: int, usuario: Optional[Any] = None) -> Decision:
+        """Como consultar, pero si está permitida consume la cuota."""
+        espera, motivo = self.backend.tomar(cubetas_para(self.limites, tokens, usuario))
+        if espera == 0:
+            return Decision(Decision.PERMITIR)
+        accion = Decision.ENCOLAR if espera <= self.espera_maxima else Decision.RECHAZAR
+        return Decision(accion, espera, motivo)
+
+    def ajustar(self, tokens: int, usuario: Optional[Any] = None) -> None:
+        """Descuenta (o devuelve, si es negativo) tokens según el uso real de la llamada."""
+        if not tokens:
+            return
+        cubetas = [c for c in cubetas_para(self.limites, tokens, usuario) if c.clave.endswith(":tpm")]
+        if cubetas:
+            self.backend.tomar(cubetas, forzar=True)
+
+
+BACKENDS = {
+    "sqlite": LimitesSQLite,
+    "django": LimitesDjango,
+}
+
+_limitador: Optional[Limitador] = None
+_limitador_cargado = False
+_lock = threading.Lock()
+
+
+def _configuracion() -> dict:
+    try:
+        from django.conf import settings
+        if settings.configured:
+            return dict(getattr(settings, "IA_LIMITES", {}))
+    except ImportError:
+        pass
+    return {}
+
+
+def construir_limitador(configuracion: dict) -> Optional[Limitador]:
+    nombre = configuracion.get("BACKEND", "ninguno")
+    if not nombre or nombre == "ninguno":
+        return None
+    if nombre not in BACKENDS:
+        raise ValueError(f"Backend de límites desconocido: {nombre}")
+
+    if nombre == "sqlite":
+        backend: BackendLimites = LimitesSQLite(configuracion["RUTA"])
+    else:
+        backend = LimitesDjango(configuracion.get("ALIAS", "default"))
+    return Limitador(backend, configuracion)
+
+
+def obtener_limitador() -> Optional[Limitador]:
+    """Devuelve el limitador configurado (o None si no hay límites)."""
+    global _limitador, _limitador_cargado
+    if not _limitador_cargado:
+        with _lock:
+            if not _limitador_cargado:
+                _limitador = construir_limitador(_configuracion())
+                _limitador_cargado = True
+    return _limitador
+
+
+def reiniciar_limitador() -> None:
+    """Olvida el limitador construido; se vuelve a leer la configuración al usarlo."""
+    global _limitador, _limitador_cargado
+    with _lock:
+        _limitador = None
+        _limitador_cargado = False
@@ -0,0 +1,597 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from datetime import timedelta
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple, Type
+
+from core.cache import clave_cache, obtener_cache
+from core.prompts import Plantilla
+
+if TYPE_CHECKING:
+    import google.generativeai as genai
+
+logger = logging.getLogger(__name__)
+
+# ===== PROVEEDORES DE IA =====
+#
+# core.ia no llama directamente a un SDK: pide el texto al backend elegido
+# con settings.IA_BACKEND["NOMBRE"]:
+#   - "gemini": Google Gemini (google.generativeai)
+#   - "local":  sin red; reproduce respuestas grabadas (o las simula) con una
+#               latencia configurable, para pruebas de carga y desarrollo
+#
+# Las respuestas tienen la forma de las de Gemini: `.text` y `.usage_metadata`
+# (prompt_token_count, candidates_token_count, total_token_count). En
+# streaming se devuelve un iterable de fragmentos con `.text` que, una vez
+# recorrido, también tiene `.usage_metadata`.
+#
+# Los lotes (varios artefactos en una sola llamada con salida JSON) y la
+# estimación de tokens para la cuota los resuelve core.ia igual para todos
+# los backends: solo necesitan generar y stream.
+
+MODELO_POR_DEFECTO = "models/gemini-2.0-flash"
+CARACTERES_POR_TOKEN = 4
+
+
+class BackendNoDisponible(Exception):
+    """El backend no se puede usar (p. ej. falta la clave de API)."""
+
+
+class BackendIA:
+    """Interfaz común de los proveedores de IA."""
+
+    nombre = ""
+    errores_transitorios: Tuple[Type[BaseException], ...] = ()  # se reintentan
+    errores_tiempo: Tuple[Type[BaseException], ...] = ()
+
+    def __init__(self, modelo: str = MODELO_POR_DEFECTO):
+        self.modelo = modelo
+
+    def generar(self, prompt: str, config: dict, opciones: dict,
+                plantilla: Optional[Plantilla] = None, variables: Optional[dict] = None) -> Any:
+        raise NotImplementedError
+
+    async def generar_async(self, prompt: str, config: dict, opciones: dict,
+                            plantilla: Optional[Plantilla] = None, variables: Optional[dict] = None) -> Any:
+        return await asyncio.to_thread(self.generar, prompt, config, opciones, plantilla, variables)
+
+    def stream(self, prompt: str, config: dict, opciones: dict,
+               plantilla: Optional[Plantilla] = None, variables: Optional[dict] = None) -> Any:
+        raise NotImplementedError
+
+    async def stream_async(self, prompt: str, config: dict, opciones: dict,
+                           plantilla: Optional[Plantilla] = None, variables: Optional[dict] = None) -> Any:
+        raise NotImplementedError
+
+    def reiniciar(self) -> None:
+        """Descarta el estado del proceso (se llama en el hijo tras un fork)."""
+
+    def precalentar(self) -> None:
+        """Prepara lo costoso de la primera llamada (importaciones, clientes)."""
+
+# ===== GRABACIONES =====
+#
+# El backend gemini puede guardar cada respuesta (IA_BACKEND["GRABAR"]) para
+# que el backend local la reproduzca después. La clave es la misma que la de
+# la caché de respuestas: (modelo, prompt completo, parámetros).
+
+class Grabaciones:
+    def __init__(self, ruta: Any):
+        self.ruta = str(ruta)
+        self._local = threading.local()
+        self._pid = os.getpid()
+
+    def _conexion(self) -> sqlite3.Connection:
+        conexion = getattr(self._local, "conexion", None)
+        if conexion is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            conexion = sqlite3.connect(self.ruta, timeout=10, isolation_level=None)
+            conexion.execute(
+                "CREATE TABLE IF NOT EXISTS grabaciones_ia ("
+                " clave TEXT PRIMARY KEY,"
+                " texto TEXT NOT NULL,"
+                " tokens_entrada INTEGER NOT NULL,"
+                " tokens_salida INTEGER NOT NULL)"
+            )
+            self._local.conexion = conexion
+        return conexion
+
+    def obtener(self, clave: str) -> Optional[Tuple[str, int, int]]:
+        return self._conexion().execute(
+            "SELECT texto, tokens_entrada, tokens_salida FROM grabaciones_ia WHERE clave = ?", (clave,)
+        ).fetchone()
+
+    def guardar(self, clave: str, texto: str, tokens_entrada: int, tokens_salida: int) -> None:
+        self._conexion().execute(
+            "INSERT OR REPLACE INTO grabaciones_ia (clave, texto, tokens_entrada, tokens_salida) VALUES (?, ?, ?, ?)",
+            (clave, texto, tokens_entrada, tokens_salida),
+        )
+
+
+def _tokens(respuesta: Any) -> Tuple[int, int]:
+    uso = getattr(respuesta, "usage_metadata", None)
+    return getattr(uso, "prompt_token_count", 0) or 0, getattr(uso, "candidates_token_count", 0) or 0
+
+
+class _StreamGrabado:
+    """Recorre el stream de Gemini y, al terminar, graba el texto completo."""
+
+    def __init__(self, respuesta: Any, grabar):
+        self._respuesta = respuesta
+        self._grabar = grabar
+
+    @property
+    def usage_metadata(self) -> Any:
+        return getattr(self._respuesta, "usage_metadata", None)
+
+    def __iter__(self) -> Iterator[Any]:
+        partes = []
+        for fragmento in self._respuesta:
+            partes.append(fragmento.text)
+            yield fragmento
+        self._grabar("".join(partes), self._respuesta)
+
+    async def __aiter__(self) -> AsyncIterator[Any]:
+        partes = []
+        async for fragmento in self._respuesta:
+            partes.append(fragmento.text)
+            yield fragmento
+        self._grabar("".join(partes), self._respuesta)
+
+# ===== GEMINI =====
+#
+# Los GenerativeModel y sus clientes (canal gRPC o sesión HTTP) se crean una
+# vez por proceso y se reutilizan entre peticiones e hilos. El pool tiene
+# IA_CLIENTES["CONEXIONES"] clientes que se reparten por turnos; las llamadas
+# asíncronas tienen su propio pool por bucle de eventos (un canal grpc.aio
+# queda atado al bucle en que se creó). Tras un fork (gunicorn prefork) el
+# proceso hijo descarta lo heredado y crea lo suyo.
+#
+# Los clientes se crean con los constructores públicos de
+# google.ai.generativelanguage, pero GenerativeModel no admite que se le pase
+# uno: se asignan a sus atributos _client y _async_client, que el SDK rellena
+# él mismo si están vacíos. Por eso requirements.txt fija google-generativeai;
+# al subir de versión hay que comprobar que GenerativeModel los sigue usando.
+#
+# Con settings.IA_CACHE_CONTEXTO["ACTIVO"] las instrucciones de cada
+# plantilla se suben una vez como CachedContent y cada llamada envía solo la
+# parte variable. El nombre del contenido se comparte entre procesos a través
+# de la caché de respuestas. Si el proveedor no lo acepta (p. ej. por debajo
+# de su mínimo de tokens) se sigue enviando el prompt completo.
+
+REINTENTO_CONTEXTO = 600  # segundos antes de volver a intentar un contexto que falló
+
+# google.generativeai (con grpc y protobuf) tarda en importarse y crea hilos
+# y canales que no sobreviven a un fork, así que no se importa al cargar el
+# módulo sino al construir el backend, en la primera generación del proceso
+# (o en precalentar(), ver gunicorn.conf.py).
+
+
+class BackendGemini(BackendIA):
+    nombre = "gemini"
+
+    def __init__(self, modelo: str = MODELO_POR_DEFECTO, api_key: Optional[str] = None,
+                 transporte: Optional[str] = None, conexiones: int = 1,
+                 grabaciones: Optional[Grabaciones] = None):
+        super().__init__(modelo)
+        if not api_key:
+            raise BackendNoDisponible("La clave de API GEMINI_API_KEY no está configurada.")
+        from google.api_core import exceptions as google_exceptions
+
+        self.errores_transitorios = (
+            google_exceptions.TooManyRequests,
+            google_exceptions.ResourceExhausted,
+            google_exceptions.InternalServerError,
+            google_exceptions.ServiceUnavailable,
+            google_exceptions.BadGateway,
+        )
+        self.errores_tiempo = (google_exceptions.DeadlineExceeded,)
+        self.api_key = api_key
+        self.transporte = transporte
+        self.conexiones = max(1, int(conexiones))
+        self.grabaciones = grabaciones
+        self._turno = itertools.count()
+        self.reiniciar()
+
+    def reiniciar(self) -> None:
+        import google.generativeai as genai
+
+        self._lock = threading.Lock()
+        self._modelos: Dict[Tuple[str, str], List[Any]] = {}
+        self._clientes: List[Any] = []
+        self._modelos_async: Dict[asyncio.AbstractEventLoop, Dict[str, List[Any]]] = {}
+        self._contextos: Dict[str, Tuple[Optional["genai.GenerativeModel"], float]] = {}
+        genai.configure(api_key=self.api_key, transport=self.transporte or None)
+
+    def precalentar(self) -> None:
+        self.obtener_modelo()
+
+    def _nuevo_cliente(self, asincrono: bool = False) -> Any:
+        from google.ai import generativelanguage as glm
+
+        if asincrono:
+            # Siempre grpc_asyncio (el de por defecto): el SDK no tiene cliente asíncrono REST
+            return glm.GenerativeServiceAsyncClient(client_options={"api_key": self.api_key})
+        return glm.GenerativeServiceClient(client_options={"api_key": self.api_key},
+                                           transport=self.transporte or None)
+
+    def _pool_clientes(self) -> List[Any]:
+        # Se llama con self._lock tomado
+        if not self._clientes:
+            self._clientes = [self._nuevo_cliente() for _ in range(self.conexiones)]
+        return self._clientes
+
+    def obtener_modelo(self, generation_config: Optional[dict] = None) -> "genai.GenerativeModel":
+        """Devuelve un GenerativeModel ya construido para la configuración de generación."""
+        import google.generativeai as genai
+
+        config = generation_config or {}
+        clave = (self.modelo, json.dumps(config, sort_keys=True))
+        modelos = self._modelos.get(clave)
+        if modelos is None:
+            with self._lock:
+                modelos = self._modelos.get(clave)
+                if modelos is None:
+                    modelos = []
+                    for cliente in self._pool_clientes():
+                        modelo = genai.GenerativeModel(self.modelo, generation_config=config or None)
+                        modelo._client = cliente
+                        modelos.append(modelo)
+                    self._modelos[clave] = modelos
+        return modelos[next(self._turno) % len(modelos)]
+
+    def obtener_modelo_async(self, generation_config: Optional[dict] = None) -> "genai.GenerativeModel":
+        """Como obtener_modelo, con clientes asíncronos del bucle de eventos en curso."""
+        import google.generativeai as genai
+
+        bucle = asyncio.get_running_loop()
+        config = generation_config or {}
+        clave = json.dumps(config, sort_keys=True)
+        with self._lock:
+            por_config = self._modelos_async.get(bucle)
+            if por_config is None:
+                # Los de bucles ya cerrados (p. ej. asyncio.run en un comando) no se pueden reutilizar
+                for cerrado in [b for b in self._modelos_async if b.is_closed()]:
+                    del self._modelos_async[cerrado]
+                por_config = self._modelos_async[bucle] = {}
+            modelos = por_config.get(clave)
+            if modelos is None:
+                # Los clientes del bucle se comparten entre configuraciones, como en el pool síncrono
+                clientes = [m._async_client for m in next(iter(por_config.values()), [])]
+                clientes = clientes or [self._nuevo_cliente(asincrono=True) for _ in range(self.conexiones)]
+                modelos = []
+                for cliente in clientes:
+                    modelo = genai.GenerativeModel(self.modelo, generation_config=config or None)
+                    modelo._async_client = cliente
+                    modelos.append(modelo)
+                por_config[clave] = modelos
+        return modelos[next(self._turno) % len(modelos)]
+
+    def _config_contexto(self) -> dict:
+        return {"ACTIVO": False, "MODELO": self.modelo, "TTL": 3600, "MIN_TOKENS": 1024,
+                **_configuracion("IA_CACHE_CONTEXTO")}
+
+    def _crear_contexto(self, plantilla: Plantilla, config: dict) -> Tuple[Optional["genai.GenerativeModel"], float]:
+        import google.generativeai as genai
+        from google.generativeai import caching
+
+        cache = obtener_cache()
+        clave = clave_cache(config["MODELO"], plantilla.instrucciones, {"contexto": plantilla.id})
+        try:
+            contenido = None
+            nombre = cache.obtener(clave) if cache is not None else None
+            if nombre:
+                try:
+                    contenido = caching.CachedContent.get(nombre)
+                except Exception:
+                    contenido = None  # expiró o fue borrado: se crea otro
+            if contenido is None:
+                contenido = caching.CachedContent.create(
+                    model=config["MODELO"],
+                    display_name=plantilla.id,
+                    system_instruction=plantilla.instrucciones,
+                    ttl=timedelta(seconds=config["TTL"]),
+                )
+                if cache is not None:
+                    cache.guardar(clave, contenido.name)
+            expira = time.time() + config["TTL"]
+            if getattr(contenido, "expire_time", None):
+                expira = min(expira, contenido.expire_time.timestamp())
+            return genai.GenerativeModel.from_cached_content(contenido), expira - 60
+        except Exception as e:
+            logger.warning("No se pudo usar la caché de contexto para %s: %s", plantilla.id, e)
+            return None, time.time() + REINTENTO_CONTEXTO
+
+    def modelo_con_contexto(self, plantilla: Plantilla) -> Optional["genai.GenerativeModel"]:
+        """Modelo ligado al CachedContent de la plantilla, o None si no se usa caché de contexto."""
+        config = self._config_contexto()
+        if not config["ACTIVO"] or len(plantilla.instrucciones) // CARACTERES_POR_TOKEN < config["MIN_TOKENS"]:
+            return None
+        guardado = self._contextos.get(plantilla.id)
+        if guardado is None or guardado[1] <= time.time():
+            with self._lock:
+                guardado = self._contextos.get(plantilla.id)
+                if guardado is None or guardado[1] <= time.time():
+                    guardado = self._crear_contexto(plantilla, config)
+                    self._contextos[plantilla.id] = guardado
+        return guardado[0]
+
+    def _preparar(self, prompt: str, config: dict, plantilla: Optional[Plantilla],
+                  variables: Optional[dict]) -> Tuple["genai.GenerativeModel", str]:
+        """Modelo y texto a enviar: solo la parte variable si la plantilla tiene su contexto en caché."""
+        if plantilla is not None and not config:
+            modelo = self.modelo_con_contexto(plantilla)
+            if modelo is not None:
+                return modelo, plantilla.parte_variable(**(variables or {}))
+        return self.obtener_modelo(config), prompt
+
+    async def _preparar_async(self, prompt: str, config: dict, plantilla: Optional[Plantilla],
+                              variables: Optional[dict]) -> Tuple["genai.GenerativeModel", str]:
+        if plantilla is not None and not config:
+            # Crear el CachedContent es una llamada bloqueante: en un hilo
+            modelo = await asyncio.to_thread(self.modelo_con_contexto, plantilla)
+            if modelo is not None:
+                return modelo, plantilla.parte_variable(**(variables or {}))
+        return self.obtener_modelo_async(config), prompt
+
+    def _grabador(self, prompt: str, config: dict):
+        def grabar(texto: str, respuesta: Any) -> None:
+            try:
+                self.grabaciones.guardar(clave_cache(self.modelo, prompt, config), texto.strip(), *_tokens(respuesta))
+            except Exception as e:
+                logger.warning("No se pudo grabar la respuesta: %s", e)
+        return grabar
+
+    def generar(self, prompt, config, opciones, plantilla=None, variables=None):
+        modelo, contenido = self._preparar(prompt, config, plantilla, variables)
+        respuesta = modelo.generate_content(contenido, request_options=opciones)
+        if self.grabaciones is not None:
+            try:
+                self._grabador(prompt, config)(respuesta.text, respuesta)
+            except ValueError:
+                pass  # respuesta bloqueada: no se graba
+        return respuesta
+
+    async def generar_async(self, prompt, config, opciones, plantilla=None, variables=None):
+        modelo, contenido = await self._preparar_async(prompt, config, plantilla, variables)
+        respuesta = await modelo.generate_content_async(contenido, request_options=opciones)
+        if self.grabaciones is not None:
+            try:
+                await asyncio.to_thread(self._grabador(prompt, config), respuesta.text, respuesta)
+            except ValueError:
+                pass
+        return respuesta
+
+    def stream(self, prompt, config, opciones, plantilla=None, variables=None):
+        modelo, contenido = self._preparar(prompt, config, plantilla, variables)
+        respuesta = modelo.generate_content(contenido, stream=True, request_options=opciones)
+        if self.grabaciones is not None:
+            return _StreamGrabado(respuesta, self._grabador(prompt, config))
+        return respuesta
+
+    async def stream_async(self, prompt, config, opciones, plantilla=None, variables=None):
+        modelo, contenido = await self._preparar_async(prompt, config, plantilla, variables)
+        respuesta = await modelo.generate_content_async(contenido, stream=True, request_options=opciones)
+        if self.grabaciones is not None:
+            return _StreamGrabado(respuesta, self._grabador(prompt, config))
+        return respuesta
+
+# ===== LOCAL (SIN RED) =====
+#
+# Reproduce la respuesta grabada para la clave de la llamada o, si no hay,
+# genera una determinista (misma llamada → mismo texto) de unos TAMANO
+# caracteres: un diagrama del tipo que pide el prompt, texto o JSON si se
+# pidió salida estructurada. Espera LATENCIA segundos (± VARIACION) como si
+# respondiera el servicio y falla con ERRORES de probabilidad para probar
+# los reintentos y el cortacircuitos.
+
+ENCABEZADOS_SIMULADOS = (
+    "classDiagram", "erDiagram", "sequenceDiagram", "stateDiagram-v2",
+    "flowchart", "C4Context", "C4Container", "C4Deployment",
+)
+
+
+class ErrorSimulado(Exception):
+    """Fallo pasajero simulado por el backend local."""
+
+
+class UsoLocal:
+    def __init__(self, entrada: int, salida: int):
+        self.prompt_token_count = entrada
+        self.candidates_token_count = salida
+        self.total_token_count = entrada + salida
+
+
+class RespuestaLocal:
+    def __init__(self, texto: str, uso: Optional[UsoLocal] = None):
+        self.text = texto
+        self.usage_metadata = uso
+
+
+class _StreamLocal:
+    def __init__(self, texto: str, uso: UsoLocal, espera: float, fragmento: int = 200):
+        self._partes = [texto[i:i + fragmento] for i in range(0, len(texto), fragmento)] or [""]
+        self._uso = uso
+        self._espera = espera / len(self._partes)
+        self.usage_metadata: Optional[UsoLocal] = None
+
+    def __iter__(self) -> Iterator[RespuestaLocal]:
+        for parte in self._partes:
+            time.sleep(self._espera)
+            yield RespuestaLocal(parte)
+        self.usage_metadata = self._uso
+
+    async def __aiter__(self) -> AsyncIterator[RespuestaLocal]:
+        for parte in self._partes:
+            await asyncio.sleep(self._espera)
+            yield RespuestaLocal(parte)
+        self.usage_metadata = self._uso
+
+
+def texto_simulado(prompt: str, tamano: int, azar: random.Random) -> str:
+    """Texto determinista de unos `tamano` caracteres con la forma que pide el prompt."""
+    encontrados = [(prompt.find(e), e) for e in ENCABEZADOS_SIMULADOS if e in prompt]
+    if not encontrados:
+        lineas = []
+        while sum(len(l) + 1 for l in lineas) < tamano:
+            n = len(lineas) + 1
+            lineas.append(f"HU{n}: Como usuario quiero registrar la operación {azar.randint(1, 999)} "
+                          f"para llevar el control del sistema.")
+        return "\n".join(lineas)
+
+    encabezado = min(encontrados)[1]
+    lineas = [encabezado]
+    while sum(len(l) + 1 for l in lineas) < tamano:
+        n = len(lineas)
+        if encabezado == "classDiagram":
+            lineas.append(f"  class Clase{n} {{\n    +int id\n    +guardar() bool\n  }}")
+            lineas.append(f"  Clase{n} --> Clase{azar.randint(1, n)} : usa")
+        elif encabezado == "flowchart":
+            lineas.append(f"  P{n}[Paso {n}] --> P{azar.randint(1, n + 1)}")
+        else:
+            lineas.append(f"  %% elemento {n}")
+    return "\n".join(lineas)
+
+
+class BackendLocal(BackendIA):
+    nombre = "local"
+    errores_transitorios = (ErrorSimulado,)
+
+    def __init__(self, modelo: str = MODELO_POR_DEFECTO, grabaciones: Optional[Grabaciones] = None,
+                 latencia: float = 0.5, variacion: float = 0.2, tamano: int = 2000, errores: float = 0.0):
+        super().__init__(modelo)
+        self.grabaciones = grabaciones
+        self.latencia = latencia
+        self.variacion = variacion
+        self.tamano = tamano
+        self.errores = errores
+
+    def _responder(self, prompt: str, config: dict) -> Tuple[str, UsoLocal, float]:
+        clave = clave_cache(self.modelo, prompt, config)
+        azar = random.Random(clave)
+        espera = max(0.0, self.latencia * (1 + azar.uniform(-self.variacion, self.variacion)))
+        if self.errores and random.random() < self.errores:
+            time.sleep(espera / 2)
+            raise ErrorSimulado("Servicio simulado no disponible (503).")
+
+        grabada = self.grabaciones.obtener(clave) if self.grabaciones is not None else None
+        if grabada is not None:
+            texto, entrada, salida = grabada
+            return texto, UsoLocal(entrada, salida), espera
+
+        esquema = (config or {}).get("response_schema")
+        if esquema:
+            texto = json.dumps({campo: texto_simulado(prompt, self.tamano, azar)
+                                for campo in esquema.get("properties", {})}, ensure_ascii=False)
+        else:
+            texto = texto_simulado(prompt, self.tamano, azar)
+        return texto, UsoLocal(len(prompt) // CARACTERES_POR_TOKEN, len(texto) // CARACTERES_POR_TOKEN), espera
+
+    def generar(self, prompt, config, opciones, plantilla=None, variables=None):
+        texto, uso, espera = self._responder(prompt, config)
+        time.sleep(espera)
+        return RespuestaLocal(texto, uso)
+
+    async def generar_async(self, prompt, config, opciones, plantilla=None, variables=None):
+        texto, uso, espera = self._responder(prompt, config)
+        await asyncio.sleep(espera)
+        return RespuestaLocal(texto, uso)
+
+    def stream(self, prompt, config, opciones, plantilla=None, variables=None):
+        return _StreamLocal(*self._responder(prompt, config))
+
+    async def stream_async(self, prompt, config, opciones, plantilla=None, variables=None):
+        return _StreamLocal(*self._responder(prompt, config))
+
+# ===== BACKEND CONFIGURADO =====
+
+BACKENDS = {
+    "gemini": BackendGemini,
+    "local": BackendLocal,
+}
+
+_backend: Optional[BackendIA] = None
+_lock = threading.Lock()
+
+
+def _configuracion(nombre: str) -> dict:
+    try:
+        from django.conf import settings
+        if settings.configured:
+            return dict(getattr(settings, nombre, {}))
+    except ImportError:
+        pass
+    return {}
+
+
+def construir_backend(configuracion: dict) -> BackendIA:
+    nombre = configuracion.get("NOMBRE", "gemini")
+    if nombre not in BACKENDS:
+        raise ValueError(f"Backend de IA desconocido: {nombre}")
+
+    modelo = configuracion.get("MODELO", MODELO_POR_DEFECTO)
+    ruta = configuracion.get("GRABACIONES")
+    if nombre == "gemini":
+        clientes = _configuracion("IA_CLIENTES")
+        return BackendGemini(
+            modelo,
+            api_key=os.getenv("GEMINI_API_KEY"),
+            transporte=clientes.get("TRANSPORTE"),
+            conexiones=clientes.get("CONEXIONES", 1),
+            grabaciones=Grabaciones(ruta) if ruta and configuracion.get("GRABAR") else None,
+        )
+    return BackendLocal(
+        modelo,
+        grabaciones=Grabaciones(ruta) if ruta else None,
+        latencia=configuracion.get("LATENCIA", 0.5),
+        variacion=configuracion.get("VARIACION", 0.2),
+        tamano=configuracion.get("TAMANO", 2000),
+        errores=configuracion.get("ERRORES", 0.0),
+    )
+
+
+def obtener_backend() -> BackendIA:
+    """Devuelve el backend configurado; lanza BackendNoDisponible si no se puede usar."""
+    global _backend
+    if _backend is None:
+        with _lock:
+            if _backend is None:
+                _backend = construir_backend(_configuracion("IA_BACKEND"))
+    return _backend
+
+
+def precalentar() -> None:
+    """Construye el backend y sus clientes antes de la primera petición (IA_BACKEND["PRECALENTAR"])."""
+    if not _configuracion("IA_BACKEND").get("PRECALENTAR"):
+        return
+    inicio = time.perf_counter()
+    try:
+        obtener_backend().precalentar()
+    except Exception as e:
+        logger.warning("No se pudo precalentar el backend de IA: %s", e)
+        return
+    logger.info("Backend de IA precalentado en %.0f ms", (time.perf_counter() - inicio) * 1000)
+
+
+def reiniciar_backend() -> None:
+    """Olvida el backend construido; se vuelve a leer la configuración al usarlo."""
+    global _backend
+    with _lock:
+        _backend = None
+
+
+def _reiniciar_en_hijo() -> None:
+    global _lock
+    _lock = threading.Lock()
+    if _backend is not None:
+        _backend.reiniciar()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reiniciar_en_hijo)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 import os
+import sys
 from pathlib import Path
 from dotenv import load_dotenv
 load_dotenv()
@@ -58,6 +59,7 @@ MERMAID_THEME = 'neutral'
 MERMAID_USE_CDN = True
 
 MIDDLEWARE = [
+    'documentacion.perfilado.PerfiladoMiddleware',  # solo con PERFILADO['ACTIVO']
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -69,6 +71,18 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Perfilado por petición (documentacion/perfilado.py): SQL, plantillas,
+# IA y total en la cabecera Server-Timing y en el log; volcados de cProfile
+# de las peticiones lentas en DIRECTORIO. No necesita DEBUG=True.
+PERFILADO = {
+    'ACTIVO': os.getenv('PERFILADO', 'False') == 'True',
+    'CABECERA': True,
+    'MUESTREO': float(os.getenv('PERFILADO_MUESTREO', 0.05)),         # fracción de peticiones al log
+    'UMBRAL_LENTO': float(os.getenv('PERFILADO_UMBRAL', 1.0)),        # segundos
+    'MUESTREO_CPROFILE': float(os.getenv('PERFILADO_CPROFILE', 0.1)),  # fracción ejecutada con cProfile
+    'DIRECTORIO': BASE_DIR / 'perfiles',
+}
+
 ROOT_URLCONF = 'docai_project.urls'
 
 TEMPLATES = [
@@ -91,15 +105,176 @@ WSGI_APPLICATION = 'docai_project.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
-
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+#
+# DB_ENGINE=postgres usa PostgreSQL con las variables DB_*. Con DB_POOL=True
+# cada proceso mantiene un pool de conexiones de psycopg (CONN_MAX_AGE debe
+# ser 0); sin pool, las conexiones se reutilizan DB_CONN_MAX_AGE segundos.
+# En ambos casos se comprueban antes de reutilizarlas (CONN_HEALTH_CHECKS).
+# Si no, SQLite en db.sqlite3, con WAL, busy_timeout y synchronous=NORMAL
+# aplicados al abrir cada conexión (SQLITE_AJUSTES, documentacion/basedatos.py).
+
+if os.getenv('DB_ENGINE', 'sqlite') == 'postgres':
+    DB_POOL = os.getenv('DB_POOL', 'True') == 'True'
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('DB_NAME', 'docai'),
+            'USER': os.getenv('DB_USER', 'docai'),
+            'PASSWORD': os.getenv('DB_PASSWORD', ''),
+            'HOST': os.getenv('DB_HOST', 'localhost'),
+            'PORT': os.getenv('DB_PORT', '5432'),
+            'CONN_MAX_AGE': 0 if DB_POOL else int(os.getenv('DB_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'pool': {
+                    'min_size': int(os.getenv('DB_POOL_MIN', 2)),
+                    'max_size': int(os.getenv('DB_POOL_MAX', 10)),  # por worker: hilos de generación incluidos
+                    'timeout': int(os.getenv('DB_POOL_TIMEOUT', 10)),
+                },
+            } if DB_POOL else {},
+        }
     }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                # BEGIN IMMEDIATE: una transacción que lee y luego escribe espera su
+                # turno (busy_timeout) en lugar de fallar con "database is locked"
+                'transaction_mode': 'IMMEDIATE',
+            },
+        }
+    }
+
+SQLITE_AJUSTES = {
+    'ACTIVO': os.getenv('SQLITE_AJUSTES', 'True') == 'True',
+    'JOURNAL_MODE': 'WAL',       # los lectores no bloquean al escritor ni al revés
+    'SYNCHRONOUS': 'NORMAL',     # con WAL no corrompe; solo puede perder la última transacción si se cae el sistema
+    'BUSY_TIMEOUT': int(os.getenv('SQLITE_BUSY_TIMEOUT', 20000)),  # ms esperando el bloqueo de escritura
+}
+
+
+# Artefacto.contenido se guarda comprimido con zstd (ver documentacion/campos.py)
+ARTEFACTO_COMPRESION = {
+    'ACTIVO': os.getenv('ARTEFACTO_COMPRESION', 'True') == 'True',
+    'NIVEL': int(os.getenv('ARTEFACTO_COMPRESION_NIVEL', 3)),
+    'MINIMO': 256,  # bytes: los textos más cortos se guardan tal cual
+}
+
+# Caché de respuestas de la IA (core/cache.py)
+# BACKEND: 'sqlite', 'django', 'archivos' o 'ninguno'
+
+IA_CACHE = {
+    'BACKEND': os.getenv('IA_CACHE_BACKEND', 'sqlite'),
+    'RUTA': os.getenv('IA_CACHE_RUTA', BASE_DIR / 'ia_cache.sqlite3'),
+    'TTL': int(os.getenv('IA_CACHE_TTL', 60 * 60 * 24 * 7)),
+    'MAX_ENTRADAS': int(os.getenv('IA_CACHE_MAX_ENTRADAS', 1000)),
 }
 
 
+# Proveedor de IA (core/proveedores.py)
+# NOMBRE: 'gemini' o 'local' (sin red: reproduce GRABACIONES o simula respuestas
+# de unos TAMANO caracteres tras LATENCIA ± VARIACION segundos; ERRORES es la
+# probabilidad de un 503 simulado). Con GRABAR=True el backend gemini guarda
+# cada respuesta en GRABACIONES para reproducirla después con 'local'.
+# El SDK de Gemini se importa en la primera generación; con PRECALENTAR=True
+# cada worker de gunicorn lo carga al arrancar (gunicorn.conf.py).
+
+IA_BACKEND = {
+    'NOMBRE': os.getenv('IA_BACKEND', 'gemini'),
+    'MODELO': os.getenv('IA_MODELO', 'models/gemini-2.0-flash'),
+    'GRABACIONES': BASE_DIR / 'ia_grabaciones.sqlite3',
+    'GRABAR': os.getenv('IA_GRABAR', 'False') == 'True',
+    'LATENCIA': float(os.getenv('IA_LOCAL_LATENCIA', 0.8)),
+    'VARIACION': 0.3,
+    'TAMANO': int(os.getenv('IA_LOCAL_TAMANO', 2000)),
+    'ERRORES': float(os.getenv('IA_LOCAL_ERRORES', 0)),
+    'PRECALENTAR': os.getenv('IA_PRECALENTAR', 'False') == 'True',
+}
+
+
+# Clientes de Gemini reutilizados por proceso (core/proveedores.py)
+# TRANSPORTE: 'grpc' o 'rest'; CONEXIONES: tamaño del pool de clientes
+
+IA_CLIENTES = {
+    'TRANSPORTE': os.getenv('IA_TRANSPORTE', 'grpc'),
+    'CONEXIONES': int(os.getenv('IA_CONEXIONES', 2)),
+}
+
+
+# Tiempos máximos, reintentos y cortacircuitos de las llamadas a Gemini
+IA_RESILIENCIA = {
+    'TIMEOUT': int(os.getenv('IA_TIMEOUT', 60)),  # segundos por llamada
+    'REINTENTOS': 3,                                # errores 429/5xx y tiempo agotado
+    'ESPERA_BASE': 1.0,
+    'ESPERA_MAXIMA': 20.0,
+    'UMBRAL_FALLOS': 5,                             # fallos seguidos que abren el circuito
+    'ENFRIAMIENTO': 30,                             # segundos fallando al instante
+}
+
+
+# Límite de uso de Gemini compartido entre procesos (token bucket por minuto).
+# Cuotas globales del proyecto en Google AI y cuota por usuario de la app.
+IA_LIMITES = {
+    'BACKEND': os.getenv('IA_LIMITES_BACKEND', 'sqlite'),  # sqlite | django | ninguno
+    'RUTA': BASE_DIR / 'ia_cache.sqlite3',
+    'GLOBAL': {'RPM': int(os.getenv('IA_RPM', 15)), 'TPM': int(os.getenv('IA_TPM', 1_000_000))},
+    'USUARIO': {'RPM': int(os.getenv('IA_RPM_USUARIO', 5)), 'TPM': int(os.getenv('IA_TPM_USUARIO', 250_000))},
+    'ESPERA_MAXIMA': 30,    # segundos que una llamada puede esperar turno antes de rechazarse
+    'TOKENS_SALIDA': 1024,  # tokens de respuesta estimados por llamada
+}
+
+
+# Instrucciones fijas de cada plantilla (core/prompts.py) guardadas como
+# CachedContent en Gemini. Solo se usa si las instrucciones llegan al mínimo
+# de tokens que admite el modelo; si no, se envía el prompt completo.
+IA_CACHE_CONTEXTO = {
+    'ACTIVO': os.getenv('IA_CACHE_CONTEXTO', 'False') == 'True',
+    'MODELO': os.getenv('IA_CACHE_CONTEXTO_MODELO', 'models/gemini-2.0-flash-001'),
+    'TTL': 3600,         # segundos de vida del contenido en caché
+    'MIN_TOKENS': 1024,  # tokens mínimos de instrucciones para intentar cachearlas
+}
+
+
+# Registro de cada llamada a la IA (LLMCallLog) y métricas en /metrics.
+# Las métricas se sirven a usuarios staff o, si hay METRICAS_TOKEN, con
+# la cabecera "Authorization: Bearer <token>" (para Prometheus).
+# Con `manage.py test` está apagado por defecto: el hilo que guarda las llamadas
+# escribiría a la vez que los tests (los que lo comprueban lo registran ellos).
+EJECUTANDO_TESTS = len(sys.argv) > 1 and sys.argv[1] == 'test'
+IA_REGISTRO_LLAMADAS = {
+    'ACTIVO': os.getenv('IA_REGISTRO_LLAMADAS', str(not EJECUTANDO_TESTS)) == 'True',
+    'LOTE': 50,        # filas por bulk_create
+    'INTERVALO': 2.0,  # segundos máximos que una llamada espera en memoria
+    # consolidar_llamadas_ia (cron): días que se guarda cada llamada; /metrics no los pierde
+    'RETENCION_DIAS': int(os.getenv('IA_REGISTRO_RETENCION_DIAS', 30)),
+}
+METRICAS_TOKEN = os.getenv('METRICAS_TOKEN', '')
+
+
+# Historia de Usuario y requisitos en una sola llamada con salida JSON
+IA_HU_ESTRUCTURADA = os.getenv('IA_HU_ESTRUCTURADA', 'True') == 'True'
+
+
+# Generación con IA en segundo plano (python manage.py procesar_generaciones)
+# Con GENERACION_ASINCRONA=False las vistas generan en la misma petición.
+
+GENERACION_ASINCRONA = os.getenv('GENERACION_ASINCRONA', 'True') == 'True'
+GENERACION_CONCURRENCIA = int(os.getenv('GENERACION_CONCURRENCIA', 4))
+# Segundos que una petición espera a la generación en vuelo del mismo artefacto
+GENERACION_ESPERA = int(os.getenv('GENERACION_ESPERA', 120))
+# Veces que el worker toma un trabajo sin cuota de IA antes de darlo por fallido
+GENERACION_INTENTOS_MAXIMOS = int(os.getenv('GENERACION_INTENTOS_MAXIMOS', 5))
+# Artefactos generados a la vez dentro de "Generar todo"
+GENERACION_CONCURRENCIA_PROYECTO = int(os.getenv('GENERACION_CONCURRENCIA_PROYECTO', 6))
+# Al regenerar el proyecto, cambios de RF (añadidos + eliminados) hasta los que un
+# artefacto se actualiza con esos RF en lugar de generarse de cero (0 lo desactiva)
+GENERACION_PARCHE_MAXIMO = int(os.getenv('GENERACION_PARCHE_MAXIMO', 5))
+# Artefactos con el mismo contexto pedidos en una sola llamada (0 o 1 desactiva los lotes)
+IA_LOTE_TAMANO = int(os.getenv('IA_LOTE_TAMANO', 4))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -142,6 +317,20 @@ STATICFILES_DIRS = [
 
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
+MEDIA_URL = 'media/'
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+
+# Render de diagramas Mermaid en el servidor con mermaid-cli
+# (npm install -g @mermaid-js/mermaid-cli). Sin `mmdc` se renderizan en el navegador.
+
+MERMAID_CLI = {
+    'COMANDO': os.getenv('MERMAID_CLI', 'mmdc'),
+    'FORMATOS': ['svg', 'png'],
+    'TIMEOUT': 60,
+    'ARGUMENTOS': [],  # p. ej. ['-p', 'puppeteer-config.json']
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -159,4 +348,17 @@ LOGOUT_REDIRECT_URL = '/'
 ACCOUNT_LOGOUT_REDIRECT_URL = '/accounts/login/'
 ACCOUNT_LOGIN_METHODS = {'username', 'email'}
 ACCOUNT_SIGNUP_FIELDS = ['email*', 'username*', 'password1*', 'password2*']
-ACCOUNT_EMAIL_VERIFICATION = 'none'
\ No newline at end of file
+ACCOUNT_EMAIL_VERIFICATION = 'none'
+
+# Logs de la app (perfilado, registro de usuarios, IA) por consola
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'consola': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'documentacion': {'handlers': ['consola'], 'level': os.getenv('LOG_NIVEL', 'INFO')},
+        'core': {'handlers': ['consola'], 'level': os.getenv('LOG_NIVEL', 'INFO')},
+    },
+}
@@ -3,9 +3,34 @@ from .models import Project
 from .models import Artefacto
 from .models import Fase
 from .models import SubArtefacto
+from .models import GenerationJob
+from .models import LLMCallLog
+from .models import Requisito
 # Register your models here.
 
 admin.site.register(Project)
-admin.site.register(Artefacto)
 admin.site.register(Fase)
-admin.site.register(SubArtefacto)
\ No newline at end of file
+admin.site.register(SubArtefacto)
+admin.site.register(GenerationJob)
+admin.site.register(Requisito)
+
+
+@admin.register(Artefacto)
+class ArtefactoAdmin(admin.ModelAdmin):
+    list_display = ('titulo', 'proyecto', 'tipo', 'generado_por_ia', 'actualizado')
+    list_filter = ('tipo', 'generado_por_ia')
+    list_select_related = ('proyecto',)
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        # El listado no muestra los cuerpos; el formulario de edición sí los necesita
+        if request.resolver_match and request.resolver_match.url_name.endswith('_changelist'):
+            queryset = queryset.metadatos()
+        return queryset
+
+
+@admin.register(LLMCallLog)
+class LLMCallLogAdmin(admin.ModelAdmin):
+    list_display = ('creado', 'tipo', 'latencia_ms', 'tokens_entrada', 'tokens_salida', 'cache', 'error')
+    list_filter = ('tipo', 'cache')
+    date_hierarchy = 'creado'
\ No newline at end of file
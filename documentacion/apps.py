@@ -1,6 +1,26 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class DocumentacionConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'documentacion'
+
+    def ready(self):
+        # PRAGMA de SQLITE_AJUSTES en cada conexión SQLite (ver basedatos.py)
+        from django.db.backends.signals import connection_created
+        from .basedatos import ajustar_sqlite
+        connection_created.connect(ajustar_sqlite, dispatch_uid='ajustes_sqlite')
+
+        # Cada llamada a la IA queda en LLMCallLog (ver observabilidad.py)
+        if getattr(settings, 'IA_REGISTRO_LLAMADAS', {}).get('ACTIVO', True):
+            from core.ia import registrar_observador
+            from .observabilidad import registro
+            registrar_observador(registro.anotar)
+
+        # El catálogo de fases y subartefactos se guarda en memoria (ver catalogo.py)
+        from django.db.models.signals import post_delete, post_save
+        from .catalogo import limpiar_catalogo
+        for modelo in (self.get_model('Fase'), self.get_model('SubArtefacto')):
+            post_save.connect(limpiar_catalogo, sender=modelo, dispatch_uid=f'catalogo_{modelo.__name__}_guardado')
+            post_delete.connect(limpiar_catalogo, sender=modelo, dispatch_uid=f'catalogo_{modelo.__name__}_borrado')
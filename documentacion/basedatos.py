@@ -0,0 +1,52 @@
+import logging
+
+from django.conf import settings # pyright: ignore[reportMissingModuleSource]
+
+logger = logging.getLogger(__name__)
+
+# ===== AJUSTES DE SQLITE =====
+#
+# SQLite sirve para despliegues pequeños, pero por defecto un escritor
+# bloquea a los lectores y las escrituras concurrentes de varios workers
+# fallan enseguida con "database is locked". Al abrir cada conexión se
+# aplican los PRAGMA de settings.SQLITE_AJUSTES: WAL (lectores y escritor a
+# la vez), busy_timeout (esperar el bloqueo en lugar de fallar) y
+# synchronous=NORMAL (un fsync por checkpoint, no por transacción).
+# Para muchos workers escribiendo a la vez, PostgreSQL (DB_ENGINE=postgres).
+
+POR_DEFECTO = {
+    "ACTIVO": True,
+    "JOURNAL_MODE": "WAL",
+    "SYNCHRONOUS": "NORMAL",
+    "BUSY_TIMEOUT": 20000,
+}
+
+_PERMITIDOS = {
+    "JOURNAL_MODE": {"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"},
+    "SYNCHRONOUS": {"OFF", "NORMAL", "FULL", "EXTRA"},
+}
+
+
+def ajustes_sqlite() -> dict:
+    ajustes = {**POR_DEFECTO, **getattr(settings, "SQLITE_AJUSTES", {})}
+    for clave, permitidos in _PERMITIDOS.items():
+        ajustes[clave] = str(ajustes[clave]).upper()
+        if ajustes[clave] not in permitidos:
+            raise ValueError(f"SQLITE_AJUSTES[{clave!r}] no es válido: {ajustes[clave]}")
+    return ajustes
+
+
+def ajustar_sqlite(sender, connection, **kwargs) -> None:
+    """Receptor de connection_created: aplica SQLITE_AJUSTES a cada conexión SQLite nueva."""
+    if connection.vendor != "sqlite":
+        return
+    ajustes = ajustes_sqlite()
+    if not ajustes["ACTIVO"]:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"PRAGMA busy_timeout = {int(ajustes['BUSY_TIMEOUT'])}")
+        cursor.execute(f"PRAGMA journal_mode = {ajustes['JOURNAL_MODE']}")
+        modo = cursor.fetchone()[0]
+        cursor.execute(f"PRAGMA synchronous = {ajustes['SYNCHRONOUS']}")
+    if modo.upper() != ajustes["JOURNAL_MODE"] and modo != "memory":  # las bases en memoria no admiten WAL
+        logger.warning("SQLite no aceptó journal_mode=%s (sigue en %s)", ajustes["JOURNAL_MODE"], modo)
@@ -0,0 +1,77 @@
+import threading
+from typing import Any, Optional
+
+from django.conf import settings # pyright: ignore[reportMissingModuleSource]
+from django.core.exceptions import ImproperlyConfigured # pyright: ignore[reportMissingModuleSource]
+from django.db import models # pyright: ignore[reportMissingModuleSource]
+
+try:
+    import zstandard
+except ImportError:  # opcional: sin él los textos se guardan sin comprimir
+    zstandard = None
+
+# ===== TEXTO COMPRIMIDO =====
+#
+# TextoComprimido se usa como un TextField (str en Python, Textarea en los
+# formularios) pero guarda bytes: el texto comprimido con zstd si
+# settings.ARTEFACTO_COMPRESION["ACTIVO"] y zstandard está instalado, o el
+# UTF-8 tal cual si no. Al leer se distingue por la cabecera de zstd, que
+# nunca es UTF-8 válido, así que activar o desactivar la compresión no
+# obliga a reescribir las filas. No admite búsquedas por contenido
+# (contains, regex...): la base de datos solo ve bytes.
+
+POR_DEFECTO = {
+    "ACTIVO": True,
+    "NIVEL": 3,
+    "MINIMO": 256,  # bytes: por debajo la cabecera se come el ahorro
+}
+
+CABECERA_ZSTD = b"\x28\xb5\x2f\xfd"
+
+_local = threading.local()  # los (de)compresores de zstandard no se comparten entre hilos
+
+
+def _config() -> dict:
+    return {**POR_DEFECTO, **getattr(settings, "ARTEFACTO_COMPRESION", {})}
+
+
+def comprimir(texto: str) -> bytes:
+    datos = texto.encode("utf-8")
+    config = _config()
+    if zstandard is None or not config["ACTIVO"] or len(datos) < config["MINIMO"]:
+        return datos
+    compresor = getattr(_local, "compresor", None)
+    if compresor is None or _local.nivel != config["NIVEL"]:
+        compresor = _local.compresor = zstandard.ZstdCompressor(level=config["NIVEL"])
+        _local.nivel = config["NIVEL"]
+    comprimido = compresor.compress(datos)
+    return comprimido if len(comprimido) < len(datos) else datos
+
+
+def descomprimir(datos: bytes) -> str:
+    if not datos.startswith(CABECERA_ZSTD):
+        return datos.decode("utf-8")
+    if zstandard is None:
+        raise ImproperlyConfigured("Hay textos comprimidos con zstd y el paquete zstandard no está instalado.")
+    descompresor = getattr(_local, "descompresor", None)
+    if descompresor is None:
+        descompresor = _local.descompresor = zstandard.ZstdDecompressor()
+    return descompresor.decompress(datos).decode("utf-8")
+
+
+class TextoComprimido(models.TextField):
+    """TextField que se guarda comprimido con zstd en una columna binaria."""
+
+    def get_internal_type(self) -> str:
+        return "BinaryField"
+
+    def get_db_prep_value(self, value: Any, connection, prepared: bool = False) -> Any:
+        value = super().get_db_prep_value(value, connection, prepared)
+        if value is None:
+            return None
+        return connection.Database.Binary(comprimir(value))
+
+    def from_db_value(self, value: Any, expression, connection) -> Optional[str]:
+        if value is None or isinstance(value, str):  # filas escritas como texto (p. ej. SQL a mano)
+            return value
+        return descomprimir(bytes(value))
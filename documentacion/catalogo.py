@@ -0,0 +1,61 @@
+import threading
+from typing import Dict, List, Optional
+
+from django.db.models import Prefetch # pyright: ignore[reportMissingModuleSource]
+
+from .models import Fase, SubArtefacto
+
+# ===== CATÁLOGO DE FASES Y SUBARTEFACTOS =====
+#
+# Las fases y sus subartefactos son globales: los proyectos no tienen copia
+# propia y los artefactos los referencian por clave foránea. El catálogo se
+# lee de la base de datos la primera vez que se necesita y queda en memoria
+# del proceso. Guardar o borrar una Fase o un SubArtefacto (p. ej. desde el
+# admin) lo invalida en este proceso; los demás workers lo ven al reiniciar.
+
+
+class Catalogo:
+    """Fases en orden, cada una con sus subartefactos en `subartefactos_ordenados`."""
+
+    def __init__(self, fases: List[Fase]):
+        self.fases = fases
+        self.subartefactos: Dict[str, SubArtefacto] = {
+            sub.nombre: sub for fase in fases for sub in fase.subartefactos_ordenados # pyright: ignore[reportAttributeAccessIssue]
+        }
+        self._por_nombre = {nombre.lower(): sub for nombre, sub in self.subartefactos.items()}
+
+    def subartefacto(self, nombre: str) -> Optional[SubArtefacto]:
+        return self.subartefactos.get(nombre)
+
+    def tipo_de(self, titulo: str) -> Optional[str]:
+        """Tipo (AREQ, DISE...) de la fase del subartefacto con ese título, sin distinguir mayúsculas."""
+        sub = self._por_nombre.get(titulo.strip().lower())
+        return sub.fase.tipo if sub is not None else None
+
+
+_catalogo: Optional[Catalogo] = None
+_catalogo_lock = threading.Lock()
+
+
+def _cargar() -> Catalogo:
+    fases = list(Fase.objects.order_by('orden', 'nombre').prefetch_related(
+        Prefetch('subartefactos', queryset=SubArtefacto.objects.order_by('orden', 'nombre'),
+                 to_attr='subartefactos_ordenados'),
+    ))
+    return Catalogo(fases)
+
+
+def obtener_catalogo() -> Catalogo:
+    global _catalogo
+    catalogo = _catalogo
+    if catalogo is None:
+        with _catalogo_lock:
+            if _catalogo is None:
+                _catalogo = _cargar()
+            catalogo = _catalogo
+    return catalogo
+
+
+def limpiar_catalogo(**kwargs) -> None:
+    global _catalogo
+    _catalogo = None
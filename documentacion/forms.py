@@ -4,20 +4,9 @@ from django.contrib.auth.models import User
 from django.contrib.auth.forms import UserCreationForm
 from django.core.exceptions import ValidationError
 from .models import Project, Artefacto, SecurityQuestions
+from .catalogo import obtener_catalogo
 
 
-
-ARTEFACTOS_MERMAID = [
-    "Diagrama de flujo",
-    "Diagrama de clases",
-    "Diagrama de Entidad-Relacion",
-    "Diagrama de secuencia",
-    "Diagrama de estado",
-    "Diagrama de C4-contexto", 
-    "Diagrama de C4-contenedor", 
-    "Diagrama de C4-implementación"
-]
-
 # Función para detectar contenido repetitivo o no coherente
 def texto_no_coherente(texto: str) -> bool:
     texto = texto.lower().strip()
@@ -152,6 +141,11 @@ class ArtefactoForm(forms.ModelForm):
         titulo = self.cleaned_data['titulo'].strip()
         if not re.match(r'^[A-Za-z0-9ÁÉÍÓÚáéíóúñÑ\s.,()-]{3,100}$', titulo):
             raise ValidationError("El título contiene caracteres no válidos.")
+        # La restricción artefacto_unico_por_proyecto no se valida sola: el proyecto no está en el formulario
+        if self.instance.pk and Artefacto.objects.filter(
+            proyecto_id=self.instance.proyecto_id, titulo=titulo
+        ).exclude(pk=self.instance.pk).exists():
+            raise ValidationError("El proyecto ya tiene un artefacto con ese título.")
         return titulo
 
     def clean_contenido(self):
@@ -162,24 +156,12 @@ class ArtefactoForm(forms.ModelForm):
 
     def clean_tipo(self):
         """
-        Asigna automáticamente el tipo de artefacto basado en el título.
+        Asigna automáticamente el tipo de artefacto según la fase del título en el catálogo.
         """
-        titulo = self.cleaned_data.get('titulo', '').lower()
-
-        if titulo == "historia de usuario":
-            return 'AREQ'
-        elif titulo in ("caja negra", "smoke"):
-            return 'PRUE'
-        elif titulo == "diagrama de flujo":
-            return 'AREQ'
-        elif titulo in ("diagrama de clases", "diagrama de entidad-relacion"):
-            return 'DISE'
-        elif titulo in ("diagrama de secuencia", "diagrama de estado"):
-            return 'DEVS'
-        elif titulo in ("diagrama de c4-contexto", "diagrama de c4-contenedor", "diagrama de c4-implementación"):
-            return 'DESP'
-        else:
+        tipo = obtener_catalogo().tipo_de(self.cleaned_data.get('titulo', ''))
+        if not tipo:
             raise ValidationError("Título no reconocido para asignar tipo automáticamente.")
+        return tipo
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -188,19 +170,9 @@ class ArtefactoForm(forms.ModelForm):
             self.fields['titulo'].disabled = True
             self.fields['tipo'].disabled = True  
 
-            titulo = self.instance.titulo.lower()
-            if titulo == "historia de usuario":
-                self.initial['tipo'] = 'AREQ'
-            elif titulo in ("caja negra", "smoke"):
-                self.initial['tipo'] = 'PRUE'
-            elif titulo == "diagrama de flujo":
-                self.initial['tipo'] = 'AREQ'
-            elif titulo in ("diagrama de clases", "diagrama de entidad-relacion"):
-                self.initial['tipo'] = 'DISE'
-            elif titulo in ("diagrama de secuencia", "diagrama de estado"):
-                self.initial['tipo'] = 'DEVS'
-            elif titulo in ("diagrama de c4-contexto", "diagrama de c4-contenedor", "diagrama de c4-implementación"):
-                self.initial['tipo'] = 'DESP'
+            tipo = obtener_catalogo().tipo_de(self.instance.titulo)
+            if tipo:
+                self.initial['tipo'] = tipo
 
 # ===== registarse  y loguearse  ============
 class CustomUserCreationForm(UserCreationForm):
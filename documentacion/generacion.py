@@ -0,0 +1,572 @@
+import asyncio
+import contextvars
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import timedelta
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings # pyright: ignore[reportMissingModuleSource]
+from django.db import IntegrityError, connections, transaction # pyright: ignore[reportMissingModuleSource]
+from django.db.models import F, Q # pyright: ignore[reportMissingModuleSource]
+from django.utils import timezone # pyright: ignore[reportMissingModuleSource]
+
+from core.ia import (generar_subartefacto_con_prompt, generar_subartefacto_stream, extraer_requisitos,
+                     generar_subartefacto_con_prompt_async, generar_subartefacto_stream_async,
+                     extraer_requisitos_async, generar_hu_con_requisitos, generar_hu_con_requisitos_async,
+                     generar_subartefactos_en_lote, en_nombre_de, estimar_tokens_tipo, consultar_cuota,
+                     actualizar_subartefacto, LimiteExcedido, version_plantilla)
+from core.limites import Decision
+from .models import (Project, Artefacto, SubArtefacto, GenerationJob, Requisito,
+                     ARTEFACTOS_TEXTO, ARTEFACTOS_MERMAID, ARTEFACTOS_VALIDOS)
+from .catalogo import obtener_catalogo
+from .render import limpiar_mermaid, renderizar_codigo, renderizador_disponible, formatos_configurados
+from .requisitos import (PARCHE, VIGENTE, hashes_activos, huella_proyecto, plan_actualizacion,
+                         sincronizar_requisitos)
+
+logger = logging.getLogger(__name__)
+
+HISTORIA_USUARIO = "Historia de Usuario"
+
+# Dependencias entre artefactos: la Historia de Usuario (con sus requisitos
+# extraídos) alimenta a todos los demás, que son independientes entre sí.
+DEPENDENCIAS = {
+    titulo: [] if titulo == HISTORIA_USUARIO else [HISTORIA_USUARIO]
+    for titulo in ARTEFACTOS_TEXTO + ARTEFACTOS_MERMAID
+}
+
+# Título del trabajo que genera todos los artefactos del proyecto
+PROYECTO_COMPLETO = "Proyecto completo"
+
+# ===== GENERACIÓN DE CONTENIDO =====
+
+def requisitos_validos(artefacto: Optional[Artefacto]) -> Optional[str]:
+    """Requisitos extraídos de la HU, o None si no hay (o si su extracción falló)."""
+    if artefacto is None or not artefacto.contexto or not artefacto.contexto.strip():
+        return None
+    if artefacto.contexto.startswith("[ERROR"):
+        return None
+    return artefacto.contexto
+
+def requisitos_del_proyecto(proyecto: Project) -> Optional[str]:
+    hu = Artefacto.objects.filter(proyecto=proyecto, titulo_normalizado=HISTORIA_USUARIO.lower()).defer('contenido', 'render').first()
+    return requisitos_validos(hu)
+
+def faltan_requisitos(proyecto: Project, titulo: str) -> bool:
+    """
+    Los diagramas parten de los requisitos de la HU: sin ellos no se generan.
+    Los artefactos de texto (la HU y las pruebas) bastan con la descripción.
+    """
+    return titulo not in ARTEFACTOS_TEXTO and not requisitos_del_proyecto(proyecto)
+
+def texto_con_requisitos(proyecto: Project, requisitos: Optional[str]) -> str:
+    """Descripción del proyecto ampliada con los requisitos funcionales de la HU."""
+    if not requisitos:
+        return proyecto.descripcion
+    return f"{proyecto.descripcion}\n\nRequisitos funcionales:\n{requisitos}"
+
+def argumentos_prompt(proyecto: Project, titulo: str, requisitos: Optional[str] = None) -> Dict[str, str]:
+    """
+    Argumentos del prompt de cada tipo. La HU parte de la descripción; el
+    resto de artefactos, de la descripción y de los requisitos de la HU.
+    """
+    if titulo == HISTORIA_USUARIO:
+        return {"nombre_proyecto": proyecto.nombre, "descripcion": proyecto.descripcion}
+
+    if requisitos is None:
+        requisitos = requisitos_del_proyecto(proyecto)
+    texto = texto_con_requisitos(proyecto, requisitos)
+    if titulo in ARTEFACTOS_TEXTO:
+        return {"nombre_proyecto": proyecto.nombre, "descripcion": texto}
+    return {"texto": texto}
+
+def generar_contenido(proyecto: Project, titulo: str, forzar: bool = False,
+                      requisitos: Optional[str] = None) -> Tuple[str, Optional[str]]:
+    """
+    Genera el contenido de un artefacto con la IA.
+    Devuelve (contenido, contexto); el contexto solo se llena para la
+    Historia de Usuario (requisitos extraídos).
+    """
+    if titulo.lower() == HISTORIA_USUARIO.lower():
+        return generar_hu_con_requisitos(proyecto.nombre, proyecto.descripcion, forzar=forzar)
+
+    contenido = generar_subartefacto_con_prompt(
+        tipo=titulo,
+        forzar=forzar,
+        **argumentos_prompt(proyecto, titulo, requisitos)
+    )
+    if titulo in ARTEFACTOS_MERMAID:
+        contenido = limpiar_mermaid(contenido)
+    return contenido, None
+
+async def generar_contenido_async(proyecto: Project, titulo: str, forzar: bool = False,
+                                  requisitos: Optional[str] = None) -> Tuple[str, Optional[str]]:
+    """Versión asíncrona de generar_contenido (para vistas async bajo ASGI)."""
+    if titulo.lower() == HISTORIA_USUARIO.lower():
+        return await generar_hu_con_requisitos_async(proyecto.nombre, proyecto.descripcion, forzar=forzar)
+
+    argumentos = await sync_to_async(argumentos_prompt)(proyecto, titulo, requisitos)
+    contenido = await generar_subartefacto_con_prompt_async(tipo=titulo, forzar=forzar, **argumentos)
+    if titulo in ARTEFACTOS_MERMAID:
+        contenido = limpiar_mermaid(contenido)
+    return contenido, None
+
+def guardar_artefacto(proyecto: Project, titulo: str, contenido: str, contexto: Optional[str] = None,
+                      subartefacto: Optional[SubArtefacto] = None, artefacto: Optional[Artefacto] = None,
+                      tipo: str = '') -> Artefacto:
+    """Crea (o actualiza) el artefacto con el contenido generado."""
+    if artefacto is None:
+        # Si otra generación lo creó mientras tanto se actualiza ese (uno por título)
+        artefacto = Artefacto.objects.filter(proyecto=proyecto, titulo=titulo).first()
+    if artefacto is None:
+        subartefacto = subartefacto or obtener_catalogo().subartefacto(titulo)
+        if subartefacto is None:
+            raise ValueError(f"El catálogo no tiene el subartefacto '{titulo}'.")
+        artefacto = Artefacto(
+            proyecto=proyecto,
+            fase=subartefacto.fase,
+            subartefacto=subartefacto,
+            titulo=titulo,
+            tipo=tipo,
+        )
+
+    artefacto.contenido = contenido
+    if contexto is not None:
+        artefacto.contexto = contexto
+    artefacto.generado_por_ia = True
+    artefacto.plantilla = version_plantilla(titulo)
+    # Entradas con que se generó, para la regeneración incremental (ver requisitos.py)
+    artefacto.huella = huella_proyecto(proyecto)
+    if titulo == HISTORIA_USUARIO:
+        artefacto.requisitos = sincronizar_requisitos(proyecto, artefacto.contexto or "")
+    else:
+        artefacto.requisitos = hashes_activos(proyecto)
+    if artefacto.pk is not None:
+        artefacto.save()
+    else:
+        # Solo el INSERT va en su propia transacción (en SQLite, leer y luego
+        # escribir dentro de una bloquea la base a los demás hilos)
+        try:
+            with transaction.atomic():
+                artefacto.save()
+        except IntegrityError:
+            existente = Artefacto.objects.get(proyecto=proyecto, titulo=titulo)
+            return guardar_artefacto(proyecto, titulo, contenido, contexto, artefacto=existente)
+    programar_render(artefacto)
+    return artefacto
+
+def programar_render(artefacto: Artefacto) -> None:
+    """
+    Tras guardar un diagrama: lo renderiza el worker (queda marcado en
+    render_pendiente) o, sin worker (GENERACION_ASINCRONA = False), se
+    renderiza en el momento, igual que las generaciones.
+    """
+    if artefacto.render_pendiente and not getattr(settings, 'GENERACION_ASINCRONA', True):
+        renderizar_diagrama(artefacto)
+
+def renderizar_diagrama(artefacto: Artefacto) -> list:
+    """
+    Renderiza en el servidor (SVG/PNG) el diagrama del artefacto y anota en
+    su render los formatos disponibles. No hace nada con artefactos de texto.
+    Llama a mermaid-cli: solo desde el worker o un comando.
+    """
+    render = dict(artefacto.render or {})
+    if render.get("tipo") != "mermaid" or not render.get("codigo"):
+        return []
+
+    formatos = [f for f in formatos_configurados() if renderizar_codigo(render["codigo"], f)]
+    render["archivos"] = formatos
+    # Solo si el contenido no cambió mientras se renderizaba; si falla no se
+    # vuelve a intentar solo (renderizar_diagramas lo reintenta a mano)
+    Artefacto.objects.filter(pk=artefacto.pk, render__hash=render.get("hash")).update(
+        render=render, render_pendiente=False
+    )
+    artefacto.render, artefacto.render_pendiente = render, False
+    return formatos
+
+def renderizar_pendientes(limite: int = 20) -> int:
+    """Renderiza hasta `limite` diagramas marcados como pendientes; devuelve cuántos había."""
+    if not renderizador_disponible():
+        return 0  # descargar_diagrama ofrece el código Mermaid mientras tanto
+    pendientes = list(Artefacto.objects.filter(render_pendiente=True).only('id', 'titulo', 'render')[:limite])
+    for artefacto in pendientes:
+        renderizar_diagrama(artefacto)
+    return len(pendientes)
+
+def generar_y_guardar(proyecto: Project, titulo: str, subartefacto: Optional[SubArtefacto] = None,
+                      artefacto: Optional[Artefacto] = None, tipo: str = '', forzar: bool = False,
+                      requisitos: Optional[str] = None) -> Artefacto:
+    """Genera el contenido y crea (o actualiza) el artefacto correspondiente."""
+    contenido, contexto = generar_contenido(proyecto, titulo, forzar=forzar, requisitos=requisitos)
+    return guardar_artefacto(proyecto, titulo, contenido, contexto,
+                             subartefacto=subartefacto, artefacto=artefacto, tipo=tipo)
+
+def generar_y_guardar_stream(proyecto: Project, titulo: str, artefacto: Optional[Artefacto] = None,
+                             forzar: bool = False) -> Iterator[Tuple[str, Any]]:
+    """
+    Versión por fragmentos de generar_y_guardar. Produce ("fragmento", texto)
+    a medida que llega la respuesta y, al final, ("fin", artefacto) una vez
+    guardado el contenido completo.
+    """
+    partes = []
+    for fragmento in generar_subartefacto_stream(titulo, forzar=forzar, **argumentos_prompt(proyecto, titulo)):
+        partes.append(fragmento)
+        yield "fragmento", fragmento
+
+    contenido = "".join(partes).strip()
+    contexto = None
+    if titulo == HISTORIA_USUARIO:
+        contexto = extraer_requisitos(contenido, forzar=forzar)
+    elif titulo in ARTEFACTOS_MERMAID:
+        contenido = limpiar_mermaid(contenido)
+
+    yield "fin", guardar_artefacto(proyecto, titulo, contenido, contexto, artefacto=artefacto)
+
+async def generar_y_guardar_stream_async(proyecto: Project, titulo: str, artefacto: Optional[Artefacto] = None,
+                                         forzar: bool = False) -> AsyncIterator[Tuple[str, Any]]:
+    """Versión asíncrona de generar_y_guardar_stream."""
+    argumentos = await sync_to_async(argumentos_prompt)(proyecto, titulo)
+    partes = []
+    async for fragmento in generar_subartefacto_stream_async(titulo, forzar=forzar, **argumentos):
+        partes.append(fragmento)
+        yield "fragmento", fragmento
+
+    contenido = "".join(partes).strip()
+    contexto = None
+    if titulo == HISTORIA_USUARIO:
+        contexto = await extraer_requisitos_async(contenido, forzar=forzar)
+    elif titulo in ARTEFACTOS_MERMAID:
+        contenido = limpiar_mermaid(contenido)
+
+    yield "fin", await sync_to_async(guardar_artefacto)(proyecto, titulo, contenido, contexto, artefacto=artefacto)
+
+# ===== GENERACIÓN DEL PROYECTO COMPLETO =====
+
+def generar_contenidos_en_lote(proyecto: Project, titulos: List[str], forzar: bool = False,
+                               requisitos: Optional[str] = None) -> Dict[str, str]:
+    """
+    Genera varios artefactos que comparten los mismos argumentos de prompt
+    con una sola llamada a la IA (ver core.ia.generar_subartefactos_en_lote).
+    """
+    contenidos = generar_subartefactos_en_lote(
+        titulos, forzar=forzar, **argumentos_prompt(proyecto, titulos[0], requisitos)
+    )
+    return {
+        titulo: limpiar_mermaid(contenido) if titulo in ARTEFACTOS_MERMAID else contenido
+        for titulo, contenido in contenidos.items()
+    }
+
+def _agrupar_en_lotes(proyecto: Project, titulos: List[str], requisitos: Optional[str]) -> List[List[str]]:
+    """Agrupa los artefactos con los mismos argumentos de prompt en lotes de settings.IA_LOTE_TAMANO."""
+    tamano = getattr(settings, 'IA_LOTE_TAMANO', 4)
+    if tamano < 2:
+        return [[titulo] for titulo in titulos]
+
+    grupos: Dict[str, List[str]] = {}
+    for titulo in titulos:
+        # La HU tiene su propio flujo (historias + requisitos): nunca va en lote
+        clave = titulo if titulo == HISTORIA_USUARIO else json.dumps(
+            argumentos_prompt(proyecto, titulo, requisitos), sort_keys=True)
+        grupos.setdefault(clave, []).append(titulo)
+    return [grupo[i:i + tamano] for grupo in grupos.values() for i in range(0, len(grupo), tamano)]
+
+def _generar_nodo(proyecto: Project, titulos: List[str], subartefactos: Dict[str, SubArtefacto],
+                  existentes: Dict[str, Artefacto], forzar: bool, requisitos: Optional[str]) -> Dict[str, Artefacto]:
+    try:
+        if len(titulos) == 1:
+            titulo = titulos[0]
+            return {titulo: generar_y_guardar(proyecto, titulo, subartefacto=subartefactos[titulo],
+                                              artefacto=existentes.get(titulo), forzar=forzar, requisitos=requisitos)}
+
+        contenidos = generar_contenidos_en_lote(proyecto, titulos, forzar=forzar, requisitos=requisitos)
+        return {
+            titulo: guardar_artefacto(proyecto, titulo, contenidos[titulo],
+                                      subartefacto=subartefactos[titulo], artefacto=existentes.get(titulo))
+            for titulo in titulos
+        }
+    finally:
+        connections.close_all()
+
+def _actualizar_nodo(proyecto: Project, titulo: str, artefacto: Artefacto, anadidos: List[str],
+                     eliminados: List[str], requisitos: Optional[str]) -> Dict[str, Artefacto]:
+    try:
+        contenido = actualizar_subartefacto(titulo, artefacto.contenido, anadidos, eliminados)
+        if contenido is None:
+            logger.info("La actualización de %s no es válida; se genera de cero", titulo)
+            return {titulo: generar_y_guardar(proyecto, titulo, artefacto=artefacto, requisitos=requisitos)}
+        if titulo in ARTEFACTOS_MERMAID:
+            contenido = limpiar_mermaid(contenido)
+        return {titulo: guardar_artefacto(proyecto, titulo, contenido, artefacto=artefacto)}
+    finally:
+        connections.close_all()
+
+def _planificar(proyecto: Project, titulos: List[str],
+                existentes: Dict[str, Artefacto]) -> Tuple[Dict[str, Artefacto], Dict[str, Tuple[List[str], List[str]]], List[str]]:
+    """
+    Reparte los artefactos listos para generarse en (vigentes, parches, nuevos)
+    según plan_actualizacion. Se llama cuando la HU ya está al día, así que
+    los Requisito activos son los que recibirán los prompts.
+    """
+    requisitos = {r.hash: r for r in Requisito.objects.filter(proyecto=proyecto)}
+    huella = huella_proyecto(proyecto)
+    vigentes, parches, nuevos = {}, {}, []
+    for titulo in titulos:
+        artefacto = existentes.get(titulo)
+        if artefacto is None or (titulo == HISTORIA_USUARIO and not requisitos_validos(artefacto)):
+            nuevos.append(titulo)
+            continue
+        accion, anadidos, eliminados = plan_actualizacion(artefacto, requisitos, huella)
+        if accion == VIGENTE:
+            vigentes[titulo] = artefacto
+        elif accion == PARCHE:
+            parches[titulo] = (anadidos, eliminados)
+        else:
+            nuevos.append(titulo)
+    return vigentes, parches, nuevos
+
+def generar_proyecto(proyecto: Project, forzar: bool = False, concurrencia: Optional[int] = None) -> Dict[str, Artefacto]:
+    """
+    Genera todos los artefactos del proyecto respetando DEPENDENCIAS.
+    Cada artefacto se lanza en cuanto sus dependencias están listas, así los
+    independientes se generan en paralelo (hasta `concurrencia` a la vez).
+    Sin forzar, los artefactos ya generados se conservan si sus entradas no
+    cambiaron, se actualizan con los RF añadidos y eliminados si cambiaron
+    pocos y, si no, se generan de nuevo (ver requisitos.py).
+    Sin cuota de IA lanza LimiteExcedido, no RuntimeError, para que el
+    trabajo vuelva a la cola (ver ejecutar_job).
+    """
+    concurrencia = concurrencia or getattr(settings, 'GENERACION_CONCURRENCIA_PROYECTO', 6)
+    subartefactos = obtener_catalogo().subartefactos
+    # Sin cuerpos: los vigentes no los necesitan y los demás los cargan al actualizarse
+    existentes = {a.titulo: a for a in Artefacto.objects.filter(proyecto=proyecto).metadatos()}
+
+    pendientes = {titulo: set(deps) for titulo, deps in DEPENDENCIAS.items() if titulo in subartefactos}
+    resultados: Dict[str, Artefacto] = {}
+    errores: Dict[str, str] = {}
+    sin_cuota: Optional[LimiteExcedido] = None
+
+    en_curso = {}
+    with ThreadPoolExecutor(max_workers=concurrencia) as pool:
+        while pendientes or en_curso:
+            listos = []
+            for titulo, deps in list(pendientes.items()):
+                fallidas = deps & errores.keys()
+                if fallidas:
+                    errores[titulo] = f"Depende de {', '.join(sorted(fallidas))}, que no se pudo generar."
+                    del pendientes[titulo]
+                elif deps <= resultados.keys():
+                    del pendientes[titulo]
+                    listos.append(titulo)
+
+            if listos:
+                requisitos = requisitos_validos(resultados.get(HISTORIA_USUARIO))
+                vigentes, parches = {}, {}
+                if not forzar:
+                    vigentes, parches, listos = _planificar(proyecto, listos, existentes)
+                resultados.update(vigentes)
+                for titulo, (anadidos, eliminados) in parches.items():
+                    futuro = pool.submit(contextvars.copy_context().run, _actualizar_nodo, proyecto, titulo,
+                                         existentes[titulo], anadidos, eliminados, requisitos)
+                    en_curso[futuro] = [titulo]
+                # Los que quedan listos a la vez y comparten contexto se piden en una sola llamada
+                for lote in _agrupar_en_lotes(proyecto, listos, requisitos):
+                    # copy_context: los hilos del pool cargan la cuota al mismo usuario
+                    futuro = pool.submit(contextvars.copy_context().run, _generar_nodo, proyecto, lote,
+                                         subartefactos, existentes, forzar, requisitos)
+                    en_curso[futuro] = lote
+                if vigentes:
+                    continue  # pueden haber dejado listos a otros
+
+            if not en_curso:
+                # Dependencias que el proyecto no tiene definidas
+                for titulo in pendientes:
+                    errores[titulo] = "Dependencias no disponibles en el proyecto."
+                break
+
+            terminados, _ = wait(en_curso, return_when=FIRST_COMPLETED)
+            for futuro in terminados:
+                lote = en_curso.pop(futuro)
+                try:
+                    resultados.update(futuro.result())
+                except LimiteExcedido as e:
+                    sin_cuota = sin_cuota or e
+                    for titulo in lote:
+                        errores[titulo] = str(e)
+                except Exception as e:
+                    logger.exception("Error al generar %s del proyecto %s", ", ".join(lote), proyecto.pk)
+                    for titulo in lote:
+                        errores[titulo] = str(e)
+
+    if sin_cuota is not None:
+        raise sin_cuota  # ejecutar_job devuelve el trabajo a la cola (lo ya generado se conserva)
+    if errores:
+        raise RuntimeError("No se pudieron generar: " + "; ".join(f"{t}: {e}" for t, e in errores.items()))
+    return resultados
+
+# ===== CUOTA DE USO =====
+
+def consultar_cuota_generacion(proyecto: Project, titulos: List[str]) -> Decision:
+    """
+    Estima los tokens de generar `titulos` a partir de sus PROMPTS y consulta
+    la cuota global y la del propietario del proyecto (sin consumirla).
+    """
+    requisitos = requisitos_del_proyecto(proyecto)
+    tokens = sum(
+        estimar_tokens_tipo(titulo, **argumentos_prompt(proyecto, titulo, requisitos))
+        for titulo in titulos if titulo in ARTEFACTOS_VALIDOS
+    )
+    return consultar_cuota(tokens, proyecto.propietario_id)
+
+# ===== COLA DE TRABAJOS =====
+
+# Single-flight: la restricción generacion_en_vuelo_unica admite un solo
+# trabajo pendiente por (proyecto, título) en toda la base de datos, así que
+# entre todos los workers solo una petición (la que lo crea) llama a la IA.
+# Las demás reciben ese mismo trabajo y esperan su resultado en lugar de
+# generar otra vez y crear otro artefacto.
+
+VUELO_MAXIMO = 15  # minutos en ejecución tras los que se da por interrumpido (ver recuperar_jobs_huerfanos)
+
+def reservar_generacion(proyecto: Project, titulo: str, estado: str = GenerationJob.EN_COLA,
+                        **campos: Any) -> Tuple[GenerationJob, bool]:
+    """
+    Crea el trabajo de (proyecto, titulo) salvo que ya haya uno en vuelo.
+    Devuelve (trabajo, nuevo); con nuevo=False el trabajo es el de otra petición.
+    """
+    if estado == GenerationJob.EJECUTANDO:
+        campos.update(iniciado=timezone.now(), intentos=1)
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                return GenerationJob.objects.create(proyecto=proyecto, titulo=titulo, estado=estado, **campos), True
+        except IntegrityError:
+            pass
+        lider = GenerationJob.objects.filter(proyecto=proyecto, titulo=titulo).order_by('-creado', '-pk').first()
+        if lider is None:
+            continue
+        if lider.estado == GenerationJob.EJECUTANDO and recuperar_jobs_huerfanos(pk=lider.pk):
+            continue  # su proceso murió sin terminarlo: se libera el vuelo y se vuelve a intentar
+        return lider, False
+    raise RuntimeError(f"No se pudo reservar la generación de {titulo}.")
+
+def esperar_job(job: GenerationJob, espera: Optional[float] = None) -> GenerationJob:
+    """Espera (consultando la BD) a que termine un trabajo que ejecuta otra petición o worker."""
+    limite = time.monotonic() + (espera if espera is not None else getattr(settings, 'GENERACION_ESPERA', 120))
+    while job.pendiente and time.monotonic() < limite:
+        time.sleep(0.5)
+        job.refresh_from_db()
+    return job
+
+async def esperar_job_async(job: GenerationJob, espera: Optional[float] = None) -> GenerationJob:
+    """Versión asíncrona de esperar_job (no ocupa un hilo mientras espera)."""
+    limite = time.monotonic() + (espera if espera is not None else getattr(settings, 'GENERACION_ESPERA', 120))
+    while job.pendiente and time.monotonic() < limite:
+        await asyncio.sleep(0.5)
+        await job.arefresh_from_db()
+    return job
+
+def terminar_job(job: GenerationJob, artefacto: Optional[Artefacto] = None, error: str = '') -> GenerationJob:
+    """Cierra un trabajo ejecutado fuera de ejecutar_job (p. ej. en streaming)."""
+    job.artefacto = artefacto
+    job.estado = GenerationJob.FALLIDO if error else GenerationJob.TERMINADO
+    job.error = error
+    job.terminado = timezone.now()
+    job.save(update_fields=['artefacto', 'estado', 'error', 'terminado'])
+    return job
+
+def encolar_generacion(proyecto: Project, titulo: str, subartefacto: Optional[SubArtefacto] = None,
+                       artefacto: Optional[Artefacto] = None, tipo: str = '', forzar: bool = False) -> GenerationJob:
+    """
+    Crea un trabajo de generación, o devuelve el que ya está en vuelo para el
+    mismo (proyecto, titulo). Con settings.GENERACION_ASINCRONA = False
+    (desarrollo sin worker) el trabajo se ejecuta en el momento y, si era de
+    otra petición, se espera a que termine.
+    """
+    job, nuevo = reservar_generacion(
+        proyecto,
+        titulo,
+        subartefacto=subartefacto,
+        artefacto=artefacto,
+        tipo=tipo,
+        forzar=forzar,
+    )
+    if not getattr(settings, 'GENERACION_ASINCRONA', True):
+        if nuevo and tomar_job(job.pk):
+            job.refresh_from_db()
+            ejecutar_job(job)
+        elif not nuevo:
+            esperar_job(job)
+    return job
+
+def tomar_job(job_id: int) -> bool:
+    """Marca el trabajo como en ejecución si sigue en cola (atómico entre workers)."""
+    return GenerationJob.objects.filter(pk=job_id, estado=GenerationJob.EN_COLA).update(
+        estado=GenerationJob.EJECUTANDO,
+        iniciado=timezone.now(),
+        intentos=F('intentos') + 1,
+    ) == 1
+
+def tomar_siguiente_job() -> Optional[GenerationJob]:
+    """Reserva el trabajo en cola más antiguo que ya puede ejecutarse; None si no hay ninguno."""
+    while True:
+        job_id = GenerationJob.objects.filter(
+            Q(no_antes_de__isnull=True) | Q(no_antes_de__lte=timezone.now()), estado=GenerationJob.EN_COLA,
+        ).order_by('creado', 'pk').values_list('pk', flat=True).first()
+        if job_id is None:
+            return None
+        if tomar_job(job_id):
+            return GenerationJob.objects.select_related('proyecto', 'subartefacto', 'artefacto').get(pk=job_id)
+
+def recuperar_jobs_huerfanos(minutos: int = VUELO_MAXIMO, **filtro: Any) -> int:
+    """
+    Da por fallidos los trabajos que siguen 'running' tras `minutos` (su
+    worker o petición se cayó) y libera su vuelo. No se reintentan solos: la
+    llamada a la IA pudo llegar a cobrarse, así que se vuelven a pedir a mano.
+    """
+    limite = timezone.now() - timedelta(minutes=minutos)
+    return GenerationJob.objects.filter(estado=GenerationJob.EJECUTANDO, iniciado__lt=limite, **filtro).update(
+        estado=GenerationJob.FALLIDO, error="Generación interrumpida.", terminado=timezone.now()
+    )
+
+def ejecutar_job(job: GenerationJob) -> GenerationJob:
+    """Genera el contenido del trabajo y guarda el artefacto resultante."""
+    proyecto = job.proyecto
+    try:
+        with en_nombre_de(proyecto.propietario_id):
+            if job.titulo == PROYECTO_COMPLETO:
+                generar_proyecto(proyecto, forzar=job.forzar)
+                artefacto = None
+            else:
+                artefacto = generar_y_guardar(proyecto, job.titulo, subartefacto=job.subartefacto,
+                                              artefacto=job.artefacto, tipo=job.tipo, forzar=job.forzar)
+
+        job.artefacto = artefacto
+        job.estado = GenerationJob.TERMINADO
+        job.error = ''
+    except LimiteExcedido as e:
+        # Sin cuota por ahora: con worker vuelve a la cola hasta que haya cuota
+        # (los demás trabajos pasan antes); en modo síncrono o sin intentos, falla
+        reintentar = (getattr(settings, 'GENERACION_ASINCRONA', True) and e.espera != float('inf')
+                      and job.intentos < getattr(settings, 'GENERACION_INTENTOS_MAXIMOS', 5))
+        job.estado = GenerationJob.EN_COLA if reintentar else GenerationJob.FALLIDO
+        job.no_antes_de = timezone.now() + timedelta(seconds=e.espera) if reintentar else None
+        job.error = str(e)
+    except Exception as e:
+        logger.exception("Error al ejecutar la generación %s", job.pk)
+        job.estado = GenerationJob.FALLIDO
+        job.error = str(e)
+
+    if job.estado != GenerationJob.EN_COLA:
+        job.terminado = timezone.now()
+    job.save(update_fields=['artefacto', 'estado', 'error', 'terminado', 'no_antes_de'])
+    return job
+
+def ejecutar_job_en_hilo(job: GenerationJob) -> GenerationJob:
+    """Igual que ejecutar_job, cerrando las conexiones de BD del hilo al terminar."""
+    try:
+        return ejecutar_job(job)
+    finally:
+        connections.close_all()
@@ -0,0 +1,25 @@
+from datetime import timedelta
+
+from django.conf import settings # pyright: ignore[reportMissingModuleSource]
+from django.core.management.base import BaseCommand # pyright: ignore[reportMissingModuleSource]
+
+from documentacion.observabilidad import consolidar_llamadas
+
+
+class Command(BaseCommand):
+    help = (
+        "Suma las llamadas a la IA registradas en LLMCallLog a los totales de /metrics (LLMCallResumen) "
+        "y borra las de más de RETENCION_DIAS. Pensado para ejecutarse periódicamente (cron)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--retencion-dias', type=int,
+            default=getattr(settings, 'IA_REGISTRO_LLAMADAS', {}).get('RETENCION_DIAS', 30),
+            help="Días que se conserva cada llamada; 0 para no borrar ninguna."
+        )
+
+    def handle(self, *args, **options):
+        dias = options['retencion_dias']
+        consolidadas, borradas = consolidar_llamadas(timedelta(days=dias) if dias else None)
+        self.stdout.write(f"{consolidadas} llamada(s) consolidada(s), {borradas} borrada(s).")
@@ -0,0 +1,279 @@
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from django.conf import settings # pyright: ignore[reportMissingModuleSource]
+from django.contrib.auth.models import User # pyright: ignore[reportMissingModuleSource]
+from django.core.management.base import BaseCommand, CommandError # pyright: ignore[reportMissingModuleSource]
+from django.db import connection # pyright: ignore[reportMissingModuleSource]
+from django.test import Client, override_settings # pyright: ignore[reportMissingModuleSource]
+from django.urls import reverse # pyright: ignore[reportMissingModuleSource]
+
+from core.cache import reiniciar_cache
+from core.limites import reiniciar_limitador
+from core.proveedores import reiniciar_backend, texto_simulado
+from documentacion.forms import ProjectForm, texto_coherente
+from documentacion.models import Artefacto, Fase, GenerationJob, Project, SubArtefacto
+from documentacion.render import construir_render, limpiar_mermaid
+
+LINEA_BASE = Path(settings.BASE_DIR) / 'benchmarks' / 'linea_base.json'
+
+DESCRIPCION = (
+    "Sistema web para gestionar las ventas, el inventario y los clientes de una tienda local, "
+    "con reportes diarios, control de stock y registro de pagos en efectivo y con tarjeta."
+)
+
+# Lo que hace un worker al arrancar: cargar Django, las URLs y las vistas.
+# Se mide en un proceso nuevo, con y sin importar el SDK de Gemini (que las
+# vistas ya no importan al cargarse; el script falla si vuelven a hacerlo).
+ARRANQUE = (
+    "import sys, django; django.setup(); "
+    "from django.urls import resolve; resolve('/'); import documentacion.views; "
+    "assert 'google.generativeai' not in sys.modules, 'las vistas importan el SDK de Gemini'"
+)
+ARRANQUE_CON_SDK = ARRANQUE + "; import google.generativeai"
+
+# ===== MEDICIÓN =====
+
+def _percentil(valores: List[float], p: float) -> float:
+    ordenados = sorted(valores)
+    indice = (len(ordenados) - 1) * p / 100
+    bajo = int(indice)
+    alto = min(bajo + 1, len(ordenados) - 1)
+    return ordenados[bajo] + (ordenados[alto] - ordenados[bajo]) * (indice - bajo)
+
+
+def medir(funcion: Callable[[int], None], repeticiones: int, calentamiento: int = 1) -> Dict[str, float]:
+    """Ejecuta `funcion(i)` y devuelve latencias (ms) y operaciones por segundo."""
+    for i in range(calentamiento):
+        funcion(repeticiones + i)
+    tiempos = []
+    inicio_total = time.perf_counter()
+    for i in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion(i)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    total = time.perf_counter() - inicio_total
+    return {
+        "n": repeticiones,
+        "media_ms": round(statistics.fmean(tiempos), 3),
+        "p50_ms": round(_percentil(tiempos, 50), 3),
+        "p95_ms": round(_percentil(tiempos, 95), 3),
+        "p99_ms": round(_percentil(tiempos, 99), 3),
+        "ops_s": round(repeticiones / total, 2),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide el rendimiento de las rutas críticas (crear y ver proyectos, generar artefactos, "
+        "limpiar Mermaid, validar formularios) con el backend de IA local y una base de datos de prueba, "
+        "y el tiempo de arranque de un proceso con y sin el SDK de Gemini."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeticiones', type=int, default=30)
+        parser.add_argument('--repeticiones-arranque', type=int, default=5,
+                            help="Procesos que se arrancan en las mediciones de arranque.")
+        parser.add_argument('--latencia', type=float, default=50, help="Latencia simulada de Gemini en ms.")
+        parser.add_argument('--tamano', type=int, default=4000, help="Caracteres de cada respuesta simulada.")
+        parser.add_argument('--artefactos', type=int, default=200,
+                            help="Artefactos del proyecto que se muestra en detalle_proyecto.")
+        parser.add_argument('--solo', nargs='+', metavar='NOMBRE', help="Ejecuta solo estas mediciones.")
+        parser.add_argument('--base', default=str(LINEA_BASE), help="Archivo de línea base para comparar.")
+        parser.add_argument('--guardar-base', action='store_true', help="Guarda los resultados como línea base.")
+        parser.add_argument('--tolerancia', type=float, default=20,
+                            help="Porcentaje de empeoramiento del p50 que se marca como regresión.")
+        parser.add_argument('--estricto', action='store_true', help="Termina con error si hay regresiones.")
+
+    def handle(self, *args, **options):
+        random.seed(0)
+        ajustes = {
+            'ALLOWED_HOSTS': ['testserver', 'localhost'],
+            'IA_CACHE': {'BACKEND': 'ninguno'},
+            'IA_LIMITES': {'BACKEND': 'ninguno'},
+            'IA_CACHE_CONTEXTO': {'ACTIVO': False},
+            'GENERACION_ASINCRONA': False,
+            'MERMAID_CLI': {**getattr(settings, 'MERMAID_CLI', {}), 'FORMATOS': []},
+            # Sin grabaciones: respuestas simuladas, deterministas y sin variación de latencia
+            'IA_BACKEND': {
+                'NOMBRE': 'local',
+                'LATENCIA': options['latencia'] / 1000,
+                'VARIACION': 0,
+                'TAMANO': options['tamano'],
+            },
+        }
+
+        nombre_original = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(**ajustes):
+                reiniciar_cache()
+                reiniciar_limitador()
+                reiniciar_backend()
+                resultados = self._ejecutar(options)
+        finally:
+            connection.creation.destroy_test_db(nombre_original, verbosity=0)
+            reiniciar_cache()
+            reiniciar_limitador()
+            reiniciar_backend()
+
+        base = self._leer_base(options['base'])
+        regresiones = self._informar(resultados, base, options['tolerancia'])
+        if 'arranque' in resultados and 'arranque_con_sdk' in resultados:
+            ahorro = resultados['arranque_con_sdk']['p50_ms'] - resultados['arranque']['p50_ms']
+            self.stdout.write(f"\nImportar el SDK de Gemini al primer uso ahorra {ahorro:.0f} ms por arranque (p50).")
+
+        if options['guardar_base']:
+            ruta = Path(options['base'])
+            ruta.parent.mkdir(parents=True, exist_ok=True)
+            ruta.write_text(json.dumps({
+                'entorno': {
+                    'python': platform.python_version(),
+                    'maquina': platform.machine(),
+                    'latencia_ms': options['latencia'],
+                    'tamano': options['tamano'],
+                    'artefactos': options['artefactos'],
+                },
+                'resultados': resultados,
+            }, indent=2, ensure_ascii=False) + "\n", encoding='utf-8')
+            self.stdout.write(f"Línea base guardada en {ruta}")
+
+        if regresiones and options['estricto']:
+            raise CommandError(f"Regresiones de rendimiento: {', '.join(regresiones)}")
+
+    # ----- mediciones -----
+
+    def _ejecutar(self, options) -> Dict[str, Dict[str, float]]:
+        usuario = User.objects.create_user('benchmark', password='clave-benchmark-123')
+        cliente = Client()
+        cliente.force_login(usuario)
+        repeticiones = options['repeticiones']
+
+        mediciones = {
+            'crear_proyecto': lambda: self._crear_proyecto(cliente),
+            'detalle_proyecto': lambda: self._detalle_proyecto(cliente, usuario, options['artefactos']),
+            'generar_artefacto': lambda: self._generar_artefacto(cliente),
+            'limpiar_mermaid': lambda: self._limpiar_mermaid(options['tamano'] * 25),
+            'validar_proyecto': lambda: self._validar_proyecto(),
+            'arranque': lambda: self._arrancar(ARRANQUE),
+            'arranque_con_sdk': lambda: self._arrancar(ARRANQUE_CON_SDK),
+        }
+        desconocidas = set(options['solo'] or []) - set(mediciones)
+        if desconocidas:
+            raise CommandError(f"Mediciones desconocidas: {', '.join(sorted(desconocidas))}")
+
+        resultados = {}
+        for nombre, preparar in mediciones.items():
+            if options['solo'] and nombre not in options['solo']:
+                continue
+            n = options['repeticiones_arranque'] if nombre.startswith('arranque') else repeticiones
+            resultados[nombre] = medir(preparar(), n)
+            self.stdout.write(f"· {nombre}: {resultados[nombre]['p50_ms']} ms (p50)")
+        return resultados
+
+    def _crear_proyecto(self, cliente: Client) -> Callable[[int], None]:
+        url = reverse('crear_proyecto')
+
+        def crear(i: int) -> None:
+            respuesta = cliente.post(url, {'nombre': f'Sistema gestion ventas {i}', 'descripcion': DESCRIPCION})
+            assert respuesta.status_code == 302, respuesta.status_code
+        return crear
+
+    def _proyecto(self, cliente: Client, nombre: str) -> Project:
+        cliente.post(reverse('crear_proyecto'), {'nombre': nombre, 'descripcion': DESCRIPCION})
+        return Project.objects.get(nombre=nombre)
+
+    def _detalle_proyecto(self, cliente: Client, usuario: User, cantidad: int) -> Callable[[int], None]:
+        proyecto = self._proyecto(cliente, 'Proyecto con muchos artefactos')
+        subartefactos = list(SubArtefacto.objects.select_related('fase'))
+        contenido = texto_simulado("classDiagram", 2000, random.Random(0))
+        for i in range(cantidad):
+            sub = subartefactos[i % len(subartefactos)]
+            titulo = sub.nombre if i < len(subartefactos) else f"{sub.nombre} v{i}"
+            artefacto = Artefacto(proyecto=proyecto, fase=sub.fase, subartefacto=sub, titulo=titulo,
+                                  tipo='DISE', contenido=contenido, contexto="RF1. Registrar ventas.")
+            artefacto.save()
+        url = reverse('detalle_proyecto', args=[proyecto.id])
+
+        def ver(i: int) -> None:
+            respuesta = cliente.get(url)
+            assert respuesta.status_code == 200, respuesta.status_code
+        return ver
+
+    def _generar_artefacto(self, cliente: Client) -> Callable[[int], None]:
+        proyecto = self._proyecto(cliente, 'Proyecto para generar artefactos')
+        fase = Fase.objects.get(nombre="Análisis Requisitos")
+        Artefacto.objects.create(
+            proyecto=proyecto, fase=fase, tipo='AREQ', titulo="Historia de Usuario",
+            contenido="HU1: Como vendedor quiero registrar ventas.", contexto="RF1. El sistema registra ventas.",
+        )
+        titulo = "Diagrama de clases"
+        url = reverse('generar_artefacto', args=[proyecto.id, titulo])
+
+        def generar(i: int) -> None:
+            Artefacto.objects.filter(proyecto=proyecto, titulo=titulo).delete()
+            GenerationJob.objects.filter(proyecto=proyecto).delete()
+            cliente.get(url)
+            assert Artefacto.objects.filter(proyecto=proyecto, titulo=titulo).exists()
+        return generar
+
+    def _limpiar_mermaid(self, tamano: int) -> Callable[[int], None]:
+        codigo = texto_simulado("classDiagram", tamano, random.Random(0))
+        texto = f"```mermaid\n{codigo}\n```"
+
+        def limpiar(i: int) -> None:
+            construir_render(texto, True)
+            assert limpiar_mermaid(texto) == codigo
+        return limpiar
+
+    def _validar_proyecto(self) -> Callable[[int], None]:
+        descripcion = " ".join([DESCRIPCION] * 20)
+
+        def validar(i: int) -> None:
+            assert ProjectForm({'nombre': f'Sistema gestion ventas {i}', 'descripcion': descripcion}).is_valid()
+            assert texto_coherente(descripcion)
+        return validar
+
+    def _arrancar(self, codigo: str) -> Callable[[int], None]:
+        entorno = {'DJANGO_SETTINGS_MODULE': 'docai_project.settings', **os.environ}
+
+        def arrancar(i: int) -> None:
+            proceso = subprocess.run([sys.executable, '-c', codigo], cwd=settings.BASE_DIR, env=entorno,
+                                     capture_output=True, text=True)
+            if proceso.returncode:
+                raise CommandError(f"El arranque falló:\n{proceso.stderr}")
+        return arrancar
+
+    # ----- informe -----
+
+    def _leer_base(self, ruta: str) -> Dict[str, Dict[str, float]]:
+        try:
+            return json.loads(Path(ruta).read_text(encoding='utf-8')).get('resultados', {})
+        except (OSError, ValueError):
+            return {}
+
+    def _informar(self, resultados, base, tolerancia: float) -> List[str]:
+        self.stdout.write("")
+        self.stdout.write(f"{'medición':<20}{'p50':>10}{'p95':>10}{'p99':>10}{'ops/s':>10}{'vs base':>12}")
+        regresiones = []
+        for nombre, r in resultados.items():
+            comparacion = ""
+            anterior = base.get(nombre)
+            if anterior and anterior.get('p50_ms'):
+                cambio = (r['p50_ms'] - anterior['p50_ms']) / anterior['p50_ms'] * 100
+                comparacion = f"{cambio:+.1f}%"
+                if cambio > tolerancia:
+                    regresiones.append(nombre)
+                    comparacion += " ✗"
+            self.stdout.write(
+                f"{nombre:<20}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}"
+                f"{r['ops_s']:>10.1f}{comparacion:>12}"
+            )
+        return regresiones
@@ -0,0 +1,83 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from django.conf import settings # pyright: ignore[reportMissingModuleSource]
+from django.core.management.base import BaseCommand # pyright: ignore[reportMissingModuleSource]
+
+from django.db import connections # pyright: ignore[reportMissingModuleSource]
+
+from documentacion.generacion import (tomar_siguiente_job, ejecutar_job_en_hilo, recuperar_jobs_huerfanos,
+                                      renderizar_pendientes)
+
+
+def renderizar_en_hilo() -> int:
+    try:
+        return renderizar_pendientes()
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = (
+        "Procesa la cola de generaciones con IA (GenerationJob) con concurrencia limitada y, en los huecos "
+        "libres, renderiza los diagramas pendientes (SVG/PNG con mermaid-cli)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrencia', type=int, default=getattr(settings, 'GENERACION_CONCURRENCIA', 4),
+            help="Número máximo de generaciones simultáneas."
+        )
+        parser.add_argument(
+            '--intervalo', type=float, default=1.0,
+            help="Segundos de espera cuando la cola está vacía."
+        )
+        parser.add_argument(
+            '--una-vez', action='store_true',
+            help="Termina cuando la cola y los diagramas pendientes quedan vacíos en lugar de seguir esperando trabajos."
+        )
+
+    def handle(self, *args, **options):
+        concurrencia = max(1, options['concurrencia'])
+        recuperados = recuperar_jobs_huerfanos()
+        if recuperados:
+            self.stdout.write(f"{recuperados} trabajo(s) interrumpido(s) marcado(s) como fallido(s).")
+        self.stdout.write(f"Procesando generaciones con concurrencia {concurrencia}...")
+
+        en_curso = set()
+        render = None  # lote de diagramas en curso: como mucho uno, en un hueco libre
+        sin_diagramas = 0.0  # última vez que no había ninguno pendiente
+        with ThreadPoolExecutor(max_workers=concurrencia) as pool:
+            try:
+                while True:
+                    while len(en_curso) < concurrencia:
+                        job = tomar_siguiente_job()
+                        if job is None:
+                            break
+                        self.stdout.write(f"→ {job.titulo} (proyecto {job.proyecto_id})")
+                        en_curso.add(pool.submit(ejecutar_job_en_hilo, job))
+
+                    if (render is None and len(en_curso) < concurrencia
+                            and time.monotonic() - sin_diagramas >= options['intervalo']):
+                        render = pool.submit(renderizar_en_hilo)
+                        en_curso.add(render)
+
+                    if en_curso:
+                        terminados, en_curso = wait(en_curso, timeout=options['intervalo'], return_when=FIRST_COMPLETED)
+                        for futuro in terminados:
+                            if futuro is render:
+                                render = None
+                                renderizados = futuro.result()
+                                if renderizados:
+                                    self.stdout.write(f"✓ {renderizados} diagrama(s) renderizado(s)")
+                                else:
+                                    sin_diagramas = time.monotonic()
+                                continue
+                            job = futuro.result()
+                            self.stdout.write(f"✓ {job.titulo}: {job.get_estado_display()}")
+                    elif options['una_vez']:
+                        break
+                    else:
+                        time.sleep(options['intervalo'])
+            except KeyboardInterrupt:
+                self.stdout.write("Deteniendo: esperando a que terminen las generaciones en curso...")
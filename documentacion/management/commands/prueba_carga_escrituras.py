@@ -0,0 +1,134 @@
+import random
+import statistics
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from django.conf import settings # pyright: ignore[reportMissingModuleSource]
+from django.contrib.auth.models import User # pyright: ignore[reportMissingModuleSource]
+from django.core.management.base import BaseCommand, CommandError # pyright: ignore[reportMissingModuleSource]
+from django.db import OperationalError, connection, connections # pyright: ignore[reportMissingModuleSource]
+from django.test import override_settings # pyright: ignore[reportMissingModuleSource]
+
+from core.proveedores import texto_simulado
+from documentacion.catalogo import obtener_catalogo
+from documentacion.generacion import guardar_artefacto, reservar_generacion, terminar_job
+from documentacion.models import GenerationJob, Project
+
+
+class Command(BaseCommand):
+    help = (
+        "Prueba de carga de escrituras: varios hilos, cada uno con su conexión, guardan generaciones a la "
+        "vez (trabajo en vuelo, artefacto comprimido y cierre del trabajo, sin llamar a la IA) en una base "
+        "de prueba del motor configurado, y se mide cuántas por segundo se completan y cuántas fallan."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hilos', type=int, nargs='+', default=[1, 4, 8],
+                            help="Escritores simultáneos; una ronda por cada valor.")
+        parser.add_argument('--generaciones', type=int, default=300, help="Generaciones por ronda.")
+        parser.add_argument('--tamano', type=int, default=4000, help="Caracteres de cada artefacto.")
+        parser.add_argument('--sin-ajustes', action='store_true',
+                            help="SQLite sin WAL, busy_timeout ni BEGIN IMMEDIATE, para comparar.")
+
+    def handle(self, *args, **options):
+        ajustes = {'MERMAID_CLI': {**getattr(settings, 'MERMAID_CLI', {}), 'FORMATOS': []}}
+        opciones_bd = connection.settings_dict.setdefault('OPTIONS', {})
+        if connection.vendor == 'sqlite':
+            # Un archivo, no la base en memoria de los tests: el bloqueo es el de producción
+            if not connection.settings_dict['TEST'].get('NAME'):
+                connection.settings_dict['TEST']['NAME'] = str(Path(settings.BASE_DIR) / 'prueba_carga.sqlite3')
+            if options['sin_ajustes']:
+                ajustes['SQLITE_AJUSTES'] = {'ACTIVO': False}
+                opciones_bd.pop('transaction_mode', None)
+        elif options['sin_ajustes']:
+            raise CommandError("--sin-ajustes solo tiene sentido con SQLite.")
+
+        with override_settings(**ajustes):
+            nombre_original = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                self.stdout.write(f"Motor: {connection.vendor}  {self._describir()}")
+                usuario = User.objects.create_user('carga', password='clave-carga-123')
+                obtener_catalogo()
+                resultados = {
+                    hilos: self._ronda(usuario, hilos, options['generaciones'], options['tamano'])
+                    for hilos in options['hilos']
+                }
+            finally:
+                connections.close_all()
+                connection.creation.destroy_test_db(nombre_original, verbosity=0)
+        self._informar(resultados)
+
+    def _describir(self) -> str:
+        if connection.vendor != 'sqlite':
+            pool = connection.settings_dict.get('OPTIONS', {}).get('pool')
+            return f"pool={'sí' if pool else 'no'} CONN_MAX_AGE={connection.settings_dict.get('CONN_MAX_AGE')}"
+        with connection.cursor() as cursor:
+            valores = []
+            for pragma in ('journal_mode', 'synchronous', 'busy_timeout'):
+                cursor.execute(f"PRAGMA {pragma}")
+                valores.append(f"{pragma}={cursor.fetchone()[0]}")
+        modo = connection.settings_dict['OPTIONS'].get('transaction_mode', 'DEFERRED')
+        return " ".join(valores + [f"transaction_mode={modo}"])
+
+    def _ronda(self, usuario: User, hilos: int, generaciones: int, tamano: int) -> Dict[str, float]:
+        titulos = list(obtener_catalogo().subartefactos)
+        proyectos = [
+            Project.objects.create(nombre=f'Carga {hilos} hilos {i}', propietario=usuario)
+            for i in range((generaciones + len(titulos) - 1) // len(titulos))
+        ]
+        contenidos = [texto_simulado("classDiagram", tamano, random.Random(i)) for i in range(16)]
+        siguiente = iter(range(generaciones))
+        candado = threading.Lock()
+        latencias: List[float] = []
+        errores: List[str] = []
+
+        def escritor() -> None:
+            try:
+                while True:
+                    with candado:
+                        i = next(siguiente, None)
+                    if i is None:
+                        return
+                    proyecto, titulo = proyectos[i // len(titulos)], titulos[i % len(titulos)]
+                    inicio = time.perf_counter()
+                    try:
+                        job, _ = reservar_generacion(proyecto, titulo, estado=GenerationJob.EJECUTANDO)
+                        artefacto = guardar_artefacto(proyecto, titulo, contenidos[i % len(contenidos)], tipo='DISE')
+                        terminar_job(job, artefacto)
+                    except OperationalError as e:  # "database is locked" en SQLite
+                        with candado:
+                            errores.append(str(e))
+                        continue
+                    with candado:
+                        latencias.append((time.perf_counter() - inicio) * 1000)
+            finally:
+                connections.close_all()
+
+        inicio = time.perf_counter()
+        escritores = [threading.Thread(target=escritor) for _ in range(hilos)]
+        for hilo in escritores:
+            hilo.start()
+        for hilo in escritores:
+            hilo.join()
+        total = time.perf_counter() - inicio
+
+        percentiles = statistics.quantiles(latencias, n=100) if len(latencias) > 1 else [0.0] * 99
+        self.stdout.write(f"· {hilos} hilos: {len(latencias) / total:.1f} generaciones/s, {len(errores)} errores")
+        if errores:
+            self.stdout.write(f"  p. ej.: {errores[0]}")
+        return {
+            "por_segundo": len(latencias) / total,
+            "p50_ms": percentiles[49],
+            "p95_ms": percentiles[94],
+            "errores": len(errores),
+        }
+
+    def _informar(self, resultados: Dict[int, Dict[str, float]]) -> None:
+        self.stdout.write("")
+        self.stdout.write(f"{'hilos':>6}{'gen/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'errores':>10}")
+        for hilos, r in resultados.items():
+            self.stdout.write(
+                f"{hilos:>6}{r['por_segundo']:>10.1f}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['errores']:>10}"
+            )
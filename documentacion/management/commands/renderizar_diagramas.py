@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand # pyright: ignore[reportMissingModuleSource]
+
+from documentacion.generacion import renderizar_diagrama
+from documentacion.models import Artefacto, ARTEFACTOS_MERMAID
+
+
+class Command(BaseCommand):
+    help = "Renderiza en el servidor (SVG/PNG con mermaid-cli) los diagramas que aún no tienen imagen."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--proyecto', type=int,
+            help="Solo los diagramas de este proyecto."
+        )
+
+    def handle(self, *args, **options):
+        # El código sale de contenido; contexto (los requisitos) no hace falta
+        artefactos = Artefacto.objects.filter(titulo__in=ARTEFACTOS_MERMAID).defer('contexto')
+        if options['proyecto']:
+            artefactos = artefactos.filter(proyecto_id=options['proyecto'])
+
+        renderizados = 0
+        for artefacto in artefactos.iterator():
+            # Los render antiguos no tienen hash: se recalculan antes de renderizar
+            if not (artefacto.render or {}).get("hash"):
+                artefacto.actualizar_render()
+                artefacto.save(update_fields=['render', 'render_pendiente'])
+            if renderizar_diagrama(artefacto):
+                renderizados += 1
+            else:
+                self.stdout.write(f"✗ {artefacto.titulo} (artefacto {artefacto.id}) no se pudo renderizar.")
+        self.stdout.write(f"{renderizados} diagrama(s) renderizado(s).")
@@ -0,0 +1,37 @@
+# Generated by Django 5.2 on 2026-10-18 12:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documentacion', '0004_alter_securityquestions_pregunta1_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenerationJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('titulo', models.CharField(max_length=100)),
+                ('tipo', models.CharField(blank=True, choices=[('AREQ', 'Análisis de Requisitos'), ('DISE', 'Diseño'), ('DEVS', 'Desarrollo'), ('PRUE', 'Pruebas'), ('DESP', 'Despliegue')], max_length=4)),
+                ('forzar', models.BooleanField(default=False)),
+                ('estado', models.CharField(choices=[('queued', 'En cola'), ('running', 'Generando'), ('done', 'Terminado'), ('failed', 'Fallido')], db_index=True, default='queued', max_length=10)),
+                ('error', models.TextField(blank=True)),
+                ('intentos', models.PositiveSmallIntegerField(default=0)),
+                ('creado', models.DateTimeField(auto_now_add=True)),
+                ('iniciado', models.DateTimeField(blank=True, null=True)),
+                ('terminado', models.DateTimeField(blank=True, null=True)),
+                ('artefacto', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='generaciones', to='documentacion.artefacto')),
+                ('proyecto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='generaciones', to='documentacion.project')),
+                ('subartefacto', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='generaciones', to='documentacion.subartefacto')),
+            ],
+            options={
+                'verbose_name': 'Trabajo de generación',
+                'verbose_name_plural': 'Trabajos de generación',
+                'ordering': ['creado'],
+            },
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 5.2 on 2026-10-18 12:43
+
+import hashlib
+
+from django.db import migrations, models
+
+# Copia congelada de documentacion.render.construir_render: la migración debe
+# producir siempre lo mismo aunque el render de la aplicación cambie.
+VERSION_RENDER = 2
+
+
+def limpiar_mermaid(texto):
+    texto = texto.strip()
+    if texto.startswith("```mermaid"):
+        texto = texto.replace("```mermaid", "", 1).strip()
+    if texto.endswith("```"):
+        texto = texto[:texto.rfind("```")].strip()
+    return texto
+
+
+def tipo_diagrama(codigo):
+    for linea in codigo.splitlines():
+        linea = linea.strip()
+        if linea and not linea.startswith("%%"):
+            return linea.split()[0]
+    return ""
+
+
+def construir_render(contenido, es_mermaid):
+    if not es_mermaid:
+        return {"tipo": "texto", "version": VERSION_RENDER}
+    codigo = limpiar_mermaid(contenido or "")
+    return {
+        "tipo": "mermaid",
+        "version": VERSION_RENDER,
+        "codigo": codigo,
+        "diagrama": tipo_diagrama(codigo),
+        "lineas": len(codigo.splitlines()),
+        "hash": hashlib.sha256(codigo.encode("utf-8")).hexdigest(),
+        "archivos": [],
+    }
+
+
+DIAGRAMAS = {
+    "Diagrama de flujo",
+    "Diagrama de clases",
+    "Diagrama de Entidad-Relacion",
+    "Diagrama de secuencia",
+    "Diagrama de estado",
+    "Diagrama de C4-contexto",
+    "Diagrama de C4-contenedor",
+    "Diagrama de C4-implementación",
+}
+
+
+def calcular_render(apps, schema_editor):
+    Artefacto = apps.get_model("documentacion", "Artefacto")
+    for artefacto in Artefacto.objects.only("id", "titulo", "contenido").iterator():
+        artefacto.render = construir_render(artefacto.contenido, artefacto.titulo in DIAGRAMAS)
+        artefacto.save(update_fields=["render"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documentacion', '0005_generationjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='artefacto',
+            name='render',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(calcular_render, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 12:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documentacion', '0006_artefacto_render'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='artefacto',
+            name='plantilla',
+            field=models.CharField(blank=True, max_length=60),
+        ),
+    ]
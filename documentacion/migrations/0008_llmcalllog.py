@@ -0,0 +1,37 @@
+# Generated by Django 5.2 on 2026-10-18 12:58
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documentacion', '0007_artefacto_plantilla'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMCallLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('creado', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('tipo', models.CharField(max_length=60)),
+                ('modelo', models.CharField(max_length=60)),
+                ('cache', models.BooleanField(default=False)),
+                ('tokens_entrada', models.PositiveIntegerField(default=0)),
+                ('tokens_salida', models.PositiveIntegerField(default=0)),
+                ('latencia_ms', models.PositiveIntegerField(default=0)),
+                ('error', models.CharField(blank=True, max_length=60)),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Llamada a la IA',
+                'verbose_name_plural': 'Llamadas a la IA',
+                'ordering': ['-creado'],
+            },
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2 on 2026-10-18 13:11
+
+from django.db import migrations, models
+from django.db.models import Case, Count, IntegerField, Q, Value, When
+
+
+def _relleno(campo):
+    """1 si el campo de texto tiene algo, 0 si está vacío o es NULL."""
+    vacio = Q(**{f'{campo}__isnull': True}) | Q(**{campo: ''})
+    return Case(When(vacio, then=Value(0)), default=Value(1), output_field=IntegerField())
+
+
+def quitar_duplicados(apps, schema_editor):
+    """Deja un artefacto por (proyecto, título) y una generación pendiente por (proyecto, título)."""
+    Artefacto = apps.get_model('documentacion', 'Artefacto')
+    GenerationJob = apps.get_model('documentacion', 'GenerationJob')
+
+    repetidos = (Artefacto.objects.order_by().values('proyecto_id', 'titulo')
+                 .annotate(n=Count('id')).filter(n__gt=1))
+    for grupo in repetidos:
+        # Se conserva el que tiene contenido (y contexto) y, entre esos, el
+        # editado más recientemente: un duplicado vacío nunca gana a uno lleno
+        ids = list(Artefacto.objects.filter(proyecto_id=grupo['proyecto_id'], titulo=grupo['titulo'])
+                   .annotate(con_contenido=_relleno('contenido'), con_contexto=_relleno('contexto'))
+                   .order_by('-con_contenido', '-con_contexto', '-actualizado', '-id')
+                   .values_list('id', flat=True))
+        GenerationJob.objects.filter(artefacto_id__in=ids[1:]).update(artefacto_id=ids[0])
+        Artefacto.objects.filter(id__in=ids[1:]).delete()
+
+    pendientes = ('queued', 'running')
+    repetidos = (GenerationJob.objects.filter(estado__in=pendientes).order_by().values('proyecto_id', 'titulo')
+                 .annotate(n=Count('id')).filter(n__gt=1))
+    for grupo in repetidos:
+        # Sigue en vuelo el más antiguo; el resto queda como fallido
+        ids = list(GenerationJob.objects.filter(proyecto_id=grupo['proyecto_id'], titulo=grupo['titulo'],
+                                                estado__in=pendientes)
+                   .order_by('creado', 'id').values_list('id', flat=True))
+        GenerationJob.objects.filter(id__in=ids[1:]).update(estado='failed', error='Generación duplicada.')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documentacion', '0008_llmcalllog'),
+    ]
+
+    operations = [
+        migrations.RunPython(quitar_duplicados, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='artefacto',
+            constraint=models.UniqueConstraint(fields=('proyecto', 'titulo'), name='artefacto_unico_por_proyecto'),
+        ),
+        migrations.AddConstraint(
+            model_name='generationjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('estado__in', ['queued', 'running'])), fields=('proyecto', 'titulo'), name='generacion_en_vuelo_unica'),
+        ),
+    ]
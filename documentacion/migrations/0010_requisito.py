@@ -0,0 +1,101 @@
+# Generated by Django 5.2 on 2026-10-18 13:15
+
+import hashlib
+import re
+import unicodedata
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Copia congelada de los ayudantes de documentacion.requisitos: la migración
+# debe producir siempre los mismos hashes aunque el parser de la aplicación cambie.
+_CODIGO_RF = re.compile(r"^\W*(RF\s*-?\s*\d+)\s*[.:)\-–—]?\s*(.*)$", re.IGNORECASE)
+
+
+def _normalizar(texto):
+    texto = unicodedata.normalize("NFC", texto or "").lower()
+    return " ".join(texto.split()).rstrip(" .;")
+
+
+def hash_texto(*partes):
+    return hashlib.sha256("\x1f".join(partes).encode("utf-8")).hexdigest()[:16]
+
+
+def parsear_requisitos(contexto):
+    lineas = [linea.strip() for linea in (contexto or "").splitlines() if linea.strip()]
+    if not any(_CODIGO_RF.match(linea) for linea in lineas):
+        return [(f"RF{i}", linea) for i, linea in enumerate(lineas, 1)]
+
+    requisitos = []
+    for linea in lineas:
+        coincidencia = _CODIGO_RF.match(linea)
+        if coincidencia:
+            codigo = re.sub(r"[\s-]", "", coincidencia.group(1)).upper()
+            requisitos.append([codigo, coincidencia.group(2).strip()])
+        elif requisitos:
+            requisitos[-1][1] = f"{requisitos[-1][1]} {linea}".strip()
+    return [(codigo, texto) for codigo, texto in requisitos if texto]
+
+
+def anotar_existentes(apps, schema_editor):
+    """
+    Parte de los RF de cada HU y da por vigentes los artefactos ya generados
+    (hasta ahora se reutilizaban siempre), con la huella actual del proyecto.
+    """
+    Artefacto = apps.get_model('documentacion', 'Artefacto')
+    Requisito = apps.get_model('documentacion', 'Requisito')
+    for hu in Artefacto.objects.filter(titulo='Historia de Usuario').select_related('proyecto'):
+        contexto = hu.contexto or ""
+        if contexto.startswith("[ERROR"):
+            contexto = ""
+        filas = {}
+        for orden, (codigo, texto) in enumerate(parsear_requisitos(contexto)):
+            filas.setdefault(hash_texto(_normalizar(texto)), Requisito(
+                proyecto_id=hu.proyecto_id, codigo=codigo, texto=texto, orden=orden))
+        for clave, fila in filas.items():
+            fila.hash = clave
+        Requisito.objects.bulk_create(filas.values())
+        proyecto = hu.proyecto
+        Artefacto.objects.filter(proyecto_id=proyecto.id, generado_por_ia=True).update(
+            huella=hash_texto(_normalizar(proyecto.nombre), _normalizar(proyecto.descripcion)),
+            requisitos=list(filas),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documentacion', '0009_artefacto_unico_generacion_en_vuelo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='artefacto',
+            name='huella',
+            field=models.CharField(blank=True, max_length=16),
+        ),
+        migrations.AddField(
+            model_name='artefacto',
+            name='requisitos',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.CreateModel(
+            name='Requisito',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hash', models.CharField(max_length=16)),
+                ('codigo', models.CharField(max_length=10)),
+                ('texto', models.TextField()),
+                ('orden', models.PositiveSmallIntegerField(default=0)),
+                ('activo', models.BooleanField(default=True)),
+                ('proyecto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='requisitos', to='documentacion.project')),
+            ],
+            options={
+                'verbose_name': 'Requisito',
+                'verbose_name_plural': 'Requisitos',
+                'ordering': ['orden'],
+                'unique_together': {('proyecto', 'hash')},
+            },
+        ),
+        migrations.RunPython(anotar_existentes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2 on 2026-10-18 13:18
+
+from django.db import migrations, models
+
+# Orden en que detalle_proyecto mostraba las fases y subartefactos
+FASES = {
+    "Análisis Requisitos": ["Historia de Usuario", "Diagrama de flujo"],
+    "Diseño": ["Diagrama de clases", "Diagrama de Entidad-Relacion"],
+    "Desarrollo": ["Diagrama de secuencia", "Diagrama de estado"],
+    "Pruebas": ["caja negra", "smoke"],
+    "Despliegue": ["Diagrama de C4-contexto", "Diagrama de C4-contenedor", "Diagrama de C4-implementación"],
+}
+
+
+def ordenar_existentes(apps, schema_editor):
+    Fase = apps.get_model('documentacion', 'Fase')
+    SubArtefacto = apps.get_model('documentacion', 'SubArtefacto')
+    for orden_fase, (fase, subartefactos) in enumerate(FASES.items()):
+        Fase.objects.filter(nombre=fase).update(orden=orden_fase)
+        for orden, nombre in enumerate(subartefactos):
+            SubArtefacto.objects.filter(fase__nombre=fase, nombre=nombre).update(orden=orden)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documentacion', '0010_requisito'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='fase',
+            options={'ordering': ['orden', 'nombre'], 'verbose_name': 'Fase', 'verbose_name_plural': 'Fases'},
+        ),
+        migrations.AlterModelOptions(
+            name='subartefacto',
+            options={'ordering': ['orden', 'nombre'], 'verbose_name': 'Subartefacto', 'verbose_name_plural': 'Subartefactos'},
+        ),
+        migrations.AddField(
+            model_name='fase',
+            name='orden',
+            field=models.PositiveSmallIntegerField(default=999),
+        ),
+        migrations.AddField(
+            model_name='subartefacto',
+            name='orden',
+            field=models.PositiveSmallIntegerField(default=999),
+        ),
+        migrations.RunPython(ordenar_existentes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,101 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Catálogo que se copiaba en cada proyecto al crearlo:
+# (fase, tipo, [(subartefacto, render)])
+CATALOGO = [
+    ("Análisis Requisitos", "AREQ", [
+        ("Historia de Usuario", "texto"),
+        ("Diagrama de flujo", "mermaid"),
+    ]),
+    ("Diseño", "DISE", [
+        ("Diagrama de clases", "mermaid"),
+        ("Diagrama de Entidad-Relacion", "mermaid"),
+    ]),
+    ("Desarrollo", "DEVS", [
+        ("Diagrama de secuencia", "mermaid"),
+        ("Diagrama de estado", "mermaid"),
+    ]),
+    ("Pruebas", "PRUE", [
+        ("caja negra", "texto"),
+        ("smoke", "texto"),
+    ]),
+    ("Despliegue", "DESP", [
+        ("Diagrama de C4-contexto", "mermaid"),
+        ("Diagrama de C4-contenedor", "mermaid"),
+        ("Diagrama de C4-implementación", "mermaid"),
+    ]),
+]
+
+
+def unificar_catalogo(apps, schema_editor):
+    """
+    Crea las fases y subartefactos globales (sin proyecto), pasa a ellos los
+    artefactos y trabajos de cada proyecto por nombre y borra las copias.
+    Las fases o subartefactos añadidos a mano en algún proyecto también pasan
+    al catálogo, detrás de los conocidos. Cada subartefacto global conserva el
+    enlace de sus copias; si varios proyectos tenían enlaces distintos, el de
+    la copia más antigua.
+    """
+    Fase = apps.get_model('documentacion', 'Fase')
+    SubArtefacto = apps.get_model('documentacion', 'SubArtefacto')
+    Artefacto = apps.get_model('documentacion', 'Artefacto')
+    GenerationJob = apps.get_model('documentacion', 'GenerationJob')
+
+    fases = {}
+    for orden, (nombre, tipo, _) in enumerate(CATALOGO):
+        fases[nombre] = Fase.objects.create(proyecto=None, nombre=nombre, tipo=tipo, orden=orden)
+    for nombre in (Fase.objects.exclude(proyecto=None).exclude(nombre__in=list(fases))
+                   .order_by('nombre').values_list('nombre', flat=True).distinct()):
+        fases[nombre] = Fase.objects.create(proyecto=None, nombre=nombre)
+
+    enlaces = {}
+    for nombre, enlace in (SubArtefacto.objects.exclude(fase__proyecto=None).exclude(enlace='')
+                           .order_by('pk').values_list('nombre', 'enlace')):
+        enlaces.setdefault(nombre, enlace)
+
+    subartefactos = {}
+    for nombre_fase, _, subs in CATALOGO:
+        for orden, (nombre, render) in enumerate(subs):
+            subartefactos[nombre] = SubArtefacto.objects.create(
+                fase=fases[nombre_fase], nombre=nombre, orden=orden, render=render, enlace=enlaces.get(nombre, ''),
+            )
+    for sub in (SubArtefacto.objects.exclude(fase__proyecto=None).exclude(nombre__in=list(subartefactos))
+                .select_related('fase').order_by('nombre', 'pk')):
+        if sub.nombre not in subartefactos:
+            subartefactos[sub.nombre] = SubArtefacto.objects.create(
+                fase=fases[sub.fase.nombre], nombre=sub.nombre, enlace=enlaces.get(sub.nombre, ''),
+            )
+
+    for nombre, fase in fases.items():
+        Artefacto.objects.filter(fase__nombre=nombre).exclude(fase=fase).update(fase=fase)
+    for nombre, sub in subartefactos.items():
+        Artefacto.objects.filter(subartefacto__nombre=nombre).exclude(subartefacto=sub).update(subartefacto=sub)
+        GenerationJob.objects.filter(subartefacto__nombre=nombre).exclude(subartefacto=sub).update(subartefacto=sub)
+    Fase.objects.exclude(proyecto=None).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documentacion', '0011_orden_fases_subartefactos'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='fase',
+            name='proyecto',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='fases', to='documentacion.project'),
+        ),
+        migrations.AddField(
+            model_name='fase',
+            name='tipo',
+            field=models.CharField(blank=True, choices=[('AREQ', 'Análisis de Requisitos'), ('DISE', 'Diseño'), ('DEVS', 'Desarrollo'), ('PRUE', 'Pruebas'), ('DESP', 'Despliegue')], max_length=4),
+        ),
+        migrations.AddField(
+            model_name='subartefacto',
+            name='render',
+            field=models.CharField(choices=[('texto', 'Texto'), ('mermaid', 'Diagrama Mermaid')], default='texto', max_length=10),
+        ),
+        migrations.RunPython(unificar_catalogo, migrations.RunPython.noop),
+    ]
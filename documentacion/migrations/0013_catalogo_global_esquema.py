@@ -0,0 +1,54 @@
+# Generated by Django 5.2 on 2026-10-18 13:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documentacion', '0012_catalogo_global'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='fase',
+            unique_together=set(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='subartefacto',
+            unique_together=set(),
+        ),
+        migrations.AlterField(
+            model_name='artefacto',
+            name='fase',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='artefactos', to='documentacion.fase'),
+        ),
+        migrations.AlterField(
+            model_name='fase',
+            name='nombre',
+            field=models.CharField(max_length=100, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='subartefacto',
+            name='fase',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='subartefactos', to='documentacion.fase'),
+        ),
+        migrations.AlterField(
+            model_name='subartefacto',
+            name='nombre',
+            field=models.CharField(max_length=100, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='fase',
+            index=models.Index(fields=['orden', 'nombre'], name='fase_orden_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subartefacto',
+            index=models.Index(fields=['fase', 'orden', 'nombre'], name='subartefacto_orden_idx'),
+        ),
+        migrations.RemoveField(
+            model_name='fase',
+            name='proyecto',
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2 on 2026-10-18 13:23
+
+import django.db.models.deletion
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documentacion', '0013_catalogo_global_esquema'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='artefacto',
+            name='titulo_normalizado',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.functions.text.Lower('titulo'), output_field=models.CharField(max_length=100)),
+        ),
+        migrations.AlterField(
+            model_name='artefacto',
+            name='proyecto',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='artefactos', to='documentacion.project'),
+        ),
+        migrations.AlterField(
+            model_name='project',
+            name='propietario',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='proyectos', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='artefacto',
+            index=models.Index(fields=['proyecto', 'titulo_normalizado'], name='artefacto_titulo_norm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['propietario', '-creado'], name='proyecto_dashboard_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+from django.db import migrations
+import documentacion.campos
+
+LOTE = 500
+
+
+def _copiar(apps, origen, destino):
+    Artefacto = apps.get_model('documentacion', 'Artefacto')
+    pks = list(Artefacto.objects.order_by('pk').values_list('pk', flat=True))
+    for inicio in range(0, len(pks), LOTE):
+        artefactos = list(Artefacto.objects.filter(pk__in=pks[inicio:inicio + LOTE]).only('pk', origen))
+        for artefacto in artefactos:
+            setattr(artefacto, destino, getattr(artefacto, origen))
+        Artefacto.objects.bulk_update(artefactos, [destino])
+
+
+def comprimir_contenidos(apps, schema_editor):
+    _copiar(apps, 'contenido', 'contenido_zstd')
+
+
+def descomprimir_contenidos(apps, schema_editor):
+    _copiar(apps, 'contenido_zstd', 'contenido')
+
+
+class Migration(migrations.Migration):
+    """
+    Artefacto.contenido pasa a TextoComprimido. Se copia a una columna nueva
+    (y en 0016 sustituye a la vieja) en lugar de cambiar el tipo: así cada
+    fila queda comprimida y no depende de cómo convierta cada base de datos
+    el texto a binario.
+    """
+
+    dependencies = [
+        ('documentacion', '0014_indices_artefacto_proyecto'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='artefacto',
+            name='contenido_zstd',
+            field=documentacion.campos.TextoComprimido(default=''),
+            preserve_default=False,
+        ),
+        migrations.RunPython(comprimir_contenidos, descomprimir_contenidos),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documentacion', '0015_artefacto_contenido_comprimido'),
+    ]
+
+    operations = [
+        # Con valor por defecto para poder volver a crearla al deshacer la migración
+        migrations.AlterField(
+            model_name='artefacto',
+            name='contenido',
+            field=models.TextField(default=''),
+        ),
+        migrations.RemoveField(
+            model_name='artefacto',
+            name='contenido',
+        ),
+        migrations.RenameField(
+            model_name='artefacto',
+            old_name='contenido_zstd',
+            new_name='contenido',
+        ),
+    ]
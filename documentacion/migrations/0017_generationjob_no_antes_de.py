@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 13:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documentacion', '0016_artefacto_contenido_comprimido_final'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generationjob',
+            name='no_antes_de',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
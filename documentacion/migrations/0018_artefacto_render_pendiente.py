@@ -0,0 +1,36 @@
+# Generated by Django 5.2 on 2026-10-18 13:42
+
+from django.db import migrations, models
+
+LOTE = 500
+
+
+def marcar_pendientes(apps, schema_editor):
+    """Los diagramas que aún no tienen imagen quedan para el worker."""
+    Artefacto = apps.get_model('documentacion', 'Artefacto')
+    pendientes = [
+        pk for pk, render in Artefacto.objects.order_by('pk').values_list('pk', 'render').iterator()
+        if (render or {}).get('tipo') == 'mermaid' and render.get('codigo') and not render.get('archivos')
+    ]
+    for inicio in range(0, len(pendientes), LOTE):
+        Artefacto.objects.filter(pk__in=pendientes[inicio:inicio + LOTE]).update(render_pendiente=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documentacion', '0017_generationjob_no_antes_de'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='artefacto',
+            name='render_pendiente',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='artefacto',
+            index=models.Index(condition=models.Q(('render_pendiente', True)), fields=['render_pendiente'], name='artefacto_render_pend_idx'),
+        ),
+        migrations.RunPython(marcar_pendientes, migrations.RunPython.noop),
+    ]
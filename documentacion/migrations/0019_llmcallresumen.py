@@ -0,0 +1,31 @@
+# Generated by Django 5.2 on 2026-10-18 13:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documentacion', '0018_artefacto_render_pendiente'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMCallResumen',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(max_length=60, unique=True)),
+                ('hasta', models.DateTimeField(blank=True, null=True)),
+                ('totales', models.JSONField(default=dict)),
+            ],
+            options={
+                'verbose_name': 'Resumen de llamadas a la IA',
+                'verbose_name_plural': 'Resúmenes de llamadas a la IA',
+            },
+        ),
+        migrations.AlterField(
+            model_name='llmcalllog',
+            name='tipo',
+            field=models.CharField(db_index=True, max_length=60),
+        ),
+    ]
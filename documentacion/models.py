@@ -1,7 +1,40 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.db.models.functions import Lower
+from django.utils import timezone
 from typing import Any, List, Tuple
+from .campos import TextoComprimido
+from .render import construir_render, formatos_pendientes
+
+# ===== TIPOS DE ARTEFACTOS =====
+
+ARTEFACTOS_TEXTO = [
+    "Historia de Usuario",
+    "caja negra",
+    "smoke"
+]
+
+ARTEFACTOS_MERMAID = [
+    "Diagrama de flujo",
+    "Diagrama de clases",
+    "Diagrama de Entidad-Relacion",
+    "Diagrama de secuencia",
+    "Diagrama de estado",
+    "Diagrama de C4-contexto",
+    "Diagrama de C4-contenedor",
+    "Diagrama de C4-implementación"
+]
+
+ARTEFACTOS_VALIDOS = set(ARTEFACTOS_TEXTO + ARTEFACTOS_MERMAID)
+
+TIPOS_ARTEFACTO: List[Tuple[str, str]] = [
+    ('AREQ', 'Análisis de Requisitos'),
+    ('DISE', 'Diseño'),
+    ('DEVS', 'Desarrollo'),
+    ('PRUE', 'Pruebas'),
+    ('DESP', 'Despliegue'),
+]
 
 class SecurityQuestions(models.Model):
     PREGUNTAS_CHOICES = [
@@ -34,45 +67,62 @@ class SecurityQuestions(models.Model):
 class Project(models.Model):
     nombre: models.CharField = models.CharField(max_length=100)
     descripcion: models.TextField = models.TextField(blank=True)
-    propietario: models.ForeignKey = models.ForeignKey(User, on_delete=models.CASCADE, related_name='proyectos')
+    # Sin índice propio: lo cubre proyecto_dashboard_idx
+    propietario: models.ForeignKey = models.ForeignKey(User, on_delete=models.CASCADE, related_name='proyectos', db_index=False)
     creado: models.DateTimeField = models.DateTimeField(auto_now_add=True)
     actualizado: models.DateTimeField = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['-creado']
+        indexes = [
+            # dashboard: proyectos del usuario, los más recientes primero
+            models.Index(fields=['propietario', '-creado'], name='proyecto_dashboard_idx'),
+        ]
         verbose_name = "Proyecto"
         verbose_name_plural = "Proyectos"
 
     def __str__(self) -> str:
         return self.nombre
 
-    @property
-    def fases(self) -> models.QuerySet:
-        return self.fase_set.all() # type: ignore
-
 
 class Fase(models.Model):
-    proyecto: models.ForeignKey = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='fases')
-    nombre: models.CharField = models.CharField(max_length=100)
+    """
+    Fase del catálogo global, común a todos los proyectos. Se lee una vez
+    por proceso (ver documentacion/catalogo.py).
+    """
+    nombre: models.CharField = models.CharField(max_length=100, unique=True)
+    tipo: models.CharField = models.CharField(max_length=4, choices=TIPOS_ARTEFACTO, blank=True)  # Tipo de sus artefactos
+    orden: models.PositiveSmallIntegerField = models.PositiveSmallIntegerField(default=999)
 
     class Meta:
-        unique_together = ('proyecto', 'nombre')
-        ordering = ['nombre']
+        ordering = ['orden', 'nombre']
+        indexes = [models.Index(fields=['orden', 'nombre'], name='fase_orden_idx')]
         verbose_name = "Fase"
         verbose_name_plural = "Fases"
 
     def __str__(self) -> str:
-        return f"{self.nombre} ({self.proyecto.nombre})"
+        return self.nombre
 
 
 class SubArtefacto(models.Model):
-    fase: models.ForeignKey = models.ForeignKey(Fase, on_delete=models.CASCADE, related_name='subartefactos')
-    nombre: models.CharField = models.CharField(max_length=100)
+    """Tipo de artefacto del catálogo global: su fase, su posición y cómo se muestra."""
+    TEXTO = 'texto'
+    MERMAID = 'mermaid'
+
+    RENDER_CHOICES: List[Tuple[str, str]] = [
+        (TEXTO, 'Texto'),
+        (MERMAID, 'Diagrama Mermaid'),
+    ]
+
+    fase: models.ForeignKey = models.ForeignKey(Fase, on_delete=models.PROTECT, related_name='subartefactos')
+    nombre: models.CharField = models.CharField(max_length=100, unique=True)
+    orden: models.PositiveSmallIntegerField = models.PositiveSmallIntegerField(default=999)
+    render: models.CharField = models.CharField(max_length=10, choices=RENDER_CHOICES, default=TEXTO)
     enlace: models.URLField = models.URLField(blank=True)
 
     class Meta:
-        unique_together = ('fase', 'nombre')
-        ordering = ['nombre']
+        ordering = ['orden', 'nombre']
+        indexes = [models.Index(fields=['fase', 'orden', 'nombre'], name='subartefacto_orden_idx')]
         verbose_name = "Subartefacto"
         verbose_name_plural = "Subartefactos"
 
@@ -80,31 +130,61 @@ class SubArtefacto(models.Model):
         return f"{self.nombre} - {self.fase.nombre}"
 
 
+class ArtefactoQuerySet(models.QuerySet):
+    # Campos que pueden ocupar varios KB de texto generado. No se difieren en
+    # el manager por defecto: casi todas las consultas son de un artefacto que
+    # se va a leer o reescribir entero (ver_artefacto, guardar_artefacto, el
+    # stream), y diferirlos ahí costaría una consulta más por campo.
+    CUERPOS = ('contenido', 'contexto', 'render')
+
+    def metadatos(self) -> 'ArtefactoQuerySet':
+        """Sin los cuerpos, para listas. Leer uno después cuesta una consulta por artefacto."""
+        return self.defer(*self.CUERPOS)
+
+
 class Artefacto(models.Model):
-    TIPO_CHOICES: List[Tuple[str, str]] = [
-        ('AREQ', 'Análisis de Requisitos'),
-        ('DISE', 'Diseño'),
-        ('DEVS', 'Desarrollo'),
-        ('PRUE', 'Pruebas'),
-        ('DESP', 'Despliegue'),
-    ]
+    TIPO_CHOICES = TIPOS_ARTEFACTO
 
-    proyecto: models.ForeignKey = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='artefactos')
-    fase: models.ForeignKey = models.ForeignKey(Fase, on_delete=models.CASCADE, related_name='artefactos')
+    # Sin índice propio: lo cubre artefacto_unico_por_proyecto (proyecto, titulo)
+    proyecto: models.ForeignKey = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='artefactos', db_index=False)
+    fase: models.ForeignKey = models.ForeignKey(Fase, on_delete=models.PROTECT, related_name='artefactos')
     subartefacto: models.ForeignKey = models.ForeignKey(SubArtefacto, on_delete=models.SET_NULL, null=True, blank=True, related_name='artefactos')
 
     tipo: models.CharField = models.CharField(max_length=4, choices=TIPO_CHOICES)
     titulo: models.CharField = models.CharField(max_length=100)
-    contenido: models.TextField = models.TextField()
-    contexto: models.TextField = models.TextField(blank=True, null=True)  # Nuevo campo para requisitos
+    # Lo calcula la base de datos: búsquedas sin distinguir mayúsculas con índice (iexact no puede usarlo)
+    titulo_normalizado: models.GeneratedField = models.GeneratedField(
+        expression=Lower('titulo'), output_field=models.CharField(max_length=100), db_persist=True,
+    )
+    contenido: TextoComprimido = TextoComprimido()  # zstd en una columna binaria (ver campos.py)
+    # Requisitos de la HU. Sin comprimir: detalle_proyecto filtra por él con
+    # regex y suele ocupar menos que el mínimo que compensa comprimir
+    contexto: models.TextField = models.TextField(blank=True, null=True)
+    render: models.JSONField = models.JSONField(null=True, blank=True, editable=False)  # Pre-render para ver_artefacto
+    render_pendiente: models.BooleanField = models.BooleanField(default=False, editable=False)  # Diagrama por renderizar en el worker
     generado_por_ia: models.BooleanField = models.BooleanField(default=True)
+    plantilla: models.CharField = models.CharField(max_length=60, blank=True)  # Id versionado del prompt usado
+    huella: models.CharField = models.CharField(max_length=16, blank=True)  # Hash de nombre y descripción del proyecto al generarlo
+    requisitos: models.JSONField = models.JSONField(default=list, blank=True)  # Hashes de los Requisito con que se generó
     creado: models.DateTimeField = models.DateTimeField(auto_now_add=True)
     actualizado: models.DateTimeField = models.DateTimeField(auto_now=True)
 
+    objects = ArtefactoQuerySet.as_manager()
+
     class Meta:
         ordering = ['-creado']
         verbose_name = "Artefacto"
         verbose_name_plural = "Artefactos"
+        constraints = [
+            # Un artefacto por título en cada proyecto (ver guardar_artefacto)
+            models.UniqueConstraint(fields=['proyecto', 'titulo'], name='artefacto_unico_por_proyecto'),
+        ]
+        indexes = [
+            models.Index(fields=['proyecto', 'titulo_normalizado'], name='artefacto_titulo_norm_idx'),
+            # Solo las pocas filas pendientes: el worker las busca sin recorrer la tabla
+            models.Index(fields=['render_pendiente'], condition=models.Q(render_pendiente=True),
+                         name='artefacto_render_pend_idx'),
+        ]
 
     def __str__(self) -> str:
         return f"{self.titulo} [{self.get_tipo_display()}]"
@@ -112,8 +192,143 @@ class Artefacto(models.Model):
     def get_tipo_display(self) -> str:
         return dict(self.TIPO_CHOICES).get(self.tipo, "")
     
+    @property
+    def es_mermaid(self) -> bool:
+        return self.titulo in ARTEFACTOS_MERMAID
+
+    def actualizar_render(self) -> None:
+        self.render = construir_render(self.contenido, self.es_mermaid, anterior=self.render)
+        self.render_pendiente = bool(formatos_pendientes(self.render))
+
     def save(self, *args: Any, **kwargs: Any) -> None:
         if self.subartefacto and not self.fase:
             self.fase = self.subartefacto.fase
+        if 'contenido' not in self.get_deferred_fields():  # diferido = sin cambios: el render sigue valiendo
+            self.actualizar_render()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'contenido' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'render', 'render_pendiente'}
         super().save(*args, **kwargs)
-        
\ No newline at end of file
+        
+
+class Requisito(models.Model):
+    """
+    Requisito funcional (RF) extraído de la Historia de Usuario. El hash se
+    calcula sobre el texto normalizado, sin el número: no cambia si solo se
+    renumera. Los que desaparecen de la HU quedan inactivos para poder
+    decir a los artefactos qué se eliminó (ver documentacion/requisitos.py).
+    """
+    proyecto: models.ForeignKey = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='requisitos')
+    hash: models.CharField = models.CharField(max_length=16)
+    codigo: models.CharField = models.CharField(max_length=10)  # RF1, RF2...
+    texto: models.TextField = models.TextField()
+    orden: models.PositiveSmallIntegerField = models.PositiveSmallIntegerField(default=0)
+    activo: models.BooleanField = models.BooleanField(default=True)
+
+    class Meta:
+        unique_together = ('proyecto', 'hash')
+        ordering = ['orden']
+        verbose_name = "Requisito"
+        verbose_name_plural = "Requisitos"
+
+    def __str__(self) -> str:
+        return f"{self.codigo}. {self.texto}"
+
+
+class GenerationJob(models.Model):
+    """
+    Trabajo de generación con IA. Las vistas solo lo encolan; el comando
+    `procesar_generaciones` lo ejecuta fuera del ciclo de la petición.
+    """
+    EN_COLA = 'queued'
+    EJECUTANDO = 'running'
+    TERMINADO = 'done'
+    FALLIDO = 'failed'
+
+    ESTADO_CHOICES: List[Tuple[str, str]] = [
+        (EN_COLA, 'En cola'),
+        (EJECUTANDO, 'Generando'),
+        (TERMINADO, 'Terminado'),
+        (FALLIDO, 'Fallido'),
+    ]
+    ESTADOS_PENDIENTES = (EN_COLA, EJECUTANDO)
+
+    proyecto: models.ForeignKey = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='generaciones')
+    subartefacto: models.ForeignKey = models.ForeignKey(SubArtefacto, on_delete=models.SET_NULL, null=True, blank=True, related_name='generaciones')
+    artefacto: models.ForeignKey = models.ForeignKey(Artefacto, on_delete=models.SET_NULL, null=True, blank=True, related_name='generaciones')
+
+    titulo: models.CharField = models.CharField(max_length=100)
+    tipo: models.CharField = models.CharField(max_length=4, choices=Artefacto.TIPO_CHOICES, blank=True)
+    forzar: models.BooleanField = models.BooleanField(default=False)
+    estado: models.CharField = models.CharField(max_length=10, choices=ESTADO_CHOICES, default=EN_COLA, db_index=True)
+    error: models.TextField = models.TextField(blank=True)
+    intentos: models.PositiveSmallIntegerField = models.PositiveSmallIntegerField(default=0)
+    no_antes_de: models.DateTimeField = models.DateTimeField(null=True, blank=True)  # Sin cuota: cuándo reintentarlo
+    creado: models.DateTimeField = models.DateTimeField(auto_now_add=True)
+    iniciado: models.DateTimeField = models.DateTimeField(null=True, blank=True)
+    terminado: models.DateTimeField = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['creado']
+        verbose_name = "Trabajo de generación"
+        verbose_name_plural = "Trabajos de generación"
+        constraints = [
+            # Una sola generación en vuelo por (proyecto, título): las peticiones
+            # que llegan mientras tanto esperan a esta (ver reservar_generacion)
+            models.UniqueConstraint(
+                fields=['proyecto', 'titulo'],
+                condition=models.Q(estado__in=['queued', 'running']),
+                name='generacion_en_vuelo_unica',
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.titulo} ({self.proyecto.nombre}) - {self.estado}"
+
+    @property
+    def pendiente(self) -> bool:
+        return self.estado in self.ESTADOS_PENDIENTES
+
+
+class LLMCallLog(models.Model):
+    """
+    Una llamada a Gemini (o un acierto de la caché de respuestas). Se
+    escribe en lotes desde documentacion.observabilidad y alimenta /metrics.
+    """
+    creado: models.DateTimeField = models.DateTimeField(default=timezone.now, db_index=True)
+    tipo: models.CharField = models.CharField(max_length=60, db_index=True)  # nombre de la plantilla, "lote", "requisitos"...
+    modelo: models.CharField = models.CharField(max_length=60)
+    usuario: models.ForeignKey = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    cache: models.BooleanField = models.BooleanField(default=False)
+    tokens_entrada: models.PositiveIntegerField = models.PositiveIntegerField(default=0)
+    tokens_salida: models.PositiveIntegerField = models.PositiveIntegerField(default=0)
+    latencia_ms: models.PositiveIntegerField = models.PositiveIntegerField(default=0)
+    error: models.CharField = models.CharField(max_length=60, blank=True)
+
+    class Meta:
+        ordering = ['-creado']
+        verbose_name = "Llamada a la IA"
+        verbose_name_plural = "Llamadas a la IA"
+
+    def __str__(self) -> str:
+        estado = self.error or ("caché" if self.cache else "ok")
+        return f"{self.tipo} {self.latencia_ms} ms ({estado})"
+
+
+class LLMCallResumen(models.Model):
+    """
+    Totales por tipo de las llamadas de LLMCallLog ya consolidadas (ver
+    observabilidad.consolidar_llamadas). /metrics suma estos totales y solo
+    las filas posteriores a `hasta`, así que las antiguas se pueden borrar sin
+    que los contadores bajen. La fila con tipo vacío guarda la marca común.
+    """
+    tipo: models.CharField = models.CharField(max_length=60, unique=True)
+    hasta: models.DateTimeField = models.DateTimeField(null=True, blank=True)
+    totales: models.JSONField = models.JSONField(default=dict)  # mismas claves que los agregados de /metrics
+
+    class Meta:
+        verbose_name = "Resumen de llamadas a la IA"
+        verbose_name_plural = "Resúmenes de llamadas a la IA"
+
+    def __str__(self) -> str:
+        return self.tipo or f"marca {self.hasta}"
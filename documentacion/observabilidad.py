@@ -0,0 +1,238 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings  # pyright: ignore[reportMissingModuleSource]
+from django.db import close_old_connections, transaction  # pyright: ignore[reportMissingModuleSource]
+from django.db.models import Count, Q, QuerySet, Sum  # pyright: ignore[reportMissingModuleSource]
+from django.utils import timezone  # pyright: ignore[reportMissingModuleSource]
+
+from core.ia import LlamadaIA
+
+logger = logging.getLogger(__name__)
+
+# ===== REGISTRO DE LLAMADAS A LA IA =====
+#
+# El observador que se registra en core.ia (ver apps.py) solo encola la
+# llamada: puede ejecutarse dentro del bucle de eventos de una vista async,
+# donde no se puede tocar la base de datos. Un hilo por proceso guarda lo
+# encolado en LLMCallLog con bulk_create cada LOTE llamadas o INTERVALO s.
+
+class RegistroLlamadas:
+    def __init__(self, lote: int = 50, intervalo: float = 2.0, maximo: int = 10_000):
+        self.lote = lote
+        self.intervalo = intervalo
+        self.maximo = maximo
+        self._lock = threading.Lock()
+        self._reiniciar()
+
+    def _reiniciar(self) -> None:
+        # Tras un fork el hilo no existe en el hijo y la cola es del padre
+        self.cola: "queue.Queue[Tuple[datetime, LlamadaIA]]" = queue.Queue(maxsize=self.maximo)
+        self._hilo: Optional[threading.Thread] = None
+
+    def anotar(self, llamada: LlamadaIA) -> None:
+        """Observador de core.ia: encola la llamada sin bloquear."""
+        try:
+            self.cola.put_nowait((timezone.now(), llamada))
+        except queue.Full:
+            logger.warning("Cola de LLMCallLog llena; se descarta una llamada de %s", llamada.tipo)
+            return
+        if self._hilo is None:
+            self._arrancar()
+
+    def _arrancar(self) -> None:
+        with self._lock:
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._bucle, name="registro-llamadas-ia", daemon=True)
+                self._hilo.start()
+
+    def _bucle(self) -> None:
+        while True:
+            pendientes = [self.cola.get()]
+            limite = time.monotonic() + self.intervalo
+            try:
+                while len(pendientes) < self.lote and time.monotonic() < limite:
+                    pendientes.append(self.cola.get(timeout=max(0.0, limite - time.monotonic())))
+            except queue.Empty:
+                pass
+            self._guardar(pendientes)
+            close_old_connections()
+
+    def vaciar(self) -> None:
+        """Guarda ya, en el hilo actual, lo que quede en la cola."""
+        pendientes = []
+        while True:
+            try:
+                pendientes.append(self.cola.get_nowait())
+            except queue.Empty:
+                break
+        self._guardar(pendientes)
+
+    def _guardar(self, pendientes: List[Tuple[datetime, LlamadaIA]]) -> None:
+        from .models import LLMCallLog
+
+        if not pendientes:
+            return
+        try:
+            LLMCallLog.objects.bulk_create([
+                LLMCallLog(
+                    creado=creado,
+                    tipo=llamada.tipo[:60],
+                    modelo=llamada.modelo[:60],
+                    usuario_id=llamada.usuario,
+                    cache=llamada.cache,
+                    tokens_entrada=llamada.tokens_entrada,
+                    tokens_salida=llamada.tokens_salida,
+                    latencia_ms=round(llamada.latencia * 1000),
+                    error=llamada.error[:60],
+                )
+                for creado, llamada in pendientes
+            ])
+        except Exception:
+            logger.exception("No se pudieron guardar %d llamadas en LLMCallLog", len(pendientes))
+
+
+_opciones = getattr(settings, 'IA_REGISTRO_LLAMADAS', {})
+registro = RegistroLlamadas(lote=_opciones.get('LOTE', 50), intervalo=_opciones.get('INTERVALO', 2.0))
+atexit.register(registro.vaciar)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=registro._reiniciar)
+
+# ===== MÉTRICAS (FORMATO PROMETHEUS) =====
+#
+# Se calculan a partir de LLMCallLog, así que suman lo de todos los procesos
+# (workers de gunicorn y procesar_generaciones). La latencia solo cuenta las
+# llamadas que llegaron al modelo, no los aciertos de caché.
+#
+# Para no agregar toda la tabla en cada scrape, consolidar_llamadas (comando
+# consolidar_llamadas_ia, p. ej. cada hora por cron) suma las llamadas
+# antiguas en LLMCallResumen y borra las que pasan de RETENCION_DIAS; las
+# métricas son el resumen más las filas posteriores a su marca. Cambiar
+# CUBETAS_LATENCIA obliga a vaciar LLMCallResumen (las cubetas van por índice).
+
+CUBETAS_LATENCIA = (0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+# Las llamadas se guardan segundos después de ocurrir (ver RegistroLlamadas):
+# no se consolidan las más recientes para no dejar atrás ninguna
+MARGEN_CONSOLIDACION = timedelta(minutes=5)
+
+
+def _etiquetas(**valores: str) -> str:
+    partes = []
+    for nombre, valor in valores.items():
+        valor = str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        partes.append(f'{nombre}="{valor}"')
+    return "{" + ",".join(partes) + "}"
+
+
+def _agregar_por_tipo(llamadas: QuerySet) -> Dict[str, Dict[str, int]]:
+    """Contadores de /metrics por tipo para un queryset de LLMCallLog."""
+    al_modelo = Q(cache=False)
+    agregados = {
+        "ok": Count("id", filter=al_modelo & Q(error="")),
+        "fallidas": Count("id", filter=~Q(error="")),
+        "cacheadas": Count("id", filter=Q(cache=True)),
+        "entrada": Sum("tokens_entrada"),
+        "salida": Sum("tokens_salida"),
+        "suma_latencia_ms": Sum("latencia_ms", filter=al_modelo),
+        "medidas": Count("id", filter=al_modelo),
+    }
+    for i, limite in enumerate(CUBETAS_LATENCIA):
+        agregados[f"le{i}"] = Count("id", filter=al_modelo & Q(latencia_ms__lte=limite * 1000))
+    filas = llamadas.order_by().values("tipo").annotate(**agregados)
+    return {fila["tipo"]: {clave: fila[clave] or 0 for clave in agregados} for fila in filas}
+
+
+def _sumar(a: Dict[str, int], b: Dict[str, int]) -> Dict[str, int]:
+    return {clave: a.get(clave, 0) + b.get(clave, 0) for clave in {*a, *b}}
+
+
+def consolidar_llamadas(retencion: Optional[timedelta] = None) -> Tuple[int, int]:
+    """
+    Suma a LLMCallResumen las llamadas aún no consolidadas (salvo las de
+    MARGEN_CONSOLIDACION) y borra las consolidadas de más de `retencion`.
+    Devuelve (consolidadas, borradas).
+    """
+    from .models import LLMCallLog, LLMCallResumen
+
+    registro.vaciar()
+    with transaction.atomic():
+        LLMCallResumen.objects.get_or_create(tipo='')
+        # Bloquea la marca: dos consolidaciones a la vez sumarían dos veces
+        marca = LLMCallResumen.objects.select_for_update().get(tipo='')
+        hasta = timezone.now() - MARGEN_CONSOLIDACION
+        consolidadas = 0
+        if marca.hasta is None or hasta > marca.hasta:
+            nuevas = LLMCallLog.objects.filter(creado__lte=hasta)
+            if marca.hasta is not None:
+                nuevas = nuevas.filter(creado__gt=marca.hasta)
+            resumenes = {r.tipo: r for r in LLMCallResumen.objects.exclude(tipo='')}
+            for tipo, totales in _agregar_por_tipo(nuevas).items():
+                resumen = resumenes.get(tipo) or LLMCallResumen(tipo=tipo)
+                resumen.totales = _sumar(resumen.totales, totales)
+                resumen.save()
+                consolidadas += totales["medidas"] + totales["cacheadas"]
+            marca.hasta = hasta
+            marca.save(update_fields=['hasta'])
+
+    borradas = 0
+    if retencion is not None:
+        # Solo lo ya consolidado: lo demás aún no está en el resumen
+        limite = min(timezone.now() - retencion, marca.hasta)
+        borradas, _ = LLMCallLog.objects.filter(creado__lte=limite).delete()
+    return consolidadas, borradas
+
+
+def metricas_prometheus() -> str:
+    """Texto para /metrics: llamadas, tokens e histograma de latencia por tipo."""
+    from .models import LLMCallLog, LLMCallResumen
+
+    registro.vaciar()
+    resumenes = {r.tipo: r for r in LLMCallResumen.objects.all()}
+    marca = resumenes.pop('', None)
+    recientes = LLMCallLog.objects.all()
+    if marca is not None and marca.hasta is not None:
+        recientes = recientes.filter(creado__gt=marca.hasta)  # con el índice de creado: solo lo último
+    totales = {tipo: r.totales for tipo, r in resumenes.items()}
+    for tipo, agregados in _agregar_por_tipo(recientes).items():
+        totales[tipo] = _sumar(totales.get(tipo, {}), agregados)
+    filas = [{"tipo": tipo, **totales[tipo]} for tipo in sorted(totales)]
+
+    lineas = [
+        "# HELP docai_llm_llamadas_total Llamadas a la IA por tipo y resultado.",
+        "# TYPE docai_llm_llamadas_total counter",
+    ]
+    for fila in filas:
+        for resultado in ("ok", "fallidas", "cacheadas"):
+            lineas.append(f"docai_llm_llamadas_total{_etiquetas(tipo=fila['tipo'], resultado=resultado)} {fila[resultado]}")
+
+    lineas += [
+        "# HELP docai_llm_tokens_total Tokens informados por Gemini.",
+        "# TYPE docai_llm_tokens_total counter",
+    ]
+    for fila in filas:
+        for direccion in ("entrada", "salida"):
+            lineas.append(
+                f"docai_llm_tokens_total{_etiquetas(tipo=fila['tipo'], direccion=direccion)} {fila[direccion] or 0}"
+            )
+
+    lineas += [
+        "# HELP docai_llm_latencia_segundos Duración de las llamadas al modelo (sin aciertos de caché).",
+        "# TYPE docai_llm_latencia_segundos histogram",
+    ]
+    for fila in filas:
+        for i, limite in enumerate(CUBETAS_LATENCIA):
+            lineas.append(
+                f"docai_llm_latencia_segundos_bucket{_etiquetas(tipo=fila['tipo'], le=limite)} {fila[f'le{i}']}"
+            )
+        lineas.append(f"docai_llm_latencia_segundos_bucket{_etiquetas(tipo=fila['tipo'], le='+Inf')} {fila['medidas']}")
+        lineas.append(
+            f"docai_llm_latencia_segundos_sum{_etiquetas(tipo=fila['tipo'])} {(fila['suma_latencia_ms'] or 0) / 1000:.3f}"
+        )
+        lineas.append(f"docai_llm_latencia_segundos_count{_etiquetas(tipo=fila['tipo'])} {fila['medidas']}")
+    return "\n".join(lineas) + "\n"
@@ -0,0 +1,209 @@
+import cProfile
+import contextvars
+import logging
+import random
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings  # pyright: ignore[reportMissingModuleSource]
+from django.core.exceptions import MiddlewareNotUsed  # pyright: ignore[reportMissingModuleSource]
+from django.db import connections  # pyright: ignore[reportMissingModuleSource]
+from django.db.backends.signals import connection_created  # pyright: ignore[reportMissingModuleSource]
+
+logger = logging.getLogger(__name__)
+
+# ===== PERFILADO DE PETICIONES =====
+#
+# Middleware opcional (settings.PERFILADO["ACTIVO"]) que mide por petición
+# las consultas SQL, el render de plantillas, las llamadas a la IA y el
+# total. Lo expone en la cabecera Server-Timing y en el log (una muestra de
+# las peticiones y todas las lentas). Una fracción de las peticiones se
+# ejecuta con cProfile y, si resulta lenta, se guarda el volcado en
+# PERFILADO["DIRECTORIO"] para abrirlo con snakeviz o pstats.
+#
+# Las respuestas en streaming se miden hasta que empiezan a enviarse: lo que
+# ocurre al generar el cuerpo no entra en las cifras.
+
+POR_DEFECTO = {
+    "ACTIVO": False,
+    "CABECERA": True,
+    "MUESTREO": 0.05,
+    "UMBRAL_LENTO": 1.0,
+    "MUESTREO_CPROFILE": 0.1,
+    "DIRECTORIO": "perfiles",
+}
+
+
+class Perfil:
+    """Tiempos acumulados de una petición (segundos)."""
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.consultas = 0
+        self.db = 0.0
+        self.plantillas = 0.0
+        self.llamadas_ia = 0
+        self.ia = 0.0
+        self.profundidad = 0  # plantillas anidadas (include/extends) en curso
+
+
+perfil_actual: contextvars.ContextVar[Optional[Perfil]] = contextvars.ContextVar("perfil_actual", default=None)
+
+# ===== SONDAS =====
+#
+# Se instalan una vez por proceso y solo anotan cuando hay un perfil activo
+# en el contexto (los hilos de generar_proyecto lo heredan con copy_context).
+
+_sondas_instaladas = False
+_sondas_lock = threading.Lock()
+
+
+def _medir_sql(execute, sql, params, many, context):
+    perfil = perfil_actual.get()
+    if perfil is None:
+        return execute(sql, params, many, context)
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        perfil.db += time.perf_counter() - inicio
+        perfil.consultas += 1
+
+
+def _instalar_en_conexion(connection, **kwargs) -> None:
+    if _medir_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _medir_sql)
+
+
+def _medir_ia(llamada) -> None:
+    perfil = perfil_actual.get()
+    if perfil is not None and not llamada.cache:
+        perfil.ia += llamada.latencia
+        perfil.llamadas_ia += 1
+
+
+def _instalar_medicion_plantillas() -> None:
+    from django.template.base import Template  # pyright: ignore[reportMissingModuleSource]
+
+    original = Template._render
+
+    def _render(self, context):
+        perfil = perfil_actual.get()
+        if perfil is None:
+            return original(self, context)
+        perfil.profundidad += 1
+        inicio = time.perf_counter()
+        try:
+            return original(self, context)
+        finally:
+            perfil.profundidad -= 1
+            if perfil.profundidad == 0:
+                perfil.plantillas += time.perf_counter() - inicio
+
+    Template._render = _render
+
+
+def instalar_sondas() -> None:
+    global _sondas_instaladas
+    with _sondas_lock:
+        if _sondas_instaladas:
+            return
+        from core.ia import registrar_observador
+
+        connection_created.connect(_instalar_en_conexion, dispatch_uid="perfilado_sql")
+        for connection in connections.all():
+            _instalar_en_conexion(connection)
+        registrar_observador(_medir_ia)
+        _instalar_medicion_plantillas()
+        _sondas_instaladas = True
+
+# ===== MIDDLEWARE =====
+
+_cprofile_lock = threading.Lock()  # cProfile no admite dos perfiladores activos a la vez
+
+
+class PerfiladoMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.config = {**POR_DEFECTO, **getattr(settings, "PERFILADO", {})}
+        if not self.config["ACTIVO"]:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        instalar_sondas()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        perfil = Perfil()
+        token = perfil_actual.set(perfil)
+        perfilador = self._iniciar_cprofile()
+        try:
+            response = self.get_response(request)
+        finally:
+            if perfilador is not None:
+                perfilador.disable()
+                _cprofile_lock.release()
+            perfil_actual.reset(token)
+        self._terminar(request, response, perfil, perfilador)
+        return response
+
+    async def __acall__(self, request):
+        # Sin cProfile: en el bucle de eventos mezclaría varias peticiones
+        perfil = Perfil()
+        token = perfil_actual.set(perfil)
+        try:
+            response = await self.get_response(request)
+        finally:
+            perfil_actual.reset(token)
+        self._terminar(request, response, perfil, None)
+        return response
+
+    def _iniciar_cprofile(self) -> Optional[cProfile.Profile]:
+        if random.random() >= self.config["MUESTREO_CPROFILE"] or not _cprofile_lock.acquire(blocking=False):
+            return None
+        perfilador = cProfile.Profile()
+        try:
+            perfilador.enable()
+        except ValueError:  # otro perfilador activo en el proceso
+            _cprofile_lock.release()
+            return None
+        return perfilador
+
+    def _terminar(self, request, response, perfil: Perfil, perfilador: Optional[cProfile.Profile]) -> None:
+        total = time.perf_counter() - perfil.inicio
+        if self.config["CABECERA"]:
+            response["Server-Timing"] = ", ".join([
+                f'db;dur={perfil.db * 1000:.1f};desc="{perfil.consultas} consultas"',
+                f"tpl;dur={perfil.plantillas * 1000:.1f}",
+                f'ia;dur={perfil.ia * 1000:.1f};desc="{perfil.llamadas_ia} llamadas"',
+                f"total;dur={total * 1000:.1f}",
+            ])
+
+        lenta = total >= self.config["UMBRAL_LENTO"]
+        if not lenta and random.random() >= self.config["MUESTREO"]:
+            return
+        vista = getattr(request.resolver_match, "view_name", None) or request.path
+        mensaje = "%s %s vista=%s estado=%s total=%.0fms db=%d/%.0fms plantillas=%.0fms ia=%d/%.0fms"
+        argumentos = [request.method, request.path, vista, response.status_code, total * 1000,
+                      perfil.consultas, perfil.db * 1000, perfil.plantillas * 1000,
+                      perfil.llamadas_ia, perfil.ia * 1000]
+        if lenta and perfilador is not None:
+            mensaje += " cprofile=%s"
+            argumentos.append(self._guardar_cprofile(perfilador, vista, total))
+        logger.log(logging.WARNING if lenta else logging.INFO, mensaje, *argumentos)
+
+    def _guardar_cprofile(self, perfilador: cProfile.Profile, vista: str, total: float) -> str:
+        directorio = Path(self.config["DIRECTORIO"])
+        directorio.mkdir(parents=True, exist_ok=True)
+        nombre = re.sub(r"[^A-Za-z0-9_-]+", "_", vista).strip("_") or "vista"
+        ruta = directorio / f"{time.strftime('%Y%m%d-%H%M%S')}-{nombre}-{total * 1000:.0f}ms.prof"
+        perfilador.dump_stats(ruta)
+        return str(ruta)
@@ -0,0 +1,125 @@
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from django.conf import settings # pyright: ignore[reportMissingModuleSource]
+
+logger = logging.getLogger(__name__)
+
+# ===== PRE-RENDER DE ARTEFACTOS =====
+#
+# Al guardar un artefacto se calcula una sola vez lo que necesita la vista
+# para mostrarlo (código Mermaid limpio y metadatos). Así ver_artefacto es
+# una lectura de la base de datos, sin llamadas externas.
+
+VERSION_RENDER = 2
+
+def limpiar_mermaid(texto):
+    texto = texto.strip()
+    if texto.startswith("```mermaid"):
+        texto = texto.replace("```mermaid", "", 1).strip()
+    if texto.endswith("```"):
+        texto = texto[:texto.rfind("```")].strip()
+    return texto
+
+def tipo_diagrama(codigo: str) -> str:
+    """Palabra clave con la que empieza el diagrama (flowchart, classDiagram, C4Context...)."""
+    for linea in codigo.splitlines():
+        linea = linea.strip()
+        if linea and not linea.startswith("%%"):
+            return linea.split()[0]
+    return ""
+
+def clave_diagrama(codigo: str) -> str:
+    return hashlib.sha256(codigo.encode("utf-8")).hexdigest()
+
+def construir_render(contenido: str, es_mermaid: bool, anterior: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    if not es_mermaid:
+        return {"tipo": "texto", "version": VERSION_RENDER}
+
+    codigo = limpiar_mermaid(contenido or "")
+    clave = clave_diagrama(codigo)
+    # Si el código no cambió se conservan las imágenes ya renderizadas
+    archivos = (anterior or {}).get("archivos", []) if (anterior or {}).get("hash") == clave else []
+    return {
+        "tipo": "mermaid",
+        "version": VERSION_RENDER,
+        "codigo": codigo,
+        "diagrama": tipo_diagrama(codigo),
+        "lineas": len(codigo.splitlines()),
+        "hash": clave,
+        "archivos": archivos,
+    }
+
+# ===== RENDER DE DIAGRAMAS EN EL SERVIDOR =====
+#
+# Los diagramas se convierten a SVG/PNG con mermaid-cli (`mmdc`) y se guardan
+# en MEDIA_ROOT/diagramas/ con el hash del código como nombre: el mismo código
+# produce siempre el mismo archivo, que puede cachearse para siempre.
+# mmdc arranca un navegador y tarda segundos, así que nunca se llama desde una
+# petición: guardar un diagrama lo marca como pendiente
+# (Artefacto.render_pendiente) y el worker lo renderiza (ver
+# generacion.renderizar_pendientes).
+
+FORMATOS_IMAGEN = {
+    "svg": "image/svg+xml",
+    "png": "image/png",
+}
+
+def _config_cli() -> dict:
+    return dict(getattr(settings, "MERMAID_CLI", {}))
+
+def formatos_configurados() -> list:
+    return [f for f in _config_cli().get("FORMATOS", ["svg"]) if f in FORMATOS_IMAGEN]
+
+def formatos_pendientes(render: Optional[Dict[str, Any]]) -> list:
+    """Formatos configurados que aún no están renderizados para este render."""
+    if not render or render.get("tipo") != "mermaid" or not render.get("codigo"):
+        return []
+    return [f for f in formatos_configurados() if f not in render.get("archivos", [])]
+
+def renderizador_disponible() -> bool:
+    return shutil.which(_config_cli().get("COMANDO", "mmdc")) is not None
+
+def ruta_diagrama(clave: str, formato: str) -> Path:
+    return Path(settings.MEDIA_ROOT) / "diagramas" / clave[:2] / f"{clave}.{formato}"
+
+def renderizar_codigo(codigo: str, formato: str = "svg") -> Optional[Path]:
+    """
+    Devuelve la ruta del diagrama renderizado, generándolo con mermaid-cli si
+    aún no existe. Devuelve None si el renderizador no está disponible o falla.
+    """
+    if formato not in FORMATOS_IMAGEN or not codigo:
+        return None
+    ruta = ruta_diagrama(clave_diagrama(codigo), formato)
+    if ruta.exists():
+        return ruta
+
+    config = _config_cli()
+    comando = shutil.which(config.get("COMANDO", "mmdc"))
+    if comando is None:
+        logger.debug("mermaid-cli no disponible; el diagrama se renderizará en el navegador.")
+        return None
+
+    ruta.parent.mkdir(parents=True, exist_ok=True)
+    # El directorio temporal está junto al destino para que os.replace sea atómico
+    with tempfile.TemporaryDirectory(dir=ruta.parent) as temporal:
+        entrada = Path(temporal) / "diagrama.mmd"
+        salida = Path(temporal) / f"diagrama.{formato}"
+        entrada.write_text(codigo, encoding="utf-8")
+        fondo = "white" if formato == "png" else "transparent"
+        try:
+            subprocess.run(
+                [comando, "-i", str(entrada), "-o", str(salida), "-b", fondo, *config.get("ARGUMENTOS", [])],
+                check=True, capture_output=True, timeout=config.get("TIMEOUT", 60),
+            )
+            os.replace(salida, ruta)
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.warning("No se pudo renderizar el diagrama %s.%s: %s", ruta.stem, formato, e)
+            return None
+    return ruta
@@ -0,0 +1,114 @@
+import hashlib
+import re
+import unicodedata
+from typing import Dict, List, Tuple
+
+from django.conf import settings # pyright: ignore[reportMissingModuleSource]
+from django.db import transaction # pyright: ignore[reportMissingModuleSource]
+
+from core.ia import version_plantilla
+from .models import Artefacto, Project, Requisito
+
+# ===== REQUISITOS FUNCIONALES =====
+#
+# Los RF que extrae la Historia de Usuario (Artefacto.contexto) se guardan
+# uno a uno en Requisito, con un hash del texto normalizado. Cada artefacto
+# anota con qué hashes se generó (Artefacto.requisitos) y la huella del
+# nombre y la descripción del proyecto (Artefacto.huella). Al regenerar el
+# proyecto, plan_actualizacion decide por artefacto:
+#   - VIGENTE:   sus entradas no cambiaron; se conserva.
+#   - PARCHE:    cambiaron pocos RF; se envía el artefacto actual con solo los
+#                RF añadidos y eliminados (core.ia.actualizar_subartefacto).
+#   - REGENERAR: se genera de cero.
+# Todos los prompts reciben el nombre y la descripción, así que si cambian
+# (o el artefacto no tiene huella, por ser anterior a ella) se regenera;
+# además, los artefactos que no son la HU dependen de los RF.
+
+VIGENTE = "vigente"
+PARCHE = "parche"
+REGENERAR = "regenerar"
+
+_CODIGO_RF = re.compile(r"^\W*(RF\s*-?\s*\d+)\s*[.:)\-–—]?\s*(.*)$", re.IGNORECASE)
+
+
+def _normalizar(texto: str) -> str:
+    texto = unicodedata.normalize("NFC", texto or "").lower()
+    return " ".join(texto.split()).rstrip(" .;")
+
+
+def hash_texto(*partes: str) -> str:
+    return hashlib.sha256("\x1f".join(partes).encode("utf-8")).hexdigest()[:16]
+
+
+def huella_proyecto(proyecto: Project) -> str:
+    """Hash del nombre y la descripción: lo que recibe el prompt de la HU."""
+    return hash_texto(_normalizar(proyecto.nombre), _normalizar(proyecto.descripcion))
+
+
+def parsear_requisitos(contexto: str) -> List[Tuple[str, str]]:
+    """
+    [(codigo, texto)] de una lista de RF, uno por línea. Las líneas sin
+    código continúan el requisito anterior; las anteriores al primero se
+    ignoran. Si ninguna línea tiene código, cada línea es un requisito.
+    """
+    lineas = [linea.strip() for linea in (contexto or "").splitlines() if linea.strip()]
+    if not any(_CODIGO_RF.match(linea) for linea in lineas):
+        return [(f"RF{i}", linea) for i, linea in enumerate(lineas, 1)]
+
+    requisitos: List[List[str]] = []
+    for linea in lineas:
+        coincidencia = _CODIGO_RF.match(linea)
+        if coincidencia:
+            codigo = re.sub(r"[\s-]", "", coincidencia.group(1)).upper()
+            requisitos.append([codigo, coincidencia.group(2).strip()])
+        elif requisitos:
+            requisitos[-1][1] = f"{requisitos[-1][1]} {linea}".strip()
+    return [(codigo, texto) for codigo, texto in requisitos if texto]
+
+
+def sincronizar_requisitos(proyecto: Project, contexto: str) -> List[str]:
+    """Guarda los RF de `contexto` como los Requisito activos del proyecto; devuelve sus hashes en orden."""
+    filas: Dict[str, Requisito] = {}
+    for orden, (codigo, texto) in enumerate(parsear_requisitos(contexto)):
+        clave = hash_texto(_normalizar(texto))
+        if clave not in filas:
+            filas[clave] = Requisito(proyecto=proyecto, hash=clave, codigo=codigo, texto=texto,
+                                     orden=orden, activo=True)
+    with transaction.atomic():
+        Requisito.objects.filter(proyecto=proyecto).exclude(hash__in=filas.keys()).update(activo=False)
+        Requisito.objects.bulk_create(
+            filas.values(),
+            update_conflicts=True,
+            unique_fields=['proyecto', 'hash'],
+            update_fields=['codigo', 'texto', 'orden', 'activo'],
+        )
+    return list(filas)
+
+
+def hashes_activos(proyecto: Project) -> List[str]:
+    return list(Requisito.objects.filter(proyecto=proyecto, activo=True).values_list('hash', flat=True))
+
+
+def plan_actualizacion(artefacto: Artefacto, requisitos: Dict[str, Requisito],
+                       huella: str) -> Tuple[str, List[str], List[str]]:
+    """
+    (VIGENTE | PARCHE | REGENERAR, RF añadidos, RF eliminados) para un
+    artefacto ya generado. `requisitos` son todos los del proyecto por hash.
+    """
+    if not artefacto.generado_por_ia:
+        return VIGENTE, [], []  # escrito a mano: se respeta
+    if artefacto.huella != huella or artefacto.plantilla != version_plantilla(artefacto.titulo):
+        return REGENERAR, [], []
+    if artefacto.titulo == "Historia de Usuario":
+        return VIGENTE, [], []
+
+    usados = set(artefacto.requisitos or [])
+    activos = [r for r in requisitos.values() if r.activo]
+    anadidos = [str(r) for r in activos if r.hash not in usados]
+    eliminados = [str(requisitos[h]) for h in usados - {r.hash for r in activos} if h in requisitos]
+    if not anadidos and not eliminados:
+        return VIGENTE, [], []
+    maximo = getattr(settings, 'GENERACION_PARCHE_MAXIMO', 5)
+    if len(anadidos) + len(eliminados) <= maximo and len(anadidos) < len(activos):
+        return PARCHE, anadidos, eliminados
+    return REGENERAR, [], []
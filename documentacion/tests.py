@@ -1,3 +1,1577 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from datetime import timedelta
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection, connections, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from core.cache import CacheDjango, clave_cache, reiniciar_cache
+from core.ia import (CircuitoAbierto, Cortacircuitos, ErrorIA, ErrorIATransitorio, LimiteExcedido, TiempoAgotadoIA,
+                     _con_reintentos, _espera, actualizar_subartefacto, cortacircuitos, en_nombre_de,
+                     generar_subartefacto_con_prompt, generar_subartefactos_en_lote, quitar_observador,
+                     registrar_observador)
+from core.limites import Decision, Limitador, LimitesDjango, LimitesSQLite, cubetas_para, reiniciar_limitador
+from core.prompts import PARCHE as PROMPT_PARCHE, PROMPTS, Plantilla
+from core.proveedores import (CARACTERES_POR_TOKEN, BackendGemini, BackendLocal, ErrorSimulado, Grabaciones,
+                              RespuestaLocal, UsoLocal, reiniciar_backend)
+from .campos import CABECERA_ZSTD
+from .catalogo import obtener_catalogo
+from .generacion import (PROYECTO_COMPLETO, VUELO_MAXIMO, _planificar, ejecutar_job, encolar_generacion, generar_proyecto,
+                         generar_y_guardar, guardar_artefacto, recuperar_jobs_huerfanos, renderizar_pendientes,
+                         reservar_generacion, tomar_siguiente_job)
+from .models import (ARTEFACTOS_MERMAID, ARTEFACTOS_TEXTO, ARTEFACTOS_VALIDOS, Artefacto, Fase, GenerationJob,
+                     LLMCallLog, Project, Requisito, SubArtefacto)
+from .observabilidad import consolidar_llamadas, metricas_prometheus, registro
+from .perfilado import PerfiladoMiddleware
+from .render import clave_diagrama, ruta_diagrama
+from .requisitos import (PARCHE, REGENERAR, VIGENTE, huella_proyecto, plan_actualizacion,
+                         sincronizar_requisitos)
+
+
+def sin_cache_ni_limites(test):
+    """Apaga la caché y los límites de la IA durante el test (los de settings escriben en ia_cache.sqlite3)."""
+    test.enterContext(override_settings(IA_CACHE={'BACKEND': 'ninguno'}, IA_LIMITES={'BACKEND': 'ninguno'}))
+    for reiniciar in (reiniciar_cache, reiniciar_limitador):
+        reiniciar()
+        test.addCleanup(reiniciar)
+
+
+class VerArtefactoTests(TestCase):
+    """ver_artefacto es de solo lectura: nunca debe llamar a la IA."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('ana', password='clave-segura-123')
+        cls.proyecto = Project.objects.create(nombre='Sistema gestion ventas', propietario=cls.usuario)
+        cls.fase = Fase.objects.get(nombre='Diseño')
+        cls.diagrama = Artefacto.objects.create(
+            proyecto=cls.proyecto, fase=cls.fase, tipo='DISE',
+            titulo='Diagrama de clases',
+            contenido="```mermaid\nclassDiagram\n  class Venta\n```",
+        )
+        cls.texto = Artefacto.objects.create(
+            proyecto=cls.proyecto, fase=cls.fase, tipo='AREQ',
+            titulo='Historia de Usuario', contenido='Como vendedor quiero registrar ventas.',
+        )
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    def test_render_se_guarda_al_generar(self):
+        self.assertEqual(self.diagrama.render['tipo'], 'mermaid')
+        self.assertEqual(self.diagrama.render['diagrama'], 'classDiagram')
+        self.assertEqual(self.diagrama.render['codigo'], "classDiagram\n  class Venta")
+        self.assertEqual(self.texto.render['tipo'], 'texto')
+
+    def test_render_se_actualiza_con_el_contenido(self):
+        self.diagrama.contenido = "erDiagram\n  VENTA ||--o{ DETALLE : tiene"
+        self.diagrama.save(update_fields=['contenido'])
+        self.diagrama.refresh_from_db()
+        self.assertEqual(self.diagrama.render['diagrama'], 'erDiagram')
+
+    @mock.patch('core.ia.obtener_backend')
+    @mock.patch('core.ia._generar_contenido')
+    def test_ver_artefacto_no_llama_a_la_ia(self, generar, obtener_backend):
+        for artefacto in (self.diagrama, self.texto):
+            with self.assertNumQueries(3):  # sesión, usuario y artefacto
+                respuesta = self.client.get(reverse('ver_artefacto', args=[artefacto.id]))
+            self.assertEqual(respuesta.status_code, 200)
+        generar.assert_not_called()
+        obtener_backend.assert_not_called()
+
+    def test_ver_artefacto_muestra_codigo_limpio(self):
+        respuesta = self.client.get(reverse('ver_artefacto', args=[self.diagrama.id]))
+        self.assertTrue(respuesta.context['is_mermaid'])
+        self.assertEqual(respuesta.context['codigo_mermaid'], "classDiagram\n  class Venta")
+
+    def test_ver_artefacto_de_otro_usuario(self):
+        otro = User.objects.create_user('luis', password='clave-segura-123')
+        self.client.force_login(otro)
+        respuesta = self.client.get(reverse('ver_artefacto', args=[self.diagrama.id]))
+        self.assertEqual(respuesta.status_code, 404)
+
+
+@override_settings(GENERACION_ASINCRONA=True)
+class RenderDiagramaTests(TestCase):
+    """mermaid-cli solo lo ejecuta el worker: las peticiones marcan el diagrama y sirven lo que ya existe."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('ana', password='clave-segura-123')
+        cls.proyecto = Project.objects.create(nombre='Sistema gestion ventas', propietario=cls.usuario)
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+        self.media = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(MEDIA_ROOT=self.media))
+        self.diagrama = Artefacto.objects.create(
+            proyecto=self.proyecto, fase=Fase.objects.get(nombre='Diseño'), tipo='DISE',
+            titulo='Diagrama de clases', contenido="classDiagram\n  class Venta",
+        )
+        self.url = reverse('descargar_diagrama', args=[self.diagrama.id])
+
+    @mock.patch('documentacion.render.subprocess.run')
+    def test_editar_no_renderiza_en_la_peticion(self, run):
+        respuesta = self.client.post(reverse('editar_artefacto', args=[self.diagrama.id]), {
+            'titulo': 'Diagrama de clases', 'tipo': 'DISE', 'contenido': "classDiagram\n  class Factura",
+        })
+        self.assertEqual(respuesta.status_code, 302)
+        run.assert_not_called()
+        self.diagrama.refresh_from_db()
+        self.assertTrue(self.diagrama.render_pendiente)
+
+    @mock.patch('documentacion.views.renderizador_disponible', return_value=True)
+    def test_descarga_pendiente_devuelve_202(self, _):
+        respuesta = self.client.get(self.url, {'formato': 'svg'})
+        self.assertEqual(respuesta.status_code, 202)
+        self.assertEqual(respuesta['Retry-After'], '5')
+
+    @mock.patch('documentacion.views.renderizador_disponible', return_value=False)
+    def test_descarga_sin_mermaid_cli_devuelve_el_codigo(self, _):
+        respuesta = self.client.get(self.url, {'formato': 'png'})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.content.decode(), "classDiagram\n  class Venta")
+        self.assertTrue(respuesta['Content-Disposition'].endswith('.mmd"'))
+
+    @mock.patch('documentacion.generacion.renderizador_disponible', return_value=True)
+    def test_el_worker_renderiza_los_pendientes(self, _):
+        def renderizar(codigo, formato):
+            ruta = ruta_diagrama(clave_diagrama(codigo), formato)
+            ruta.parent.mkdir(parents=True, exist_ok=True)
+            ruta.write_text('<svg/>')
+            return ruta
+
+        with mock.patch('documentacion.generacion.renderizar_codigo', side_effect=renderizar):
+            self.assertEqual(renderizar_pendientes(), 1)
+        self.diagrama.refresh_from_db()
+        self.assertFalse(self.diagrama.render_pendiente)
+        self.assertEqual(self.diagrama.render['archivos'], ['svg', 'png'])
+        self.assertEqual(renderizar_pendientes(), 0)
+
+        respuesta = self.client.get(self.url, {'formato': 'svg'})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta['Content-Type'], 'image/svg+xml')
+        self.assertEqual(b''.join(respuesta.streaming_content), b'<svg/>')
+
+
+class GenerarModalTests(TestCase):
+    """La vista previa rechaza con 400 los subartefactos que no existen, sin llamar a la IA."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('ana', password='clave-segura-123')
+        cls.proyecto = Project.objects.create(nombre='Sistema gestion ventas', propietario=cls.usuario)
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+        self.url = reverse('generar_subartefacto_modal', args=[self.proyecto.id])
+
+    @mock.patch('core.ia.obtener_backend')
+    @mock.patch('core.ia._generar_contenido')
+    def test_subartefacto_desconocido_o_vacio(self, generar, obtener_backend):
+        for consulta in ('?subartefacto=Diagrama%20inventado', '?subartefacto=', ''):
+            respuesta = self.client.get(self.url + consulta)
+            self.assertEqual(respuesta.status_code, 400, consulta)
+            self.assertEqual(respuesta.json(), {"error": "Tipo de artefacto inválido."})
+        generar.assert_not_called()
+        obtener_backend.assert_not_called()
+
+
+class DetalleProyectoTests(TestCase):
+    """detalle_proyecto se sirve con un número fijo de consultas."""
+
+    FASES = {
+        "Análisis Requisitos": ["Historia de Usuario", "Diagrama de flujo"],
+        "Diseño": ["Diagrama de clases", "Diagrama de Entidad-Relacion"],
+        "Desarrollo": ["Diagrama de secuencia", "Diagrama de estado"],
+        "Pruebas": ["caja negra", "smoke"],
+        "Despliegue": ["Diagrama de C4-contexto", "Diagrama de C4-contenedor", "Diagrama de C4-implementación"],
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('ana', password='clave-segura-123')
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+        self.client.post(reverse('crear_proyecto'), {
+            'nombre': 'Sistema gestion ventas',
+            'descripcion': 'Sistema web para gestionar las ventas y el inventario de una tienda local.',
+        })
+        self.proyecto = Project.objects.get(propietario=self.usuario)
+        self.url = reverse('detalle_proyecto', args=[self.proyecto.id])
+        obtener_catalogo()
+
+    def _generar(self, titulos):
+        for sub in SubArtefacto.objects.filter(nombre__in=titulos).select_related('fase'):
+            Artefacto.objects.create(
+                proyecto=self.proyecto, fase=sub.fase, subartefacto=sub, tipo='DISE', titulo=sub.nombre,
+                contenido='Contenido generado', contexto='RF1. El sistema registra ventas.',
+            )
+
+    def test_consultas_no_crecen_con_los_artefactos(self):
+        # sesión, usuario, proyecto (con la marca de la HU) y títulos generados; el catálogo ya está en memoria
+        with self.assertNumQueries(4):
+            self.client.get(self.url)
+        self._generar(ARTEFACTOS_VALIDOS)
+        with self.assertNumQueries(4):
+            respuesta = self.client.get(self.url)
+        self.assertTrue(respuesta.context['hu_con_requisitos'])
+
+    def test_fases_y_subartefactos_en_orden(self):
+        self._generar(["Diagrama de clases"])
+        respuesta = self.client.get(self.url)
+        fases = respuesta.context['fases']
+        self.assertEqual([f.nombre for f in fases], list(self.FASES))
+        for fase in fases:
+            self.assertEqual([s.nombre for s in fase.subartefactos_ordenados], self.FASES[fase.nombre])
+        self.assertEqual(respuesta.context['generados'], {"Diagrama de clases"})
+        self.assertFalse(respuesta.context['hu_con_requisitos'])
+
+    def test_crear_proyecto_no_copia_el_catalogo(self):
+        fases, subartefactos = Fase.objects.count(), SubArtefacto.objects.count()
+        self.client.post(reverse('crear_proyecto'), {
+            'nombre': 'Sistema gestion inventario',
+            'descripcion': 'Sistema web para gestionar el inventario de varias tiendas de la ciudad.',
+        })
+        self.assertEqual(Project.objects.filter(propietario=self.usuario).count(), 2)
+        self.assertEqual((Fase.objects.count(), SubArtefacto.objects.count()), (fases, subartefactos))
+
+
+@skipUnless(connection.vendor == 'sqlite', "Los planes se comprueban con EXPLAIN QUERY PLAN de SQLite")
+class IndicesTests(TestCase):
+    """Las consultas de cada vista usan un índice con 100k artefactos, sin recorrer la tabla."""
+
+    PROYECTOS = 2000
+    ARTEFACTOS_POR_PROYECTO = 50
+
+    @classmethod
+    def setUpTestData(cls):
+        usuarios = User.objects.bulk_create([User(username=f'usuario{i}') for i in range(100)])
+        Project.objects.bulk_create([
+            Project(nombre=f'Proyecto {i}', propietario=usuarios[i % len(usuarios)]) for i in range(cls.PROYECTOS)
+        ])
+        fase = Fase.objects.get(nombre='Diseño')
+        for proyecto_id in Project.objects.values_list('id', flat=True).iterator():
+            Artefacto.objects.bulk_create([
+                Artefacto(proyecto_id=proyecto_id, fase=fase, tipo='DISE', titulo=f'Artefacto {i}', contenido='-')
+                for i in range(cls.ARTEFACTOS_POR_PROYECTO)
+            ])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        cls.usuario = usuarios[0]
+        cls.proyecto = Project.objects.filter(propietario=cls.usuario).first()
+
+    def assertUsaIndice(self, queryset, busqueda):
+        """`busqueda` es lo que el plan muestra del índice, p. ej. "(proyecto_id=? AND titulo=?)"."""
+        plan = queryset.explain()
+        self.assertIn(busqueda, plan)
+        self.assertNotIn('SCAN documentacion_', plan)
+        return plan
+
+    def test_hay_100k_artefactos(self):
+        self.assertGreaterEqual(Artefacto.objects.count(), 100_000)
+
+    def test_artefacto_por_titulo(self):
+        # El índice de artefacto_unico_por_proyecto (SQLite lo nombra sqlite_autoindex_...)
+        self.assertUsaIndice(Artefacto.objects.filter(proyecto=self.proyecto, titulo='Artefacto 7'),
+                             '(proyecto_id=? AND titulo=?)')
+
+    def test_historia_de_usuario_sin_distinguir_mayusculas(self):
+        self.assertUsaIndice(
+            Artefacto.objects.filter(proyecto=self.proyecto, titulo_normalizado='historia de usuario'),
+            'artefacto_titulo_norm_idx (proyecto_id=? AND titulo_normalizado=?)',
+        )
+        self.assertEqual(Artefacto.objects.get(proyecto=self.proyecto, titulo_normalizado='artefacto 7').titulo,
+                         'Artefacto 7')
+
+    def test_detalle_proyecto_marca_de_la_hu(self):
+        self.client.force_login(self.usuario)
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(reverse('detalle_proyecto', args=[self.proyecto.id]))
+        self.assertEqual(respuesta.status_code, 200)
+        for consulta in consultas.captured_queries:
+            with connection.cursor() as cursor:
+                cursor.execute(f"EXPLAIN QUERY PLAN {consulta['sql']}")
+                plan = "\n".join(str(fila[-1]) for fila in cursor.fetchall())
+            self.assertNotIn('SCAN documentacion_artefacto', plan, consulta['sql'])
+
+    def test_dashboard(self):
+        plan = self.assertUsaIndice(
+            Project.objects.filter(propietario=self.usuario).order_by('-creado'), 'proyecto_dashboard_idx',
+        )
+        self.assertNotIn('TEMP B-TREE', plan)  # el orden sale del índice
+
+    def test_artefacto_del_propietario(self):
+        artefacto = Artefacto.objects.filter(proyecto=self.proyecto).first()
+        plan = Artefacto.objects.filter(id=artefacto.id, proyecto__propietario=self.usuario).explain()
+        self.assertIn('USING INTEGER PRIMARY KEY', plan)
+        self.assertNotIn('SCAN', plan)
+
+
+@override_settings(GENERACION_ASINCRONA=True)
+class GenerarArtefactoTests(TestCase):
+    """Con worker las vistas solo encolan: la IA la llama el worker al ejecutar el trabajo."""
+
+    CASOS = "1. Registrar una venta con stock suficiente.\n2. Rechazar una venta sin stock."
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('ana', password='clave-segura-123')
+        cls.proyecto = Project.objects.create(
+            nombre='Sistema gestion ventas', propietario=cls.usuario,
+            descripcion='Sistema web para gestionar las ventas de una tienda local.',
+        )
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+        sin_cache_ni_limites(self)
+        self.url = reverse('generar_artefacto', args=[self.proyecto.id, 'caja negra'])
+        self.url_estado = reverse('estado_generacion', args=[self.proyecto.id])
+
+    @mock.patch('core.ia.obtener_backend')
+    @mock.patch('core.ia._generar_contenido', return_value=CASOS)
+    def test_la_vista_encola_y_el_worker_genera(self, generar, obtener_backend):
+        respuesta = self.client.get(self.url)
+        self.assertRedirects(respuesta, reverse('detalle_proyecto', args=[self.proyecto.id]))
+        generar.assert_not_called()
+        job = GenerationJob.objects.get(proyecto=self.proyecto)
+        self.assertEqual((job.titulo, job.estado), ('caja negra', GenerationJob.EN_COLA))
+        self.assertEqual(self.client.get(self.url_estado).json()['pendientes'], 1)
+
+        job = ejecutar_job(tomar_siguiente_job())
+        generar.assert_called_once()
+        obtener_backend.assert_not_called()
+        self.assertEqual(job.estado, GenerationJob.TERMINADO)
+        self.assertEqual(Artefacto.objects.get(pk=job.artefacto_id).contenido, self.CASOS)
+
+        estado = self.client.get(self.url_estado).json()
+        self.assertEqual(estado['pendientes'], 0)
+        self.assertEqual(estado['generaciones'], [{
+            "id": job.id, "titulo": 'caja negra', "estado": GenerationJob.TERMINADO,
+            "estado_display": job.get_estado_display(), "error": '',
+            "url": reverse('ver_artefacto', args=[job.artefacto_id]),
+        }])
+
+    @mock.patch('core.ia._generar_contenido')
+    def test_repetir_la_peticion_no_encola_otro(self, generar):
+        self.client.get(self.url)
+        self.client.get(self.url)
+        self.assertEqual(GenerationJob.objects.filter(proyecto=self.proyecto).count(), 1)
+        generar.assert_not_called()
+
+    @mock.patch('core.ia._generar_contenido', side_effect=RuntimeError('Servicio caído'))
+    def test_el_fallo_queda_en_el_trabajo(self, _):
+        self.client.get(self.url)
+        with self.assertLogs('documentacion.generacion', 'ERROR'):
+            job = ejecutar_job(tomar_siguiente_job())
+        self.assertEqual((job.estado, job.error), (GenerationJob.FALLIDO, 'Servicio caído'))
+        self.assertFalse(Artefacto.objects.filter(proyecto=self.proyecto).exists())
+        self.assertIsNone(tomar_siguiente_job())
+        self.assertEqual(self.client.get(self.url_estado).json()['generaciones'][0]['url'], None)
+
+    def test_encolar_no_lee_los_cuerpos(self):
+        fase = Fase.objects.get(nombre='Análisis Requisitos')
+        Artefacto.objects.create(proyecto=self.proyecto, fase=fase, tipo='AREQ', titulo='Historia de Usuario',
+                                 contenido='Como vendedor quiero registrar ventas. ' * 200, contexto=self.CASOS)
+        url = reverse('generar_artefacto', args=[self.proyecto.id, 'Diagrama de clases'])
+        with CaptureQueriesContext(connection) as consultas:
+            self.client.get(url)
+        self.assertTrue(GenerationJob.objects.filter(proyecto=self.proyecto, titulo='Diagrama de clases').exists())
+        for consulta in consultas.captured_queries:
+            if consulta['sql'].startswith('SELECT') and 'FROM "documentacion_artefacto"' in consulta['sql']:
+                self.assertNotIn('"contenido"', consulta['sql'])
+                self.assertNotIn('"render"', consulta['sql'])
+
+    @override_settings(GENERACION_ASINCRONA=False)
+    @mock.patch('core.ia._generar_contenido', return_value=CASOS)
+    def test_sin_worker_genera_en_la_peticion(self, generar):
+        respuesta = self.client.get(self.url)
+        artefacto = Artefacto.objects.get(proyecto=self.proyecto, titulo='caja negra')
+        self.assertRedirects(respuesta, reverse('ver_artefacto', args=[artefacto.id]))
+        generar.assert_called_once()
+        self.assertEqual(GenerationJob.objects.get(proyecto=self.proyecto).estado, GenerationJob.TERMINADO)
+
+
+class GenerarStreamTests(TestCase):
+    """generar_subartefacto_stream envía el texto por server-sent events y guarda el artefacto al terminar."""
+
+    CASOS = "1. Registrar una venta con stock suficiente.\n2. Rechazar una venta sin stock."
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('ana', password='clave-segura-123')
+        cls.proyecto = Project.objects.create(
+            nombre='Sistema gestion ventas', propietario=cls.usuario,
+            descripcion='Sistema web para gestionar las ventas de una tienda local.',
+        )
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+        self.async_client.force_login(self.usuario)
+        sin_cache_ni_limites(self)
+        # Respuestas simuladas sin red: el stream recorre el mismo camino que con Gemini
+        self.enterContext(override_settings(IA_BACKEND={'NOMBRE': 'local', 'LATENCIA': 0}))
+        reiniciar_backend()
+        self.addCleanup(reiniciar_backend)
+        self.url = reverse('generar_subartefacto_stream', args=[self.proyecto.id])
+
+    @staticmethod
+    def _eventos(cuerpo):
+        eventos = []
+        for bloque in cuerpo.decode('utf-8').strip().split("\n\n"):
+            evento, datos = bloque.split("\n")
+            eventos.append((evento.removeprefix("event: "), json.loads(datos.removeprefix("data: "))))
+        return eventos
+
+    def _comprobar_guardado(self, eventos):
+        tipos = [tipo for tipo, _ in eventos]
+        self.assertEqual(tipos[-1], 'fin')
+        self.assertEqual(set(tipos[:-1]), {'fragmento'})
+        artefacto = Artefacto.objects.get(proyecto=self.proyecto, titulo='caja negra')
+        self.assertEqual(artefacto.contenido, "".join(datos['texto'] for _, datos in eventos[:-1]).strip())
+        self.assertEqual(eventos[-1][1]['url'], reverse('ver_artefacto', args=[artefacto.id]))
+        job = GenerationJob.objects.get(proyecto=self.proyecto, titulo='caja negra')
+        self.assertEqual((job.estado, job.artefacto_id, job.error), (GenerationJob.TERMINADO, artefacto.id, ''))
+
+    def test_stream_guarda_el_artefacto_y_cierra_el_trabajo(self):
+        respuesta = self.client.get(self.url, {'subartefacto': 'caja negra'})
+        self.assertEqual(respuesta['Content-Type'], 'text/event-stream')
+        self.assertFalse(GenerationJob.objects.filter(estado=GenerationJob.TERMINADO).exists())  # aún sin consumir
+        self._comprobar_guardado(self._eventos(b"".join(respuesta.streaming_content)))
+
+    async def test_stream_asincrono(self):
+        respuesta = await self.async_client.get(self.url, {'subartefacto': 'caja negra'})
+        cuerpo = b"".join([fragmento async for fragmento in respuesta.streaming_content])
+        await sync_to_async(self._comprobar_guardado)(self._eventos(cuerpo))
+
+    def test_existente_se_envia_sin_llamar_a_la_ia(self):
+        artefacto = Artefacto.objects.create(proyecto=self.proyecto, fase=Fase.objects.get(nombre='Pruebas'),
+                                             tipo='PRUE', titulo='caja negra', contenido=self.CASOS)
+        with mock.patch('core.ia._backend') as backend:
+            respuesta = self.client.get(self.url, {'subartefacto': 'caja negra'})
+            eventos = self._eventos(b"".join(respuesta.streaming_content))
+        backend.assert_not_called()
+        self.assertEqual(eventos, [('fragmento', {'texto': self.CASOS}),
+                                   ('fin', {'url': reverse('ver_artefacto', args=[artefacto.id])})])
+        self.assertFalse(GenerationJob.objects.exists())
+
+    def test_el_fallo_a_mitad_queda_en_el_trabajo(self):
+        def cortado(*args, **kwargs):
+            yield "fragmento", "1. Registrar"
+            raise ErrorIA("Se cortó la respuesta.")
+
+        with mock.patch('documentacion.views.generar_y_guardar_stream', cortado):
+            respuesta = self.client.get(self.url, {'subartefacto': 'caja negra'})
+            eventos = self._eventos(b"".join(respuesta.streaming_content))
+        self.assertEqual(eventos[-1], ('error', {'error': 'Se cortó la respuesta.'}))
+        job = GenerationJob.objects.get(proyecto=self.proyecto)
+        self.assertEqual((job.estado, job.error), (GenerationJob.FALLIDO, 'Se cortó la respuesta.'))
+        self.assertFalse(Artefacto.objects.exists())
+
+    def test_requisitos_de_la_hu_igual_que_generar_artefacto(self):
+        # Los diagramas necesitan los requisitos de la HU en las dos vistas; las pruebas, no
+        respuesta = self.client.get(self.url, {'subartefacto': 'Diagrama de clases'})
+        self.assertEqual(respuesta.status_code, 400)
+        respuesta = self.client.get(reverse('generar_artefacto', args=[self.proyecto.id, 'Diagrama de clases']))
+        self.assertRedirects(respuesta, reverse('detalle_proyecto', args=[self.proyecto.id]))
+        self.assertFalse(GenerationJob.objects.exists())
+
+        self.assertEqual(self.client.get(self.url, {'subartefacto': 'caja negra'}).status_code, 200)
+
+
+class ColaGeneracionTests(TestCase):
+    """Un trabajo en vuelo por (proyecto, título); sin cuota de IA espera en la cola sin bloquear a los demás."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('ana', password='clave-segura-123')
+        cls.proyecto = Project.objects.create(nombre='Sistema gestion ventas', propietario=cls.usuario)
+
+    def test_single_flight(self):
+        job, nuevo = reservar_generacion(self.proyecto, 'Diagrama de clases', estado=GenerationJob.EJECUTANDO)
+        otro, otro_nuevo = reservar_generacion(self.proyecto, 'Diagrama de clases')
+        self.assertEqual((nuevo, otro_nuevo), (True, False))
+        self.assertEqual(otro.pk, job.pk)
+        self.assertEqual(GenerationJob.objects.filter(proyecto=self.proyecto, titulo='Diagrama de clases').count(), 1)
+
+    def test_vuelo_interrumpido_se_da_por_fallido(self):
+        job, _ = reservar_generacion(self.proyecto, 'Diagrama de clases', estado=GenerationJob.EJECUTANDO)
+        GenerationJob.objects.filter(pk=job.pk).update(iniciado=timezone.now() - timedelta(minutes=VUELO_MAXIMO + 1))
+        nuevo_job, nuevo = reservar_generacion(self.proyecto, 'Diagrama de clases')
+        self.assertTrue(nuevo)
+        job.refresh_from_db()
+        self.assertEqual(job.estado, GenerationJob.FALLIDO)
+        self.assertEqual(recuperar_jobs_huerfanos(), 0)  # el mismo criterio que el worker al arrancar
+        self.assertEqual(GenerationJob.objects.get(pk=nuevo_job.pk).estado, GenerationJob.EN_COLA)
+
+    def _sin_cuota(self, job):
+        with mock.patch('documentacion.generacion.generar_y_guardar',
+                        side_effect=LimiteExcedido("Sin cuota de IA.", espera=30)):
+            return ejecutar_job(job)
+
+    @override_settings(GENERACION_ASINCRONA=True)
+    def test_sin_cuota_espera_sin_bloquear_la_cola(self):
+        limitado = encolar_generacion(self.proyecto, 'Diagrama de clases')
+        otro = encolar_generacion(self.proyecto, 'Diagrama de estado')
+        job = self._sin_cuota(tomar_siguiente_job())
+        self.assertEqual(job.pk, limitado.pk)
+        self.assertEqual(job.estado, GenerationJob.EN_COLA)
+        self.assertGreater(job.no_antes_de, timezone.now() + timedelta(seconds=25))
+
+        self.assertEqual(tomar_siguiente_job().pk, otro.pk)
+        self.assertIsNone(tomar_siguiente_job())  # el limitado no vuelve hasta no_antes_de
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + timedelta(seconds=31)):
+            self.assertEqual(tomar_siguiente_job().pk, limitado.pk)
+
+    @override_settings(GENERACION_ASINCRONA=True)
+    def test_proyecto_sin_cuota_vuelve_a_la_cola(self):
+        encolar_generacion(self.proyecto, PROYECTO_COMPLETO)
+        with mock.patch('documentacion.generacion._generar_nodo',
+                        side_effect=LimiteExcedido("Sin cuota de IA.", espera=30)) as nodo:
+            job = ejecutar_job(tomar_siguiente_job())
+        nodo.assert_called_once()  # la HU; lo que depende de ella no se lanza
+        self.assertEqual((job.estado, job.error), (GenerationJob.EN_COLA, "Sin cuota de IA."))
+        self.assertGreater(job.no_antes_de, timezone.now() + timedelta(seconds=25))
+
+    @override_settings(GENERACION_ASINCRONA=True, GENERACION_INTENTOS_MAXIMOS=3)
+    def test_sin_cuota_falla_tras_los_intentos_maximos(self):
+        encolar_generacion(self.proyecto, 'Diagrama de clases')
+        for intento in range(1, 4):
+            GenerationJob.objects.update(no_antes_de=None)
+            job = self._sin_cuota(tomar_siguiente_job())
+            self.assertEqual(job.intentos, intento)
+        self.assertEqual(job.estado, GenerationJob.FALLIDO)
+        self.assertIsNotNone(job.terminado)
+        self.assertIsNone(tomar_siguiente_job())
+
+
+class PlanActualizacionTests(TestCase):
+    """Al regenerar el proyecto cada artefacto se conserva, se parchea o se genera de cero según sus entradas."""
+
+    RF = "RF1. El sistema registra ventas.\nRF2. El sistema emite facturas.\nRF3. El sistema controla el stock."
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('ana', password='clave-segura-123')
+
+    def setUp(self):
+        self.proyecto = Project.objects.create(
+            nombre='Sistema gestion ventas', propietario=self.usuario,
+            descripcion='Sistema web para gestionar las ventas de una tienda local.',
+        )
+        self.hu = guardar_artefacto(self.proyecto, 'Historia de Usuario', 'Como vendedor...', self.RF)
+        self.diagrama = guardar_artefacto(self.proyecto, 'Diagrama de clases', 'classDiagram\n  class Venta')
+
+    def _plan(self, artefacto):
+        requisitos = {r.hash: r for r in Requisito.objects.filter(proyecto=self.proyecto)}
+        return plan_actualizacion(artefacto, requisitos, huella_proyecto(self.proyecto))
+
+    def test_vigente_si_no_cambia_nada(self):
+        self.assertEqual(self._plan(self.hu), (VIGENTE, [], []))
+        self.assertEqual(self._plan(self.diagrama), (VIGENTE, [], []))
+
+    def test_vigente_si_se_escribio_a_mano(self):
+        self.diagrama.generado_por_ia = False
+        self.diagrama.huella = ''
+        self.assertEqual(self._plan(self.diagrama), (VIGENTE, [], []))
+
+    def test_parche_con_pocos_rf_cambiados(self):
+        sincronizar_requisitos(self.proyecto, self.RF.replace("emite facturas", "emite facturas electrónicas"))
+        accion, anadidos, eliminados = self._plan(self.diagrama)
+        self.assertEqual(accion, PARCHE)
+        self.assertEqual(anadidos, ["RF2. El sistema emite facturas electrónicas."])
+        self.assertEqual(eliminados, ["RF2. El sistema emite facturas."])
+
+    @override_settings(GENERACION_PARCHE_MAXIMO=1)
+    def test_regenerar_con_muchos_rf_cambiados(self):
+        sincronizar_requisitos(self.proyecto, "RF1. El sistema registra devoluciones.")
+        self.assertEqual(self._plan(self.diagrama), (REGENERAR, [], []))
+
+    def test_regenerar_si_cambia_la_descripcion(self):
+        self.proyecto.descripcion = 'Sistema web para gestionar las ventas y el inventario de varias tiendas.'
+        self.assertEqual(self._plan(self.hu), (REGENERAR, [], []))
+        self.assertEqual(self._plan(self.diagrama), (REGENERAR, [], []))  # sus prompts también la reciben
+
+    def test_regenerar_sin_huella(self):
+        self.diagrama.huella = ''
+        self.assertEqual(self._plan(self.diagrama), (REGENERAR, [], []))
+
+
+@override_settings(GENERACION_ASINCRONA=True, IA_LOTE_TAMANO=4)
+class GenerarProyectoTests(TestCase):
+    """La HU va antes que el resto; sin forzar solo se genera lo que cambió."""
+
+    RF = "RF1. El sistema registra ventas.\nRF2. El sistema emite facturas."
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('ana', password='clave-segura-123')
+
+    def setUp(self):
+        self.proyecto = Project.objects.create(
+            nombre='Sistema gestion ventas', propietario=self.usuario,
+            descripcion='Sistema web para gestionar las ventas de una tienda local.',
+        )
+        self.lotes = []
+        nodo = mock.patch('documentacion.generacion._generar_nodo', side_effect=self._generar_nodo)
+        nodo.start()
+        self.addCleanup(nodo.stop)
+
+    def _generar_nodo(self, proyecto, titulos, subartefactos, existentes, forzar, requisitos):
+        # Sin base de datos: corre en los hilos del pool
+        self.lotes.append((titulos, requisitos))
+        return {titulo: Artefacto(titulo=titulo, contexto=self.RF if titulo == 'Historia de Usuario' else '')
+                for titulo in titulos}
+
+    def _generar_todo(self):
+        # La HU primero: los demás guardan los RF que extrajo
+        for titulo in ARTEFACTOS_TEXTO + ARTEFACTOS_MERMAID:
+            contenido = 'Como vendedor...' if titulo in ARTEFACTOS_TEXTO else 'graph TD'
+            guardar_artefacto(self.proyecto, titulo, contenido, self.RF if titulo == 'Historia de Usuario' else None)
+        return {a.titulo: a for a in Artefacto.objects.filter(proyecto=self.proyecto).metadatos()}
+
+    def test_la_hu_se_genera_antes_que_sus_dependientes(self):
+        resultados = generar_proyecto(self.proyecto, forzar=True)
+        self.assertEqual(set(resultados), set(ARTEFACTOS_VALIDOS))
+        self.assertEqual(self.lotes[0], (['Historia de Usuario'], None))
+        resto = [titulo for titulos, _ in self.lotes[1:] for titulo in titulos]
+        self.assertCountEqual(resto, [t for t in ARTEFACTOS_VALIDOS if t != 'Historia de Usuario'])
+        for titulos, requisitos in self.lotes[1:]:
+            self.assertLessEqual(len(titulos), 4)
+            self.assertEqual(requisitos, self.RF)  # los prompts reciben los RF de la HU recién generada
+
+    def test_si_falla_la_hu_no_se_genera_el_resto(self):
+        with mock.patch('documentacion.generacion._generar_nodo', side_effect=RuntimeError('Servicio caído')) as nodo:
+            with self.assertLogs('documentacion.generacion', 'ERROR'), self.assertRaises(RuntimeError) as error:
+                generar_proyecto(self.proyecto, forzar=True)
+        nodo.assert_called_once()
+        self.assertIn('Historia de Usuario: Servicio caído', str(error.exception))
+        self.assertIn('Diagrama de clases: Depende de Historia de Usuario, que no se pudo generar.', str(error.exception))
+
+    def test_planificar_reparte_vigentes_parches_y_nuevos(self):
+        existentes = self._generar_todo()
+        sincronizar_requisitos(self.proyecto, self.RF.replace("emite facturas", "emite facturas electrónicas"))
+        guardar_artefacto(self.proyecto, 'Diagrama de clases', 'classDiagram\n  class Factura')  # ya con los RF nuevos
+        existentes['Diagrama de clases'].refresh_from_db()
+        del existentes['caja negra']
+
+        vigentes, parches, nuevos = _planificar(
+            self.proyecto, ['Diagrama de clases', 'Diagrama de estado', 'caja negra'], existentes,
+        )
+        self.assertEqual(list(vigentes), ['Diagrama de clases'])
+        self.assertEqual(parches, {'Diagrama de estado': (["RF2. El sistema emite facturas electrónicas."],
+                                                          ["RF2. El sistema emite facturas."])})
+        self.assertEqual(nuevos, ['caja negra'])
+
+    def test_planificar_rehace_la_hu_sin_requisitos(self):
+        hu = guardar_artefacto(self.proyecto, 'Historia de Usuario', 'Como vendedor...', '[ERROR] Sin respuesta')
+        self.assertEqual(_planificar(self.proyecto, ['Historia de Usuario'], {'Historia de Usuario': hu}),
+                         ({}, {}, ['Historia de Usuario']))
+
+    def test_sin_forzar_solo_genera_lo_que_cambio(self):
+        self._generar_todo()
+        Artefacto.objects.filter(proyecto=self.proyecto, titulo='Diagrama de clases').delete()
+        Artefacto.objects.filter(proyecto=self.proyecto, titulo='Diagrama de estado').update(huella='')
+        resultados = generar_proyecto(self.proyecto)
+        self.assertEqual(set(resultados), set(ARTEFACTOS_VALIDOS))
+        self.assertEqual(len(self.lotes), 1)  # los dos comparten contexto: un solo lote
+        titulos, requisitos = self.lotes[0]
+        self.assertCountEqual(titulos, ['Diagrama de clases', 'Diagrama de estado'])
+        self.assertEqual(requisitos, self.RF)
+
+
+class LoteIATests(TestCase):
+    """Los artefactos con el mismo contexto se piden en una llamada JSON; los que fallan, uno a uno."""
+
+    TIPOS = ['Diagrama de clases', 'Diagrama de estado', 'Diagrama de secuencia']
+    SUELTOS = {
+        'diagrama-clases': "classDiagram\n  class Venta",
+        'diagrama-estado': "stateDiagram-v2\n  [*] --> Abierta",
+        'diagrama-secuencia': "sequenceDiagram\n  Cliente->>Caja: paga",
+    }
+    TEXTO = 'Sistema web para gestionar las ventas de una tienda local.'
+
+    def setUp(self):
+        sin_cache_ni_limites(self)
+        self.lote = json.dumps({f"a{i}": self.SUELTOS[PROMPTS[tipo].nombre] for i, tipo in enumerate(self.TIPOS, 1)})
+        generar = mock.patch('core.ia._generar_contenido', side_effect=self._responder)
+        self.generar = generar.start()
+        self.addCleanup(generar.stop)
+
+    def _responder(self, prompt, forzar=False, generation_config=None, plantilla=None, variables=None, tipo=None):
+        if tipo == 'lote':
+            return self.lote
+        return self.SUELTOS[plantilla.nombre]
+
+    def _llamadas(self):
+        return [c.kwargs.get('tipo') or c.kwargs['plantilla'].nombre for c in self.generar.call_args_list]
+
+    def test_una_llamada_para_todo_el_lote(self):
+        resultados = generar_subartefactos_en_lote(self.TIPOS, texto=self.TEXTO)
+        self.assertEqual(resultados, {tipo: self.SUELTOS[PROMPTS[tipo].nombre] for tipo in self.TIPOS})
+        self.assertEqual(self._llamadas(), ['lote'])
+        prompt, config = self.generar.call_args.args[0], self.generar.call_args.kwargs['generation_config']
+        self.assertEqual(prompt.count(self.TEXTO), 1)  # el contexto común va una sola vez
+        self.assertEqual(config['response_mime_type'], 'application/json')
+        self.assertEqual(config['response_schema']['required'], ['a1', 'a2', 'a3'])
+
+    def test_los_invalidos_se_generan_por_separado(self):
+        # a2 no es un diagrama de estado y a3 falta
+        self.lote = json.dumps({"a1": self.SUELTOS['diagrama-clases'], "a2": self.SUELTOS['diagrama-clases']})
+        resultados = generar_subartefactos_en_lote(self.TIPOS, texto=self.TEXTO)
+        self.assertEqual(self._llamadas(), ['lote', 'diagrama-estado', 'diagrama-secuencia'])
+        self.assertEqual(resultados['Diagrama de estado'], self.SUELTOS['diagrama-estado'])
+
+    def test_respuesta_que_no_es_json(self):
+        for respuesta in ('Aquí tienes los diagramas:', '["classDiagram"]'):
+            with self.subTest(respuesta=respuesta):
+                self.generar.reset_mock()
+                self.lote = respuesta
+                resultados = generar_subartefactos_en_lote(self.TIPOS, texto=self.TEXTO)
+                self.assertEqual(self._llamadas(), ['lote', 'diagrama-clases', 'diagrama-estado', 'diagrama-secuencia'])
+                self.assertEqual(list(resultados), self.TIPOS)
+
+    def test_lote_bloqueado_se_genera_uno_a_uno(self):
+        def responder(*args, **kwargs):
+            if kwargs.get('tipo') == 'lote':
+                raise ErrorIA("Respuesta bloqueada.")
+            return self._responder(*args, **kwargs)
+
+        self.generar.side_effect = responder
+        resultados = generar_subartefactos_en_lote(self.TIPOS, texto=self.TEXTO)
+        self.assertEqual(len(self.generar.call_args_list), 4)
+        self.assertEqual(resultados['Diagrama de clases'], self.SUELTOS['diagrama-clases'])
+
+    def test_error_transitorio_no_multiplica_las_llamadas(self):
+        self.generar.side_effect = ErrorIATransitorio("Servicio no disponible.")
+        with self.assertRaises(ErrorIATransitorio):
+            generar_subartefactos_en_lote(self.TIPOS, texto=self.TEXTO)
+        self.assertEqual(self._llamadas(), ['lote'])
+
+    def test_lotes_del_tamano_pedido(self):
+        generar_subartefactos_en_lote(self.TIPOS, tamano=2, texto=self.TEXTO)
+        self.assertEqual(self._llamadas(), ['lote', 'diagrama-secuencia'])  # un lote de uno va suelto
+        self.generar.reset_mock()
+        generar_subartefactos_en_lote(self.TIPOS, tamano=1, texto=self.TEXTO)
+        self.assertEqual(self._llamadas(), ['diagrama-clases', 'diagrama-estado', 'diagrama-secuencia'])
+
+    def test_el_lote_queda_en_la_cache_de_cada_artefacto(self):
+        self.enterContext(override_settings(IA_CACHE={'BACKEND': 'django'}))
+        reiniciar_cache()
+        self.addCleanup(caches['default'].clear)
+        primera = generar_subartefactos_en_lote(self.TIPOS, texto=self.TEXTO)
+        self.generar.reset_mock()
+        self.assertEqual(generar_subartefactos_en_lote(self.TIPOS[:2], tamano=1, texto=self.TEXTO),
+                         {tipo: primera[tipo] for tipo in self.TIPOS[:2]})
+        self.generar.assert_not_called()
+
+
+class HistoriaUsuarioIATests(TestCase):
+    """La HU y sus requisitos salen de una llamada JSON; si no es válida, de la HU y luego los requisitos."""
+
+    HISTORIAS = "Como vendedor quiero registrar una venta para llevar el control del stock."
+    REQUISITOS = "RF1: El sistema debe registrar ventas.\nRF2: El sistema debe descontar el stock."
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('ana', password='clave-segura-123')
+        cls.proyecto = Project.objects.create(
+            nombre='Sistema gestion ventas', propietario=cls.usuario,
+            descripcion='Sistema web para gestionar las ventas de una tienda local.',
+        )
+
+    def setUp(self):
+        sin_cache_ni_limites(self)
+        self.backend = self.enterContext(mock.patch('core.ia.obtener_backend')).return_value
+        self.backend.errores_tiempo = self.backend.errores_transitorios = ()
+
+    def _responder(self, *respuestas):
+        self.backend.generar.side_effect = [RespuestaLocal(texto, UsoLocal(100, 50)) for texto in respuestas]
+
+    def _generar_y_guardar(self):
+        with CaptureQueriesContext(connection) as consultas:
+            artefacto = generar_y_guardar(self.proyecto, 'Historia de Usuario')
+        escrituras = [c['sql'] for c in consultas.captured_queries
+                      if c['sql'].startswith(('INSERT INTO "documentacion_artefacto"', 'UPDATE "documentacion_artefacto"'))]
+        self.assertEqual(len(escrituras), 1, escrituras)
+        self.assertTrue(escrituras[0].startswith('INSERT'))
+        self.assertEqual((artefacto.contenido, artefacto.contexto), (self.HISTORIAS, self.REQUISITOS))
+
+    def test_una_sola_llamada_estructurada(self):
+        self._responder(json.dumps({"historias": self.HISTORIAS, "requisitos": self.REQUISITOS}))
+        self._generar_y_guardar()
+        self.assertEqual(self.backend.generar.call_count, 1)
+        self.assertEqual(self.backend.generar.call_args.args[1]['response_mime_type'], 'application/json')
+
+    def test_respuesta_no_valida_vuelve_a_dos_llamadas(self):
+        self._responder('{"historias": "sin requisitos"}', self.HISTORIAS, self.REQUISITOS)
+        self._generar_y_guardar()
+        self.assertEqual(self.backend.generar.call_count, 3)
+
+    @override_settings(IA_HU_ESTRUCTURADA=False)
+    def test_sin_modo_estructurado(self):
+        self._responder(self.HISTORIAS, self.REQUISITOS)
+        self._generar_y_guardar()
+        self.assertEqual(self.backend.generar.call_count, 2)
+        self.assertEqual([c.args[1] for c in self.backend.generar.call_args_list], [{}, {}])
+
+
+class PlantillasTests(TestCase):
+    """Cada prompt tiene un id versionado que queda en el artefacto; PARCHE envía solo los RF que cambiaron."""
+
+    ACTUAL = "classDiagram\n  class Venta"
+
+    def test_ids_versionados_y_unicos(self):
+        plantillas = [*PROMPTS.values(), PROMPT_PARCHE]
+        for plantilla in plantillas:
+            self.assertEqual(plantilla.id, f"{plantilla.nombre}/v{plantilla.version}")
+        self.assertEqual(len({p.id for p in plantillas}), len(plantillas))
+
+    def test_instrucciones_como_prefijo_comun(self):
+        plantilla = PROMPTS['Diagrama de clases']
+        uno, otro = plantilla(texto='Ventas de una tienda.'), plantilla(texto='Reservas de un hotel.')
+        self.assertTrue(uno.startswith(plantilla.instrucciones + "\n\n"))
+        self.assertTrue(otro.startswith(plantilla.instrucciones + "\n\n"))
+        self.assertEqual(uno.removeprefix(plantilla.instrucciones + "\n\n"),
+                         plantilla.parte_variable(texto='Ventas de una tienda.'))
+        with self.assertRaisesMessage(TypeError, 'diagrama-clases/v'):
+            plantilla()
+
+    def test_el_artefacto_guarda_la_version(self):
+        usuario = User.objects.create_user('ana', password='clave-segura-123')
+        proyecto = Project.objects.create(nombre='Sistema gestion ventas', propietario=usuario)
+        artefacto = guardar_artefacto(proyecto, 'Diagrama de clases', self.ACTUAL)
+        self.assertEqual(Artefacto.objects.get(pk=artefacto.pk).plantilla, PROMPTS['Diagrama de clases'].id)
+
+    @mock.patch('core.ia._generar_contenido', return_value="classDiagram\n  class Venta\n  class Factura")
+    def test_parche_envia_el_artefacto_y_los_cambios(self, generar):
+        texto = actualizar_subartefacto('Diagrama de clases', self.ACTUAL, ["RF2. El sistema emite facturas."], [])
+        self.assertEqual(texto, "classDiagram\n  class Venta\n  class Factura")
+        prompt, opciones = generar.call_args.args[0], generar.call_args.kwargs
+        self.assertIs(opciones['plantilla'], PROMPT_PARCHE)
+        self.assertEqual(opciones['variables'], {
+            "tipo": 'Diagrama de clases', "contenido": self.ACTUAL,
+            "anadidos": "RF2. El sistema emite facturas.", "eliminados": "(ninguno)",
+        })
+        self.assertTrue(prompt.startswith(PROMPT_PARCHE.instrucciones))
+        self.assertIn(f"Artefacto actual:\n{self.ACTUAL}", prompt)
+
+    @mock.patch('core.ia._generar_contenido', return_value="sequenceDiagram\n  Cliente->>Caja: paga")
+    def test_parche_de_otro_tipo_se_descarta(self, _):
+        self.assertIsNone(actualizar_subartefacto('Diagrama de clases', self.ACTUAL, [], ["RF2. El sistema emite facturas."]))
+
+
+@override_settings(IA_CACHE_CONTEXTO={'ACTIVO': True, 'TTL': 3600, 'MIN_TOKENS': 1024})
+class ContextoGeminiTests(TestCase):
+    """Las instrucciones largas se suben una vez como CachedContent; las cortas van en el prompt."""
+
+    LARGA = Plantilla('prueba-contexto', 1, instrucciones="Sigue esta regla al pie de la letra. " * 150,
+                      variables="Historias de usuario:\n{texto}")
+
+    def setUp(self):
+        sin_cache_ni_limites(self)
+        self.backend = BackendGemini(api_key='clave-de-prueba')
+        self.cached_content = self.enterContext(mock.patch('google.generativeai.caching.CachedContent'))
+        self.cached_content.create.side_effect = self._crear
+        self.desde_contexto = self.enterContext(
+            mock.patch('google.generativeai.GenerativeModel.from_cached_content', side_effect=lambda c: ('modelo', c.name))
+        )
+        self.creados = 0
+
+    def _crear(self, **kwargs):
+        self.creados += 1
+        return SimpleNamespace(name=f'cachedContents/{self.creados}', expire_time=timezone.now() + timedelta(hours=1))
+
+    def test_por_debajo_del_minimo_no_se_cachea(self):
+        plantilla = PROMPTS['Historia de Usuario']
+        self.assertLess(len(plantilla.instrucciones) // CARACTERES_POR_TOKEN, 1024)
+        self.assertIsNone(self.backend.modelo_con_contexto(plantilla))
+        variables = {'nombre_proyecto': 'Ventas', 'descripcion': 'Tienda local.'}
+        _, enviado = self.backend._preparar(plantilla(**variables), {}, plantilla, variables)
+        self.assertEqual(enviado, plantilla(**variables))  # el prompt completo
+        self.cached_content.create.assert_not_called()
+
+    def test_se_crea_una_vez_y_se_reutiliza(self):
+        self.assertEqual(self.backend.modelo_con_contexto(self.LARGA), ('modelo', 'cachedContents/1'))
+        modelo, enviado = self.backend._preparar(self.LARGA(texto='RF1'), {}, self.LARGA, {'texto': 'RF1'})
+        self.assertEqual((modelo, enviado), (('modelo', 'cachedContents/1'), "Historias de usuario:\nRF1"))
+        self.cached_content.create.assert_called_once()
+        self.assertEqual(self.cached_content.create.call_args.kwargs['display_name'], 'prueba-contexto/v1')
+        self.assertEqual(self.cached_content.create.call_args.kwargs['system_instruction'], self.LARGA.instrucciones)
+
+    def test_caducado_se_vuelve_a_crear(self):
+        self.backend.modelo_con_contexto(self.LARGA)
+        with mock.patch('core.proveedores.time.time', return_value=time.time() + 3600):
+            self.assertEqual(self.backend.modelo_con_contexto(self.LARGA), ('modelo', 'cachedContents/2'))
+        self.assertEqual(self.cached_content.create.call_count, 2)
+
+    @override_settings(IA_CACHE={'BACKEND': 'django'})
+    def test_otro_proceso_reutiliza_el_nombre(self):
+        reiniciar_cache()
+        self.addCleanup(caches['default'].clear)
+        self.cached_content.get.side_effect = lambda nombre: SimpleNamespace(name=nombre, expire_time=None)
+        self.backend.modelo_con_contexto(self.LARGA)
+        otro = BackendGemini(api_key='clave-de-prueba')
+        self.assertEqual(otro.modelo_con_contexto(self.LARGA), ('modelo', 'cachedContents/1'))
+        self.cached_content.get.assert_called_once_with('cachedContents/1')
+        self.cached_content.create.assert_called_once()
+
+        # Si el proveedor ya lo borró, se crea otro
+        self.cached_content.get.side_effect = RuntimeError('404 CachedContent not found')
+        self.assertEqual(BackendGemini(api_key='clave-de-prueba').modelo_con_contexto(self.LARGA),
+                         ('modelo', 'cachedContents/2'))
+
+    def test_si_falla_se_envia_el_prompt_completo(self):
+        self.cached_content.create.side_effect = RuntimeError('400 Cached content is too small')
+        with self.assertLogs('core.proveedores', 'WARNING'):
+            self.assertIsNone(self.backend.modelo_con_contexto(self.LARGA))
+        self.assertIsNone(self.backend.modelo_con_contexto(self.LARGA))
+        self.cached_content.create.assert_called_once()  # no se reintenta hasta REINTENTO_CONTEXTO
+
+
+class ClientesGeminiTests(TestCase):
+    """BackendGemini asigna sus clientes a GenerativeModel._client/_async_client y los rehace tras un fork."""
+
+    def setUp(self):
+        self.backend = BackendGemini(api_key='clave-de-prueba', conexiones=2)
+
+    @staticmethod
+    def _respuesta(texto):
+        from google.generativeai import protos
+        return protos.GenerateContentResponse(candidates=[
+            protos.Candidate(content=protos.Content(parts=[protos.Part(text=texto)], role='model'), finish_reason=1),
+        ])
+
+    def test_el_sdk_llama_con_el_cliente_asignado(self):
+        # Si una versión del SDK deja de usar _client, haría la llamada con un cliente propio
+        cliente = mock.Mock()
+        cliente.generate_content.return_value = self._respuesta('Hola')
+        with mock.patch.object(self.backend, '_nuevo_cliente', return_value=cliente):
+            self.assertEqual(self.backend.generar('Saluda', {}, {}).text, 'Hola')
+        cliente.generate_content.assert_called_once()
+
+    def test_el_sdk_llama_con_el_cliente_asincrono_asignado(self):
+        cliente = mock.Mock()
+        cliente.generate_content = mock.AsyncMock(return_value=self._respuesta('Hola'))
+        with mock.patch.object(self.backend, '_nuevo_cliente', return_value=cliente) as nuevo:
+            respuesta = asyncio.run(self.backend.generar_async('Saluda', {}, {}))
+        self.assertEqual(respuesta.text, 'Hola')
+        nuevo.assert_called_with(asincrono=True)
+        cliente.generate_content.assert_awaited_once()
+
+    def test_pool_por_bucle_de_eventos(self):
+        async def clientes():
+            self.backend.obtener_modelo_async()
+            self.backend.obtener_modelo_async({'temperature': 0})
+            por_config = self.backend._modelos_async[asyncio.get_running_loop()]
+            return [[modelo._async_client for modelo in modelos] for modelos in por_config.values()]
+
+        with mock.patch.object(self.backend, '_nuevo_cliente', side_effect=lambda asincrono: mock.Mock()) as nuevo:
+            primero = asyncio.run(clientes())
+            self.assertEqual(nuevo.call_count, 2)  # uno por conexión: la otra configuración los comparte
+            self.assertEqual(primero[0], primero[1])
+            segundo = asyncio.run(clientes())
+        self.assertEqual(nuevo.call_count, 4)
+        self.assertNotEqual(segundo[0], primero[0])
+        self.assertEqual(len(self.backend._modelos_async), 1)  # el bucle del primer asyncio.run ya cerró
+
+    @skipUnless(hasattr(os, 'fork'), "Solo en sistemas con fork")
+    def test_el_hijo_de_un_fork_no_hereda_los_clientes(self):
+        self.backend.obtener_modelo()
+        clientes = list(self.backend._clientes)
+        self.assertEqual(len(clientes), 2)
+        lectura, escritura = os.pipe()
+        with mock.patch('core.proveedores._backend', self.backend):
+            pid = os.fork()
+            if pid == 0:  # pragma: no cover (corre en el hijo)
+                try:
+                    heredado = bool(self.backend._clientes or self.backend._modelos)
+                    nuevo = self.backend.obtener_modelo()
+                    os.write(escritura, b'no' if heredado or nuevo._client in clientes else b'ok')
+                finally:
+                    os._exit(0)
+            os.close(escritura)
+            os.waitpid(pid, 0)
+        with os.fdopen(lectura, 'rb') as resultado:
+            self.assertEqual(resultado.read(), b'ok')
+        self.assertEqual(self.backend._clientes, clientes)  # el padre conserva los suyos
+
+
+class PerfiladoTests(TestCase):
+    """Con PERFILADO["ACTIVO"] cada respuesta lleva Server-Timing; apagado, el middleware no se carga."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('ana', password='clave-segura-123')
+        cls.proyecto = Project.objects.create(
+            nombre='Sistema gestion ventas', propietario=cls.usuario,
+            descripcion='Sistema web para gestionar las ventas de una tienda local.',
+        )
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+        self.directorio = self.enterContext(tempfile.TemporaryDirectory())
+        self.url = reverse('detalle_proyecto', args=[self.proyecto.id])
+
+    def _perfilado(self, **ajustes):
+        return override_settings(PERFILADO={'ACTIVO': True, 'MUESTREO': 0, 'UMBRAL_LENTO': 60,
+                                            'MUESTREO_CPROFILE': 0, 'DIRECTORIO': self.directorio, **ajustes})
+
+    @staticmethod
+    def _metricas(respuesta):
+        return {metrica.split(';')[0]: metrica for metrica in respuesta['Server-Timing'].split(', ')}
+
+    def test_server_timing(self):
+        with self._perfilado(), CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(self.url)
+        metricas = self._metricas(respuesta)
+        self.assertEqual(list(metricas), ['db', 'tpl', 'ia', 'total'])
+        self.assertIn(f'desc="{len(consultas)} consultas"', metricas['db'])
+        self.assertIn('desc="0 llamadas"', metricas['ia'])
+        self.assertGreater(float(metricas['tpl'].removeprefix('tpl;dur=')), 0)
+
+    def test_cuenta_las_llamadas_a_la_ia(self):
+        sin_cache_ni_limites(self)
+        self.enterContext(override_settings(IA_BACKEND={'NOMBRE': 'local', 'LATENCIA': 0}))
+        reiniciar_backend()
+        self.addCleanup(reiniciar_backend)
+        with self._perfilado():
+            respuesta = self.client.get(reverse('generar_subartefacto_modal', args=[self.proyecto.id]),
+                                        {'subartefacto': 'caja negra'})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertIn('desc="1 llamadas"', self._metricas(respuesta)['ia'])
+
+    def test_peticion_lenta_al_log_con_cprofile(self):
+        with self._perfilado(UMBRAL_LENTO=0, MUESTREO_CPROFILE=1), \
+                self.assertLogs('documentacion.perfilado', 'WARNING') as logs:
+            self.client.get(self.url)
+        self.assertIn('vista=detalle_proyecto', logs.output[0])
+        volcados = list(Path(self.directorio).glob('*-detalle_proyecto-*ms.prof'))
+        self.assertEqual(len(volcados), 1)
+        self.assertIn(str(volcados[0]), logs.output[0])
+
+    def test_sin_cabecera(self):
+        with self._perfilado(CABECERA=False):
+            respuesta = self.client.get(self.url)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertNotIn('Server-Timing', respuesta)
+
+    def test_apagado_no_se_carga(self):
+        respuesta = self.client.get(self.url)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertNotIn('Server-Timing', respuesta)
+        with self.assertRaises(MiddlewareNotUsed):
+            PerfiladoMiddleware(lambda request: None)
+
+
+@override_settings(IA_RESILIENCIA={"REINTENTOS": 2, "ESPERA_BASE": 1.0, "ESPERA_MAXIMA": 3.0,
+                                   "UMBRAL_FALLOS": 3, "ENFRIAMIENTO": 30})
+class ResilienciaIATests(TestCase):
+    """Reintentos con espera exponencial y jitter para los errores transitorios, y cortacircuitos."""
+
+    def setUp(self):
+        cortacircuitos.reiniciar()
+        self.addCleanup(cortacircuitos.reiniciar)
+        self.ahora = 1000.0
+        for nombre, parche in {
+            'sleep': mock.patch('core.ia.time.sleep'),
+            'monotonic': mock.patch('core.ia.time.monotonic', side_effect=lambda: self.ahora),
+            'uniform': mock.patch('core.ia.random.uniform', side_effect=lambda a, b: b / 2),
+            'backend': mock.patch('core.ia.obtener_backend', return_value=mock.Mock(
+                errores_transitorios=(ConnectionError,), errores_tiempo=())),
+        }.items():
+            setattr(self, nombre, parche.start())
+            self.addCleanup(parche.stop)
+
+    def test_reintenta_los_transitorios_con_jitter(self):
+        llamada = mock.Mock(side_effect=[ConnectionError('reset'), TimeoutError(), 'respuesta'])
+        self.assertEqual(_con_reintentos(llamada), 'respuesta')
+        self.assertEqual(llamada.call_count, 3)
+        # Jitter completo: uniforme entre 0 y ESPERA_BASE * 2^intento
+        self.assertEqual(self.uniform.call_args_list, [mock.call(0, 1.0), mock.call(0, 2.0)])
+        self.assertEqual(self.sleep.call_args_list, [mock.call(0.5), mock.call(1.0)])
+        self.assertEqual((cortacircuitos.estado, cortacircuitos.fallos), (Cortacircuitos.CERRADO, 0))
+
+    def test_la_espera_no_pasa_del_maximo(self):
+        _espera(10, {"ESPERA_BASE": 1.0, "ESPERA_MAXIMA": 3.0})
+        self.uniform.assert_called_once_with(0, 3.0)
+
+    def test_no_reintenta_los_errores_permanentes(self):
+        llamada = mock.Mock(side_effect=ValueError('petición inválida'))
+        with self.assertRaises(ErrorIA) as error:
+            _con_reintentos(llamada)
+        self.assertNotIsInstance(error.exception, ErrorIATransitorio)
+        llamada.assert_called_once()
+        self.sleep.assert_not_called()
+        self.assertEqual(cortacircuitos.fallos, 0)  # el servicio respondió
+
+    def test_agotar_los_reintentos_abre_el_circuito(self):
+        llamada = mock.Mock(side_effect=TimeoutError())
+        with self.assertRaises(TiempoAgotadoIA):
+            _con_reintentos(llamada)
+        self.assertEqual(llamada.call_count, 3)
+        self.assertEqual(cortacircuitos.estado, Cortacircuitos.ABIERTO)
+
+        llamada.reset_mock()
+        with self.assertRaises(CircuitoAbierto):
+            _con_reintentos(llamada)
+        llamada.assert_not_called()
+
+    @override_settings(IA_RESILIENCIA={"REINTENTOS": 5, "UMBRAL_FALLOS": 2, "ENFRIAMIENTO": 30})
+    def test_el_circuito_corta_los_reintentos(self):
+        llamada = mock.Mock(side_effect=ConnectionError('reset'))
+        with self.assertRaises(CircuitoAbierto):
+            _con_reintentos(llamada)
+        self.assertEqual(llamada.call_count, 2)
+
+    def test_semiabierto_deja_pasar_una_prueba(self):
+        for _ in range(3):
+            cortacircuitos.registrar_fallo()
+        self.ahora += 29
+        with self.assertRaises(CircuitoAbierto):
+            cortacircuitos.permitir()
+
+        # Pasado el enfriamiento pasa una sola prueba; si falla, se abre de nuevo sin esperar al umbral
+        self.ahora += 1
+        llamada = mock.Mock(side_effect=ConnectionError('reset'))
+        with self.assertRaises(CircuitoAbierto):
+            _con_reintentos(llamada)
+        llamada.assert_called_once()
+        self.assertEqual(cortacircuitos.estado, Cortacircuitos.ABIERTO)
+
+        self.ahora += 30
+        self.assertEqual(_con_reintentos(mock.Mock(return_value='respuesta')), 'respuesta')
+        self.assertEqual((cortacircuitos.estado, cortacircuitos.fallos), (Cortacircuitos.CERRADO, 0))
+
+
+@override_settings(METRICAS_TOKEN='')
+class RegistroLlamadasTests(TestCase):
+    """Cada llamada a la IA (o acierto de caché) queda en LLMCallLog y en /metrics."""
+
+    TEXTO = 'Sistema web para gestionar las ventas de una tienda local.'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('ana', password='clave-segura-123')
+        cls.admin = User.objects.create_user('admin', password='clave-segura-123', is_staff=True)
+
+    def setUp(self):
+        sin_cache_ni_limites(self)
+        self.enterContext(override_settings(IA_CACHE={'BACKEND': 'django'}))
+        reiniciar_cache()
+        self.addCleanup(caches['default'].clear)
+        # Sin el hilo de fondo: lo encolado se guarda al vaciar, en este hilo
+        self.enterContext(mock.patch.object(registro, '_arrancar'))
+        registrar_observador(registro.anotar)
+        self.addCleanup(quitar_observador, registro.anotar)
+        self.addCleanup(registro.vaciar)
+        self.backend = self.enterContext(mock.patch('core.ia.obtener_backend')).return_value
+        self.backend.errores_tiempo = self.backend.errores_transitorios = ()
+        self.backend.generar.return_value = RespuestaLocal("classDiagram\n  class Venta", UsoLocal(120, 40))
+
+    def test_llamadas_en_la_tabla_y_en_metrics(self):
+        with en_nombre_de(self.usuario.pk):
+            generar_subartefacto_con_prompt('Diagrama de clases', texto=self.TEXTO)
+            generar_subartefacto_con_prompt('Diagrama de clases', texto=self.TEXTO)  # de la caché
+            self.backend.generar.side_effect = ValueError('petición inválida')
+            with self.assertRaises(ErrorIA):
+                generar_subartefacto_con_prompt('Diagrama de estado', texto=self.TEXTO)
+        self.assertFalse(LLMCallLog.objects.exists())  # aún en la cola
+
+        self.client.force_login(self.admin)
+        metricas = self.client.get(reverse('metricas')).content.decode()
+        self.assertEqual(
+            list(LLMCallLog.objects.order_by('id').values_list('tipo', 'usuario_id', 'cache', 'tokens_entrada',
+                                                               'tokens_salida', 'error')),
+            [('diagrama-clases', self.usuario.pk, False, 120, 40, ''),
+             ('diagrama-clases', self.usuario.pk, True, 0, 0, ''),
+             ('diagrama-estado', self.usuario.pk, False, 0, 0, 'ErrorIA')],
+        )
+        for linea in (
+            'docai_llm_llamadas_total{tipo="diagrama-clases",resultado="ok"} 1',
+            'docai_llm_llamadas_total{tipo="diagrama-clases",resultado="cacheadas"} 1',
+            'docai_llm_llamadas_total{tipo="diagrama-estado",resultado="fallidas"} 1',
+            'docai_llm_tokens_total{tipo="diagrama-clases",direccion="entrada"} 120',
+            'docai_llm_tokens_total{tipo="diagrama-clases",direccion="salida"} 40',
+            # El acierto de caché no cuenta en la latencia; la llamada fallida sí
+            'docai_llm_latencia_segundos_bucket{tipo="diagrama-clases",le="0.25"} 1',
+            'docai_llm_latencia_segundos_bucket{tipo="diagrama-clases",le="+Inf"} 1',
+            'docai_llm_latencia_segundos_count{tipo="diagrama-clases"} 1',
+            'docai_llm_latencia_segundos_bucket{tipo="diagrama-estado",le="80"} 1',
+            'docai_llm_latencia_segundos_count{tipo="diagrama-estado"} 1',
+        ):
+            self.assertIn(linea, metricas.splitlines())
+
+
+class BackendLocalTests(TestCase):
+    """El backend local reproduce las respuestas grabadas sin red y simula las que faltan."""
+
+    MODELO = 'models/gemini-2.0-flash'
+    TEXTO = 'Sistema web para gestionar las ventas de una tienda local.'
+
+    def setUp(self):
+        sin_cache_ni_limites(self)
+        directorio = self.enterContext(tempfile.TemporaryDirectory())
+        self.ruta = f'{directorio}/grabaciones.sqlite3'
+        self.backend = BackendLocal(self.MODELO, grabaciones=Grabaciones(self.ruta), latencia=0)
+        self.prompt = PROMPTS['Diagrama de clases'](texto=self.TEXTO)
+        self.grabado = "classDiagram\n  class Venta\n  class Factura\n  Venta --> Factura"
+        self.backend.grabaciones.guardar(clave_cache(self.MODELO, self.prompt, {}), self.grabado, 850, 30)
+
+    def test_reproduce_la_respuesta_grabada(self):
+        respuesta = self.backend.generar(self.prompt, {}, {})
+        self.assertEqual(respuesta.text, self.grabado)
+        self.assertEqual((respuesta.usage_metadata.prompt_token_count,
+                          respuesta.usage_metadata.candidates_token_count), (850, 30))
+
+        stream = self.backend.stream(self.prompt, {}, {})
+        self.assertEqual("".join(fragmento.text for fragmento in stream), self.grabado)
+        self.assertEqual(stream.usage_metadata.total_token_count, 880)
+
+    def test_sin_grabacion_simula_una_respuesta_determinista(self):
+        prompt = PROMPTS['Diagrama de estado'](texto=self.TEXTO)
+        texto = self.backend.generar(prompt, {}, {}).text
+        self.assertTrue(texto.startswith('stateDiagram-v2'))
+        self.assertEqual(self.backend.generar(prompt, {}, {}).text, texto)
+        lote = json.loads(self.backend.generar(prompt, {"response_schema": {"properties": {"a1": {}, "a2": {}}}}, {}).text)
+        self.assertEqual(list(lote), ['a1', 'a2'])
+
+    def test_errores_simulados(self):
+        backend = BackendLocal(self.MODELO, latencia=0, errores=1.0)
+        with self.assertRaises(ErrorSimulado):
+            backend.generar(self.prompt, {}, {})
+
+    def test_elegido_desde_settings(self):
+        self.enterContext(override_settings(IA_BACKEND={
+            'NOMBRE': 'local', 'MODELO': self.MODELO, 'GRABACIONES': self.ruta, 'LATENCIA': 0,
+        }))
+        reiniciar_backend()
+        self.addCleanup(reiniciar_backend)
+        self.assertEqual(generar_subartefacto_con_prompt('Diagrama de clases', texto=self.TEXTO), self.grabado)
+
+
+class CacheIATests(TestCase):
+    """La caché de la IA sobre una caché de Django solo borra sus propias claves."""
+
+    def setUp(self):
+        self.addCleanup(caches['default'].clear)
+
+    def test_limpiar_no_toca_el_resto_de_la_cache(self):
+        caches['default'].set('sesion:123', 'datos de otra parte de la aplicación')
+        backend = CacheDjango()
+        backend.guardar('clave', 'respuesta')
+        self.assertEqual(backend.obtener('clave'), 'respuesta')
+
+        backend.limpiar()
+        self.assertIsNone(backend.obtener('clave'))
+        self.assertIsNone(CacheDjango().obtener('clave'))  # otro proceso ve la misma versión
+        self.assertEqual(caches['default'].get('sesion:123'), 'datos de otra parte de la aplicación')
+
+        backend.guardar('clave', 'respuesta nueva')
+        self.assertEqual(backend.obtener('clave'), 'respuesta nueva')
+
+    def test_version_expulsada_no_resucita_claves_viejas(self):
+        backend = CacheDjango()
+        backend.guardar('clave', 'respuesta')
+        caches['default'].delete(backend._prefijo.clave_version)
+        with mock.patch('core.cache.time.time', return_value=time.time() + 1):
+            self.assertIsNone(backend.obtener('clave'))
+
+
+class LimitesIATests(TestCase):
+    """Token bucket compartido: se consume, se rellena con el tiempo y decide permitir, encolar o rechazar."""
+
+    LIMITES = {"GLOBAL": {"RPM": 2, "TPM": 1000}, "USUARIO": {"RPM": 1}, "ESPERA_MAXIMA": 40}
+
+    def setUp(self):
+        self.addCleanup(caches['default'].clear)
+        self.ahora = time.time()
+        reloj = mock.patch('core.limites.time.time', side_effect=lambda: self.ahora)
+        reloj.start()
+        self.addCleanup(reloj.stop)
+        directorio = self.enterContext(tempfile.TemporaryDirectory())
+        self.backends = {
+            'sqlite': LimitesSQLite(f'{directorio}/limites.sqlite3'),
+            'django': LimitesDjango(),
+        }
+
+    def test_cubetas_se_consumen_y_se_rellenan(self):
+        for nombre, backend in self.backends.items():
+            with self.subTest(backend=nombre):
+                limitador = Limitador(backend, self.LIMITES)
+                self.assertEqual(limitador.intentar(100, usuario=1).accion, Decision.PERMITIR)
+                # La cubeta del usuario (1 RPM) está vacía: falta un minuto, más que ESPERA_MAXIMA
+                self.assertEqual(limitador.intentar(100, usuario=1).accion, Decision.RECHAZAR)
+                self.assertEqual(limitador.intentar(100, usuario=2).accion, Decision.PERMITIR)
+                # Global vacía (2 RPM): se rellena una petición cada 30 s
+                decision = limitador.consultar(100, usuario=3)
+                self.assertEqual(decision.accion, Decision.ENCOLAR)
+                self.assertAlmostEqual(decision.espera, 30)
+                self.assertEqual(decision.motivo, 'global:rpm')
+
+                self.ahora += 30
+                self.assertEqual(limitador.intentar(100, usuario=3).accion, Decision.PERMITIR)
+                self.assertEqual(limitador.consultar(5000).accion, Decision.RECHAZAR)  # más que la capacidad TPM
+                self.assertEqual(limitador.consultar(5000).espera, float('inf'))
+                backend.limpiar()
+                self.ahora -= 30
+
+    def test_ajustar_descuenta_los_tokens_reales(self):
+        limitador = Limitador(self.backends['sqlite'], {"GLOBAL": {"TPM": 1000}})
+        self.assertTrue(limitador.intentar(100).permitida)
+        limitador.ajustar(850)  # la llamada usó 950 tokens, no 100
+        self.assertEqual(limitador.consultar(100).accion, Decision.ENCOLAR)
+        limitador.ajustar(-900)  # y devolver también suma
+        self.assertTrue(limitador.consultar(100).permitida)
+
+    def test_limpiar_django_no_toca_el_resto_de_la_cache(self):
+        caches['default'].set('sesion:123', 'datos')
+        limitador = Limitador(self.backends['django'], self.LIMITES)
+        limitador.intentar(100, usuario=1)
+        self.backends['django'].limpiar()
+        self.assertTrue(limitador.intentar(100, usuario=1).permitida)
+        self.assertEqual(caches['default'].get('sesion:123'), 'datos')
+
+    def test_no_suelta_el_cerrojo_de_otro_proceso(self):
+        cerrojo = LimitesDjango.PREFIJO + 'cerrojo'
+        caches['default'].set(cerrojo, 'de-otro-proceso', timeout=60)
+        with mock.patch.object(LimitesDjango, 'CADUCIDAD_CERROJO', 0.05):
+            self.assertEqual(self.backends['django'].tomar(cubetas_para(self.LIMITES, 1)), (0.0, ''))
+        self.assertEqual(caches['default'].get(cerrojo), 'de-otro-proceso')
+
+        caches['default'].delete(cerrojo)
+        self.backends['django'].tomar(cubetas_para(self.LIMITES, 1))
+        self.assertIsNone(caches['default'].get(cerrojo))  # el propio sí se suelta
+
+
+class MetricasTests(TestCase):
+    """Consolidar y podar LLMCallLog no cambia los contadores de /metrics."""
+
+    def setUp(self):
+        ahora = timezone.now()
+        LLMCallLog.objects.bulk_create([
+            LLMCallLog(creado=ahora - timedelta(days=dias), tipo=tipo, modelo='gemini', cache=cache,
+                       tokens_entrada=100, tokens_salida=50, latencia_ms=latencia, error=error)
+            for dias, tipo, cache, latencia, error in [
+                (60, 'diagrama-clases', False, 800, ''),
+                (60, 'diagrama-clases', True, 0, ''),
+                (10, 'diagrama-clases', False, 3000, 'Timeout'),
+                (10, 'lote', False, 12000, ''),
+                (0, 'lote', False, 400, ''),
+            ]
+        ])
+
+    def test_consolidar_no_cambia_las_metricas(self):
+        antes = metricas_prometheus()
+        self.assertIn('docai_llm_llamadas_total{tipo="diagrama-clases",resultado="fallidas"} 1', antes)
+        self.assertIn('docai_llm_latencia_segundos_bucket{tipo="lote",le="0.5"} 1', antes)
+
+        self.assertEqual(consolidar_llamadas(timedelta(days=30)), (4, 2))
+        self.assertEqual(LLMCallLog.objects.count(), 3)
+        self.assertEqual(metricas_prometheus(), antes)
+        self.assertEqual(consolidar_llamadas(timedelta(days=30)), (0, 0))  # nada se suma dos veces
+        self.assertEqual(metricas_prometheus(), antes)
+
+    def test_llamadas_nuevas_tras_consolidar(self):
+        consolidar_llamadas()
+        LLMCallLog.objects.create(tipo='lote', modelo='gemini', latencia_ms=400)
+        self.assertIn('docai_llm_llamadas_total{tipo="lote",resultado="ok"} 3', metricas_prometheus())
+
+    def test_scrape_no_agrega_las_consolidadas(self):
+        consolidar_llamadas()
+        with CaptureQueriesContext(connection) as consultas:
+            metricas_prometheus()
+        agregado = next(c['sql'] for c in consultas.captured_queries if 'GROUP BY' in c['sql'])
+        self.assertIn('"creado" >', agregado)
+
+
+class TextoComprimidoTests(TestCase):
+    """Artefacto.contenido se guarda comprimido con zstd y se lee igual que un TextField."""
+
+    DIAGRAMA = "classDiagram\n" + "".join(f"  class Factura{i} {{\n    +número: int\n  }}\n" for i in range(60))
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('ana', password='clave-segura-123')
+        cls.proyecto = Project.objects.create(nombre='Sistema gestion ventas', propietario=cls.usuario)
+        cls.fase = Fase.objects.get(nombre='Diseño')
+
+    def _crear(self, contenido, titulo='Diagrama de clases'):
+        return Artefacto.objects.create(proyecto=self.proyecto, fase=self.fase, tipo='DISE', titulo=titulo,
+                                        contenido=contenido)
+
+    def _columna(self, artefacto):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT contenido FROM documentacion_artefacto WHERE id = %s", [artefacto.pk])
+            return cursor.fetchone()[0]
+
+    def test_ida_y_vuelta_comprimido(self):
+        artefacto = self._crear(self.DIAGRAMA)
+        guardado = bytes(self._columna(artefacto))
+        self.assertTrue(guardado.startswith(CABECERA_ZSTD))
+        self.assertLess(len(guardado), len(self.DIAGRAMA.encode('utf-8')) // 4)
+        self.assertEqual(Artefacto.objects.get(pk=artefacto.pk).contenido, self.DIAGRAMA)
+
+    def test_textos_cortos_sin_comprimir(self):
+        artefacto = self._crear('Como vendedor quiero registrar ventas con ñ.')
+        self.assertEqual(bytes(self._columna(artefacto)), 'Como vendedor quiero registrar ventas con ñ.'.encode('utf-8'))
+        self.assertEqual(Artefacto.objects.get(pk=artefacto.pk).contenido, 'Como vendedor quiero registrar ventas con ñ.')
+
+    def test_desactivar_la_compresion_no_obliga_a_reescribir(self):
+        comprimido = self._crear(self.DIAGRAMA)
+        with override_settings(ARTEFACTO_COMPRESION={'ACTIVO': False}):
+            plano = self._crear(self.DIAGRAMA, titulo='Diagrama de estado')
+            self.assertEqual(bytes(self._columna(plano)), self.DIAGRAMA.encode('utf-8'))
+            # Las filas ya comprimidas se siguen leyendo por su cabecera
+            self.assertEqual(Artefacto.objects.get(pk=comprimido.pk).contenido, self.DIAGRAMA)
+        self.assertEqual(Artefacto.objects.get(pk=plano.pk).contenido, self.DIAGRAMA)
+
+    @skipUnless(connection.vendor == 'sqlite', "Solo SQLite admite texto en una columna binaria")
+    def test_filas_escritas_como_texto(self):
+        artefacto = self._crear(self.DIAGRAMA)
+        with connection.cursor() as cursor:
+            cursor.execute("UPDATE documentacion_artefacto SET contenido = %s WHERE id = %s",
+                           ['Escrito a mano', artefacto.pk])
+        self.assertEqual(Artefacto.objects.get(pk=artefacto.pk).contenido, 'Escrito a mano')
+
+
+@skipUnless(connection.vendor == 'sqlite', "Ajustes propios de SQLite")
+class AjustesSqliteTests(TestCase):
+    """Cada conexión SQLite nueva sale con WAL y busy_timeout, y sus transacciones empiezan con BEGIN IMMEDIATE."""
+
+    ALIAS = 'ajustes_sqlite'
+
+    def setUp(self):
+        # La base de los tests está en memoria (sin WAL): una conexión nueva a un archivo, como en producción
+        self.ruta = f"{self.enterContext(tempfile.TemporaryDirectory())}/db.sqlite3"
+        self.nueva = SQLiteDatabaseWrapper({**connection.settings_dict, 'NAME': self.ruta}, alias=self.ALIAS)
+        self.addCleanup(self.nueva.close)
+
+    def _pragma(self, nombre):
+        with self.nueva.cursor() as cursor:
+            cursor.execute(f"PRAGMA {nombre}")
+            return cursor.fetchone()[0]
+
+    def test_pragmas_al_conectar(self):
+        self.assertEqual(self._pragma('journal_mode'), 'wal')
+        self.assertEqual(self._pragma('busy_timeout'), settings.SQLITE_AJUSTES['BUSY_TIMEOUT'])
+        self.assertEqual(self._pragma('synchronous'), 1)  # NORMAL
+
+    @override_settings(SQLITE_AJUSTES={'ACTIVO': False})
+    def test_apagado_por_settings(self):
+        self.assertEqual(self._pragma('journal_mode'), 'delete')
+
+    def test_transacciones_immediate(self):
+        connections[self.ALIAS] = self.nueva
+        self.addCleanup(connections.__delitem__, self.ALIAS)
+        with CaptureQueriesContext(self.nueva) as consultas, transaction.atomic(using=self.ALIAS):
+            self.assertEqual(consultas[0]['sql'], 'BEGIN IMMEDIATE')
+            # El bloqueo de escritura se toma al empezar, no en la primera escritura
+            otra = sqlite3.connect(self.ruta, timeout=0)
+            self.addCleanup(otra.close)
+            with self.assertRaisesMessage(sqlite3.OperationalError, 'database is locked'):
+                otra.execute('BEGIN IMMEDIATE')
+
+
+class MigracionTestCase(TransactionTestCase):
+    """Migra a ANTES para preparar los datos; al terminar, vuelve a la última migración."""
+
+    serialized_rollback = True  # el catálogo lo crean las migraciones
+    ANTES = []
+
+    def setUp(self):
+        self.executor = MigrationExecutor(connection)
+        self.addCleanup(self._migrar, None)
+
+    def _migrar(self, destino):
+        self.executor.loader.build_graph()  # el grafo cambia tras cada migrate
+        destino = destino or self.executor.loader.graph.leaf_nodes()
+        self.executor.migrate(destino)
+        return self.executor.loader.project_state(destino).apps
+
+
+class MigracionCatalogoTests(MigracionTestCase):
+    """0012 une las copias del catálogo de cada proyecto sin perder sus enlaces."""
+
+    ANTES = [('documentacion', '0011_orden_fases_subartefactos')]
+
+    def setUp(self):
+        super().setUp()
+        # Volver antes de 0012 exige que no haya catálogo global
+        SubArtefacto.objects.all().delete()
+        Fase.objects.all().delete()
+        apps = self._migrar(self.ANTES)
+        User = apps.get_model('auth', 'User')
+        Project = apps.get_model('documentacion', 'Project')
+        FaseAntigua = apps.get_model('documentacion', 'Fase')
+        SubArtefactoAntiguo = apps.get_model('documentacion', 'SubArtefacto')
+        usuario = User.objects.create(username='ana')
+        for nombre, enlace in (('Ventas', 'https://wiki.example.com/clases'), ('Inventario', 'https://otra.example.com'),
+                               ('Compras', '')):
+            fase = FaseAntigua.objects.create(proyecto=Project.objects.create(nombre=nombre, propietario=usuario),
+                                        nombre='Diseño')
+            SubArtefactoAntiguo.objects.create(fase=fase, nombre='Diagrama de clases', enlace=enlace)
+            SubArtefactoAntiguo.objects.create(fase=fase, nombre='Glosario', enlace=enlace)
+
+    def test_los_enlaces_pasan_al_catalogo(self):
+        apps = self._migrar([('documentacion', '0013_catalogo_global_esquema')])
+        SubArtefactoAntiguo = apps.get_model('documentacion', 'SubArtefacto')
+        enlaces = dict(SubArtefactoAntiguo.objects.values_list('nombre', 'enlace'))
+        # Con enlaces distintos queda el de la copia más antigua
+        self.assertEqual(enlaces['Diagrama de clases'], 'https://wiki.example.com/clases')
+        self.assertEqual(enlaces['Glosario'], 'https://wiki.example.com/clases')  # añadido a mano
+        self.assertEqual(enlaces['Diagrama de estado'], '')
+
+
+class MigracionCompresionTests(MigracionTestCase):
+    """0015/0016 copian cada contenido a la columna comprimida y deshacerlas lo devuelve intacto."""
+
+    ANTES = [('documentacion', '0014_indices_artefacto_proyecto')]
+    DESPUES = [('documentacion', '0016_artefacto_contenido_comprimido_final')]
+    CONTENIDOS = {
+        'Diagrama de clases': "classDiagram\n" + "  class Venta {\n    +total: float\n  }\n" * 100,
+        'Historia de Usuario': 'Como vendedor quiero registrar ventas.',
+        'smoke': '',
+    }
+
+    def setUp(self):
+        super().setUp()
+        apps = self._migrar(self.ANTES)
+        usuario = apps.get_model('auth', 'User').objects.create(username='ana')
+        proyecto = apps.get_model('documentacion', 'Project').objects.create(nombre='Sistema gestion ventas',
+                                                                             propietario=usuario)
+        fase = apps.get_model('documentacion', 'Fase').objects.get(nombre='Diseño')
+        Artefacto = apps.get_model('documentacion', 'Artefacto')
+        for titulo, contenido in self.CONTENIDOS.items():
+            Artefacto.objects.create(proyecto=proyecto, fase=fase, titulo=titulo, contenido=contenido)
+
+    def _contenidos(self, apps):
+        Artefacto = apps.get_model('documentacion', 'Artefacto')
+        return dict(Artefacto.objects.values_list('titulo', 'contenido'))
+
+    def test_copia_y_vuelta_atras(self):
+        apps = self._migrar(self.DESPUES)
+        self.assertEqual(self._contenidos(apps), self.CONTENIDOS)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT contenido FROM documentacion_artefacto WHERE titulo = %s", ['Diagrama de clases'])
+            self.assertTrue(bytes(cursor.fetchone()[0]).startswith(CABECERA_ZSTD))
+
+        self.assertEqual(self._contenidos(self._migrar(self.ANTES)), self.CONTENIDOS)
@@ -19,8 +19,14 @@ urlpatterns = [
     path('artefacto/editar/<int:artefacto_id>/', views.editar_artefacto, name='editar_artefacto'),# editar artefacto
     path('logout/', views.cerrar_sesion, name='logout'),  # Importante para cerrar sesión
     path('proyecto/<int:proyecto_id>/generar/<str:subartefacto_nombre>/', views.generar_artefacto, name='generar_artefacto'),#generar artefactos
+    path('proyecto/<int:proyecto_id>/generar-todo/', views.generar_todo, name='generar_todo'),#generar todos los artefactos
+    path('proyecto/<int:proyecto_id>/generar-modal/', views.generar_subartefacto_modal, name='generar_subartefacto_modal'),#vista previa sin guardar
+    path('proyecto/<int:proyecto_id>/generar-stream/', views.generar_subartefacto_stream, name='generar_subartefacto_stream'),#generar mostrando el texto en vivo
+    path('proyecto/<int:proyecto_id>/generaciones/', views.estado_generacion, name='estado_generacion'),#estado de las generaciones en curso
     path('artefacto/eliminar/<int:artefacto_id>/', views.eliminar_artefacto, name='eliminar_artefacto'),# eliminar artefacto
     path('artefacto/<int:artefacto_id>/descargar/', views.descargar_diagrama, name='descargar_diagrama'), #descaegar diagramas 
+    path('diagramas/<slug:clave>.<slug:formato>', views.diagrama_renderizado, name='diagrama_renderizado'), #diagramas renderizados en el servidor
+    path('metrics', views.metricas, name='metricas'), #métricas de la IA para Prometheus
 
     path('password_reset/', views.password_reset_request, name='password_reset_request'),
     path('password_reset/verify/', views.password_reset_verify, name='password_reset_verify'),
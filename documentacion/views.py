@@ -1,49 +1,39 @@
-from django.shortcuts import render, redirect, get_object_or_404 # pyright: ignore[reportMissingModuleSource]
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404 # pyright: ignore[reportMissingModuleSource]
 from django.contrib.auth.decorators import login_required # pyright: ignore[reportMissingModuleSource]
 from django.contrib.auth import authenticate, login, logout # pyright: ignore[reportMissingModuleSource]
 from django.views.decorators.http import require_POST # pyright: ignore[reportMissingModuleSource]
-from django.http import JsonResponse, HttpResponse # pyright: ignore[reportMissingModuleSource]
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse, FileResponse, Http404 # pyright: ignore[reportMissingModuleSource]
 from django.contrib.auth.forms import AuthenticationForm # pyright: ignore[reportMissingModuleSource]
 from django.contrib import messages # pyright: ignore[reportMissingModuleSource]
 from django.contrib.auth.models import User # pyright: ignore[reportMissingModuleSource]
 from django.views.decorators.csrf import csrf_exempt # pyright: ignore[reportMissingModuleSource]
 from django.core.exceptions import ValidationError # pyright: ignore[reportMissingModuleSource]
-from .models import Project, Artefacto, Fase, SubArtefacto, SecurityQuestions
+from django.core.handlers.asgi import ASGIRequest # pyright: ignore[reportMissingModuleSource]
+from asgiref.sync import sync_to_async
+from core.ia import ErrorIA, en_nombre_de
+from core.limites import Decision
+from .models import Project, Artefacto, SecurityQuestions, GenerationJob
+from .catalogo import obtener_catalogo
 from .forms import (ProjectForm, ArtefactoForm, CustomUserCreationForm, SecurityQuestionsForm,
                    PasswordResetRequestForm, SecurityAnswersForm, NewPasswordForm)
-from core.ia import generar_subartefacto_con_prompt, extraer_requisitos, _generar_contenido, PROMPTS
+from .generacion import (ARTEFACTOS_TEXTO, ARTEFACTOS_MERMAID, ARTEFACTOS_VALIDOS, limpiar_mermaid,
+                         PROYECTO_COMPLETO, encolar_generacion, faltan_requisitos, generar_y_guardar_stream,
+                         generar_contenido_async, generar_y_guardar_stream_async, programar_render,
+                         consultar_cuota_generacion, reservar_generacion, esperar_job, esperar_job_async,
+                         terminar_job)
+from .render import FORMATOS_IMAGEN, clave_diagrama, formatos_configurados, renderizador_disponible, ruta_diagrama
+from .observabilidad import metricas_prometheus
+from django.conf import settings # pyright: ignore[reportMissingModuleSource]
+from django.db.models import Exists, OuterRef # pyright: ignore[reportMissingModuleSource]
+from django.urls import reverse # pyright: ignore[reportMissingModuleSource]
+from django.utils import timezone # pyright: ignore[reportMissingModuleSource]
 import datetime
+import hmac
+import json
+import logging
+import math
 
-# ===== TIPOS DE ARTEFACTOS DEFINIDOS DIRECTAMENTE =====
-
-ARTEFACTOS_TEXTO = [
-    "Historia de Usuario",
-    "caja negra",
-    "smoke"
-]
-
-ARTEFACTOS_MERMAID = [
-    "Diagrama de flujo",
-    "Diagrama de clases",
-    "Diagrama de Entidad-Relacion",
-    "Diagrama de secuencia",
-    "Diagrama de estado",
-    "Diagrama de C4-contexto",
-    "Diagrama de C4-contenedor",
-    "Diagrama de C4-implementación"
-]
-
-ARTEFACTOS_VALIDOS = set(ARTEFACTOS_TEXTO + ARTEFACTOS_MERMAID)
-
-# ===== UTILIDAD PARA LIMPIAR BLOQUES MERMAID =====
-
-def limpiar_mermaid(texto):
-    texto = texto.strip()
-    if texto.startswith("```mermaid"):
-        texto = texto.replace("```mermaid", "", 1).strip()
-    if texto.endswith("```"):
-        texto = texto[:texto.rfind("```")].strip()
-    return texto
+logger = logging.getLogger(__name__)
 
 # ========================= DASHBOARD =========================
 
@@ -61,22 +51,7 @@ def crear_proyecto(request):
         if form.is_valid():
             proyecto = form.save(commit=False)
             proyecto.propietario = request.user
-            proyecto.save()
-
-            fases_con_subartefactos = {
-                "Análisis Requisitos": ["Historia de Usuario", "Diagrama de flujo"],
-                "Diseño": ["Diagrama de clases", "Diagrama de Entidad-Relacion"],
-                "Desarrollo": ["Diagrama de secuencia", "Diagrama de estado"],
-                "Pruebas": ["caja negra", "smoke"],
-                "Despliegue": ["Diagrama de C4-contexto", "Diagrama de C4-contenedor","Diagrama de C4-implementación" ] #se creo 3 botones C4
-            }
-
-            for nombre_fase, subartefactos in fases_con_subartefactos.items():
-                fase = Fase.objects.create(proyecto=proyecto, nombre=nombre_fase)
-                SubArtefacto.objects.bulk_create([
-                    SubArtefacto(fase=fase, nombre=nombre_sub) for nombre_sub in subartefactos
-                ])
-
+            proyecto.save()  # Las fases y subartefactos son del catálogo global (ver catalogo.py)
             return redirect('dashboard')
     else:
         form = ProjectForm()
@@ -89,6 +64,9 @@ def editar_proyecto(request, pk):
         form = ProjectForm(request.POST, instance=proyecto)
         if form.is_valid():
             form.save()
+            if form.has_changed() and proyecto.artefactos.exists(): # pyright: ignore[reportAttributeAccessIssue]
+                messages.info(request, "✏️ Proyecto actualizado. «Generar todo» actualizará solo los artefactos afectados por el cambio.")
+                return redirect('detalle_proyecto', proyecto_id=proyecto.id) # pyright: ignore[reportAttributeAccessIssue]
             return redirect('dashboard')
     else:
         form = ProjectForm(instance=proyecto)
@@ -106,15 +84,12 @@ def eliminar_proyecto(request, proyecto_id):
 
 def signup(request):
     if request.method == 'POST':
-        print("Datos POST recibidos:", request.POST)  # Debug
         user_form = CustomUserCreationForm(request.POST)
         security_form = SecurityQuestionsForm(request.POST)
-        print("¿El formulario es válido?:", user_form.is_valid() and security_form.is_valid())  # Debug
         if user_form.is_valid() and security_form.is_valid():
             try:
-                print("Creando usuario con datos:", user_form.cleaned_data)  # Debug
                 user = user_form.save()
-                print("Usuario creado:", user)  # Debug
+                logger.info("Usuario creado: %s", user.username)
                 
                 # Guardar preguntas de seguridad
                 security_questions = security_form.save(commit=False)
@@ -135,11 +110,10 @@ def signup(request):
                     messages.error(request, "No se pudo iniciar sesión automáticamente. Intenta iniciar sesión manualmente.")
                     return redirect('login')
             except Exception as e:
-                print("Error al crear usuario:", str(e))  # Debug
+                logger.exception("Error al crear usuario")
                 messages.error(request, f"Error al crear el usuario: {str(e)}")
         else:
-            print("Errores del formulario user:", user_form.errors)  # Debug
-            print("Errores del formulario security:", security_form.errors)  # Debug
+            logger.debug("Registro inválido: %s %s", user_form.errors.as_json(), security_form.errors.as_json())
             for form in [user_form, security_form]:
                 for field in form.errors:
                     for error in form.errors[field]:
@@ -161,45 +135,25 @@ def cerrar_sesion(request):
 
 @login_required
 def detalle_proyecto(request, proyecto_id):
-    proyecto = get_object_or_404(Project, id=proyecto_id, propietario=request.user)
-    orden_deseado = [
-        "Análisis Requisitos",
-        "Diseño",
-        "Desarrollo",
-        "Pruebas",
-        "Despliegue"
-    ]
-    
-    # Obtener las fases usando el manager de Fase directamente
-    fases_queryset = Fase.objects.filter(proyecto=proyecto).select_related('proyecto').prefetch_related('subartefactos')
-    fases = sorted(fases_queryset, key=lambda f: orden_deseado.index(f.nombre) if f.nombre in orden_deseado else 999)
-
-    orden_subartefactos = {
-        "Análisis Requisitos": ["Historia de Usuario", "Diagrama de flujo"],
-        "Diseño": ["Diagrama de clases", "Diagrama de Entidad-Relacion"],
-        "Desarrollo": ["Diagrama de secuencia", "Diagrama de estado"],
-        "Pruebas": ["caja negra", "smoke"],
-        "Despliegue": ["Diagrama de C4-contexto", "Diagrama de C4-contenedor", "Diagrama de C4-implementación"]
-    }
-
-    for fase in fases:
-        orden = orden_subartefactos.get(fase.nombre, [])
-        fase.subartefactos_ordenados = sorted( # pyright: ignore[reportAttributeAccessIssue]
-            fase.subartefactos.all(), # pyright: ignore[reportAttributeAccessIssue]
-            key=lambda s: orden.index(s.nombre) if s.nombre in orden else 999
-        )
-
-    artefactos = proyecto.artefactos.select_related('fase', 'subartefacto') # pyright: ignore[reportAttributeAccessIssue]
+    # Número fijo de consultas: proyecto (con la marca de la HU) y títulos generados; el catálogo está en memoria
+    proyecto = get_object_or_404(
+        Project.objects.annotate(hu_con_requisitos=Exists(
+            Artefacto.objects.filter(proyecto=OuterRef('pk'), titulo_normalizado="historia de usuario", contexto__regex=r'\S')
+        )),
+        id=proyecto_id,
+        propietario=request.user,
+    )
+    catalogo = obtener_catalogo()
+    # Solo los de los subartefactos (a lo sumo uno por título): filas acotadas además de consultas
+    generados = set(Artefacto.objects.filter(
+        proyecto=proyecto, titulo__in=list(catalogo.subartefactos)
+    ).values_list('titulo', flat=True))
 
-    #=======  Buscar HU y verificar si tiene requisitos ===================
-    hu = artefactos.filter(titulo__iexact="Historia de Usuario").first()
-    hu_con_requisitos = hu and hu.contexto and hu.contexto.strip() != ""
-    
     return render(request, 'documentacion/detalle_proyecto.html', {
         'proyecto': proyecto,
-        'fases': fases,
-        'artefactos': artefactos,
-        'hu_con_requisitos': hu_con_requisitos
+        'fases': catalogo.fases,
+        'generados': generados,
+        'hu_con_requisitos': proyecto.hu_con_requisitos, # pyright: ignore[reportAttributeAccessIssue]
     })
 
 # ===================== CREAR Y EDITA ARTEFACTOS =====================
@@ -212,28 +166,17 @@ def crear_artefacto(request, proyecto_id):
     if request.method == 'POST':
         form = ArtefactoForm(request.POST)
         if form.is_valid():
-            artefacto = form.save(commit=False)
-            artefacto.proyecto = proyecto
-            artefacto.generado_por_ia = True
-            try:
-                if artefacto.get_tipo_display() in ARTEFACTOS_TEXTO:
-                    contenido = generar_subartefacto_con_prompt(
-                        tipo=artefacto.get_tipo_display(),
-                        nombre_proyecto=proyecto.nombre,
-                        descripcion=proyecto.descripcion
-                    )
-                else:
-                    contenido = generar_subartefacto_con_prompt(
-                        tipo=artefacto.get_tipo_display(),
-                        texto=proyecto.descripcion
-                    )
-                    contenido = limpiar_mermaid(contenido)
-                artefacto.contenido = contenido
-            except Exception as e:
-                import traceback
-                artefacto.contenido = f"[ERROR IA] {str(e)}\n{traceback.format_exc()}"
-            artefacto.save()
-            return redirect('detalle_proyecto', proyecto_id=proyecto.id) # type: ignore
+            titulo = form.cleaned_data['titulo']
+            rechazo = _cuota_rechazada(request, proyecto, [titulo])
+            if rechazo:
+                return rechazo
+            job = encolar_generacion(
+                proyecto,
+                titulo,
+                subartefacto=obtener_catalogo().subartefacto(titulo),
+                tipo=form.cleaned_data['tipo']
+            )
+            return _redirigir_generacion(request, job)
     else:
         form = ArtefactoForm(initial={'titulo': titulo_default})
     
@@ -253,49 +196,19 @@ def editar_artefacto(request, artefacto_id):
 
         if form.is_valid():
             if regenerar:
-                try:
-                    artefacto.titulo = form.cleaned_data['titulo']
-                    artefacto.tipo = form.cleaned_data['tipo'] 
-                    
-                    if artefacto.titulo.lower() == "historia de usuario":
-                        contenido = generar_subartefacto_con_prompt(
-                            tipo="Historia de Usuario",
-                            nombre_proyecto=proyecto.nombre,
-                            descripcion=proyecto.descripcion
-                        )
-                        artefacto.contenido = contenido
-                        artefacto.generado_por_ia = True
-
-                        try:
-                            from core.ia import extraer_requisitos  
-                            requisitos = extraer_requisitos(contenido)
-                            artefacto.contexto = requisitos
-                        except Exception as e:
-                            artefacto.contexto = "[ERROR AL EXTRAER REQUISITOS]"
-                    else:
-                        contenido = generar_subartefacto_con_prompt(
-                            tipo=artefacto.titulo,
-                            texto=proyecto.descripcion
-                        )
-                        artefacto.contenido = limpiar_mermaid(contenido)
-                        artefacto.generado_por_ia = True
-
-                    messages.success(request, '♻️ Artefacto regenerado correctamente con IA.')
-
-                except Exception as e:
-                    import traceback
-                    artefacto.contenido = f"[ERROR IA] {str(e)}\n{traceback.format_exc()}"
-                    messages.error(request, '❌ Error al regenerar el contenido con IA.')
-                
-            else:
-                
-                artefacto = form.save(commit=False)
-                messages.success(request, '💾 Artefacto actualizado correctamente.')
+                rechazo = _cuota_rechazada(request, proyecto, [artefacto.titulo])
+                if rechazo:
+                    return rechazo
+                job = encolar_generacion(proyecto, artefacto.titulo, artefacto=artefacto, forzar=True)
+                return _redirigir_generacion(request, job)
 
+            artefacto = form.save(commit=False)
+            messages.success(request, '💾 Artefacto actualizado correctamente.')
             artefacto.save()
+            programar_render(artefacto)
             return redirect('ver_artefacto', artefacto_id=artefacto.id) # pyright: ignore[reportAttributeAccessIssue]
         else:
-            print("❌ Errores de validación:", form.errors) 
+            logger.debug("Errores al editar el artefacto %s: %s", artefacto.id, form.errors.as_json())
             messages.error(request, '❌ Corrige los errores en el formulario.')
 
 
@@ -320,153 +233,320 @@ def eliminar_artefacto(request, artefacto_id):
 
 @login_required
 def ver_artefacto(request, artefacto_id):
-    artefacto = get_object_or_404(Artefacto, id=artefacto_id)
-    is_mermaid = artefacto.titulo in ARTEFACTOS_MERMAID
-    
-    if artefacto.titulo.lower() in PROMPTS and artefacto.titulo.lower() in ARTEFACTOS_MERMAID:
-        try:
-            texto_diagrama = artefacto.contexto if artefacto.contexto else artefacto.contenido
-            prompt = PROMPTS[artefacto.titulo](texto_diagrama)
-            mermaid_code = _generar_contenido(prompt)
-        except Exception as e:
-            mermaid_code = f"[ERROR AL GENERAR DIAGRAMA] {str(e)}"
-    
+    # Solo lectura: el código Mermaid ya se limpió y guardó al generar (Artefacto.render)
+    artefacto = get_object_or_404(
+        Artefacto.objects.select_related('proyecto'),
+        id=artefacto_id,
+        proyecto__propietario=request.user
+    )
+    render_artefacto = artefacto.render or {}
+    is_mermaid = render_artefacto.get("tipo") == "mermaid" if render_artefacto else artefacto.es_mermaid
+    # Si el diagrama ya está renderizado en el servidor se muestra como imagen
+    formatos = render_artefacto.get("archivos", []) if is_mermaid else []
+    diagrama_svg = reverse('diagrama_renderizado', args=[render_artefacto["hash"], 'svg']) if 'svg' in formatos else ""
+
     return render(request, 'documentacion/ver_artefacto.html', {
         'artefacto': artefacto,
         'is_mermaid': is_mermaid,
+        'codigo_mermaid': render_artefacto.get("codigo", artefacto.contenido) if is_mermaid else "",
+        'diagrama_svg': diagrama_svg,
+        'formatos_diagrama': formatos,
     })
 
+@login_required
+def diagrama_renderizado(request, clave, formato):
+    # Archivo direccionado por contenido: nunca cambia, se cachea un año
+    if formato not in FORMATOS_IMAGEN or len(clave) != 64:
+        raise Http404
+    if not Artefacto.objects.filter(proyecto__propietario=request.user, render__hash=clave).exists():
+        raise Http404
+
+    etag = f'"{clave}.{formato}"'
+    if request.headers.get('If-None-Match') == etag:
+        respuesta = HttpResponse(status=304)
+    else:
+        ruta = ruta_diagrama(clave, formato)
+        if not ruta.exists():
+            raise Http404
+        respuesta = FileResponse(open(ruta, 'rb'), content_type=FORMATOS_IMAGEN[formato])
+    respuesta['ETag'] = etag
+    respuesta['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return respuesta
+
 # ===================== IA GENERACIÓN AUTOMÁTICA ARTEFACTOS Y SUBARTEFACTOS =====================
 
 @login_required
 def generar_artefacto(request, proyecto_id, subartefacto_nombre):
     proyecto = get_object_or_404(Project, id=proyecto_id, propietario=request.user)
-    subartefacto = get_object_or_404(SubArtefacto, fase__proyecto=proyecto, nombre=subartefacto_nombre)
+    subartefacto = obtener_catalogo().subartefacto(subartefacto_nombre)
+    if subartefacto is None:
+        raise Http404("Subartefacto desconocido.")
 
     if subartefacto.nombre not in ARTEFACTOS_VALIDOS:
         return JsonResponse({"error": "Tipo de artefacto inválido."}, status=400)
     
-    artefactos = Artefacto.objects.filter(proyecto=proyecto)
-    hu = artefactos.filter(titulo__iexact="Historia de Usuario").first()
-    hu_con_requisitos = hu and hu.contexto and hu.contexto.strip() != ""
-
-    if subartefacto.nombre not in ARTEFACTOS_TEXTO and not hu_con_requisitos:
+    if faltan_requisitos(proyecto, subartefacto.nombre):
         messages.warning(request, "⚠️ Primero debes generar la Historia de Usuario con requisitos antes de crear este tipo de artefacto.")
         return redirect('detalle_proyecto', proyecto_id=proyecto.id) # pyright: ignore[reportAttributeAccessIssue]
 
     artefacto_existente = Artefacto.objects.filter(
         proyecto=proyecto,
         titulo=subartefacto.nombre
-    ).first()
+    ).metadatos().first()
     if artefacto_existente:
         return redirect('ver_artefacto', artefacto_id=artefacto_existente.id) # pyright: ignore[reportAttributeAccessIssue]
 
-    try:
-        if subartefacto.nombre in ARTEFACTOS_TEXTO:
-            contenido = generar_subartefacto_con_prompt(
-                tipo=subartefacto.nombre,
-                nombre_proyecto=proyecto.nombre,
-                descripcion=proyecto.descripcion
-            )
-        
+    rechazo = _cuota_rechazada(request, proyecto, [subartefacto.nombre])
+    if rechazo:
+        return rechazo
+    job = encolar_generacion(proyecto, subartefacto.nombre, subartefacto=subartefacto)
+    return _redirigir_generacion(request, job)
+
+def _cuota_rechazada(request, proyecto, titulos):
+    """
+    Consulta la cuota de IA antes de encolar. Si se rechaza devuelve la
+    redirección con el aviso; si toca esperar, avisa y deja encolar.
+    """
+    decision = consultar_cuota_generacion(proyecto, titulos)
+    if decision.accion == Decision.RECHAZAR:
+        if math.isinf(decision.espera):
+            messages.error(request, "⛔ La generación supera la cuota de uso de la IA disponible.")
         else:
-            
-            contenido = generar_subartefacto_con_prompt(
-                tipo=subartefacto.nombre,
-                texto=proyecto.descripcion
-            )
-            contenido = limpiar_mermaid(contenido)
-
-    except Exception as e:
-        import traceback
-        contenido = f"[ERROR IA] {str(e)}\n{traceback.format_exc()}"
-
-    artefacto = Artefacto.objects.create(
-        proyecto=proyecto,
-        fase=subartefacto.fase,
-        subartefacto=subartefacto,
-        titulo=subartefacto.nombre,
-        contenido=contenido,
-        generado_por_ia=True
-    )
-
-    if artefacto.titulo.lower() == "historia de usuario":
-            contenido = generar_subartefacto_con_prompt(
-                tipo="Historia de Usuario",
-                nombre_proyecto=proyecto.nombre,
-                descripcion=proyecto.descripcion
-            )
+            messages.error(request, f"⛔ Alcanzaste el límite de uso de la IA. Inténtalo de nuevo en {math.ceil(decision.espera)} s.")
+        return redirect('detalle_proyecto', proyecto_id=proyecto.id)
+    if decision.accion == Decision.ENCOLAR:
+        messages.info(request, "⏳ Límite de uso de la IA: la generación esperará su turno.")
+    return None
+
+def _respuesta_cuota(decision):
+    """Respuesta 429 (con Retry-After) para las vistas que generan en la misma petición."""
+    response = JsonResponse({"error": "Se alcanzó el límite de uso de la IA."}, status=429)
+    if not math.isinf(decision.espera):
+        response["Retry-After"] = str(math.ceil(decision.espera))
+    return response
 
-            artefacto.contenido = contenido
-            artefacto.generado_por_ia = True
+def _redirigir_generacion(request, job):
+    """Tras encolar: si ya terminó (modo síncrono) muestra el artefacto; si no, vuelve al proyecto."""
+    if job.estado == GenerationJob.TERMINADO:
+        messages.success(request, f"{job.titulo} generado con IA.")
+        if job.artefacto_id:
+            return redirect('ver_artefacto', artefacto_id=job.artefacto_id)
+    elif job.estado == GenerationJob.FALLIDO:
+        messages.error(request, f"❌ Error al generar {job.titulo} con IA: {job.error}")
+    else:
+        messages.info(request, f"⏳ {job.titulo}: generación en curso.")
+    return redirect('detalle_proyecto', proyecto_id=job.proyecto_id)
 
-            try:
-                requisitos = extraer_requisitos(contenido)
-                artefacto.contexto = requisitos
-            except Exception as e:
-                artefacto.contexto = "[ERROR AL EXTRAER REQUISITOS]"
+@require_POST
+@login_required
+def generar_todo(request, proyecto_id):
+    """Genera en segundo plano todos los artefactos que falten en el proyecto."""
+    proyecto = get_object_or_404(Project, id=proyecto_id, propietario=request.user)
+    rechazo = _cuota_rechazada(request, proyecto, ARTEFACTOS_TEXTO + ARTEFACTOS_MERMAID)
+    if rechazo:
+        return rechazo
+    job = encolar_generacion(proyecto, PROYECTO_COMPLETO)
+    return _redirigir_generacion(request, job)
 
-            artefacto.save()
-            messages.success(request, "Historia de Usuario generada con requisitos.")
-            return redirect('ver_artefacto', artefacto.id) # pyright: ignore[reportAttributeAccessIssue]
+@login_required
+def estado_generacion(request, proyecto_id):
+    """Estado de las generaciones recientes del proyecto (lo consulta detalle_proyecto)."""
+    proyecto = get_object_or_404(Project, id=proyecto_id, propietario=request.user)
+    desde = timezone.now() - datetime.timedelta(hours=1)
+    jobs = GenerationJob.objects.filter(proyecto=proyecto, creado__gte=desde).order_by('-creado')
+
+    generaciones = []
+    vistos = set()
+    for job in jobs:
+        if job.titulo in vistos:
+            continue
+        vistos.add(job.titulo)
+        generaciones.append({
+            "id": job.id,
+            "titulo": job.titulo,
+            "estado": job.estado,
+            "estado_display": job.get_estado_display(),
+            "error": job.error,
+            "url": reverse('ver_artefacto', args=[job.artefacto_id]) if job.artefacto_id else None,
+        })
 
-    return redirect('ver_artefacto', artefacto_id=artefacto.id) # pyright: ignore[reportAttributeAccessIssue]
+    return JsonResponse({
+        "pendientes": sum(1 for g in generaciones if g["estado"] in GenerationJob.ESTADOS_PENDIENTES),
+        "generaciones": generaciones,
+    })
 
 @login_required
-def generar_subartefacto_modal(request, proyecto_id):
+async def generar_subartefacto_modal(request, proyecto_id):
     subartefacto_nombre = request.GET.get("subartefacto", "")
-    proyecto = get_object_or_404(Project, id=proyecto_id, propietario=request.user)
+    usuario = await request.auser()
+    proyecto = await aget_object_or_404(Project, id=proyecto_id, propietario=usuario)
 
-    try:
-        if subartefacto_nombre in ARTEFACTOS_TEXTO:
-            contenido = generar_subartefacto_con_prompt(
-                tipo=subartefacto_nombre,
-                nombre_proyecto=proyecto.nombre,
-                descripcion=proyecto.descripcion
-            )
-        else:
-            contenido = generar_subartefacto_con_prompt(
-                tipo=subartefacto_nombre,
-                texto=proyecto.descripcion
-            )
-            contenido = limpiar_mermaid(contenido)
+    if subartefacto_nombre not in ARTEFACTOS_VALIDOS:
+        return JsonResponse({"error": "Tipo de artefacto inválido."}, status=400)
+
+    decision = await sync_to_async(consultar_cuota_generacion)(proyecto, [subartefacto_nombre])
+    if decision.accion == Decision.RECHAZAR:
+        return _respuesta_cuota(decision)
 
-        tipo = "mermaid" if subartefacto_nombre in ARTEFACTOS_MERMAID else "texto"
-    except Exception as e:
-        import traceback
-        contenido = f"[ERROR IA] {str(e)}\n{traceback.format_exc()}"
-        tipo = "error"
+    try:
+        with en_nombre_de(usuario.id):
+            contenido, _ = await generar_contenido_async(proyecto, subartefacto_nombre)
+    except ErrorIA as e:
+        return JsonResponse({"tipo": "error", "contenido": str(e), "titulo": subartefacto_nombre}, status=503)
 
     return JsonResponse({
-        "tipo": tipo,
+        "tipo": "mermaid" if subartefacto_nombre in ARTEFACTOS_MERMAID else "texto",
         "contenido": contenido,
         "titulo": subartefacto_nombre
     })
 
+def _evento_sse(evento, datos):
+    return f"event: {evento}\ndata: {json.dumps(datos, ensure_ascii=False)}\n\n"
+
+@login_required
+async def generar_subartefacto_stream(request, proyecto_id):
+    """
+    Genera un subartefacto enviando el texto al navegador a medida que llega
+    (server-sent events). Al terminar guarda el contenido en el Artefacto.
+    Bajo ASGI la respuesta se produce con el cliente asíncrono de Gemini;
+    bajo WSGI se usa el iterador síncrono para no acumular la respuesta.
+    Si ya hay una generación en vuelo del mismo artefacto (otra pestaña, doble
+    clic o un trabajo en cola) se espera a esa y se envía su resultado.
+    """
+    subartefacto_nombre = request.GET.get("subartefacto", "")
+    regenerar = request.GET.get("regenerar") == "1"
+    usuario = await request.auser()
+    proyecto = await aget_object_or_404(Project, id=proyecto_id, propietario=usuario)
+
+    if subartefacto_nombre not in ARTEFACTOS_VALIDOS:
+        return JsonResponse({"error": "Tipo de artefacto inválido."}, status=400)
+    if await sync_to_async(faltan_requisitos)(proyecto, subartefacto_nombre):
+        return JsonResponse({"error": "Primero debes generar la Historia de Usuario con requisitos."}, status=400)
+
+    artefacto = await Artefacto.objects.filter(proyecto=proyecto, titulo=subartefacto_nombre).afirst()
+
+    def a_evento(tipo, valor):
+        if tipo == "fragmento":
+            return _evento_sse("fragmento", {"texto": valor})
+        return _evento_sse("fin", {"url": reverse('ver_artefacto', args=[valor.id])})
+
+    def existente():
+        yield _evento_sse("fragmento", {"texto": artefacto.contenido})
+        yield _evento_sse("fin", {"url": reverse('ver_artefacto', args=[artefacto.id])})
+
+    # El trabajo en vuelo se cierra al terminar el stream, también si el cliente se desconecta
+    def eventos():
+        resultado = {"error": "Generación interrumpida."}
+        try:
+            with en_nombre_de(usuario.id):
+                for tipo, valor in generar_y_guardar_stream(proyecto, subartefacto_nombre, artefacto=artefacto, forzar=regenerar):
+                    if tipo == "fin":
+                        resultado = {"artefacto": valor}
+                    yield a_evento(tipo, valor)
+        except Exception as e:
+            resultado = {"error": str(e)}
+            yield _evento_sse("error", {"error": str(e)})
+        finally:
+            terminar_job(job, **resultado)
+
+    async def eventos_async():
+        resultado = {"error": "Generación interrumpida."}
+        try:
+            with en_nombre_de(usuario.id):
+                async for tipo, valor in generar_y_guardar_stream_async(proyecto, subartefacto_nombre, artefacto=artefacto, forzar=regenerar):
+                    if tipo == "fin":
+                        resultado = {"artefacto": valor}
+                    yield a_evento(tipo, valor)
+        except Exception as e:
+            resultado = {"error": str(e)}
+            yield _evento_sse("error", {"error": str(e)})
+        finally:
+            await sync_to_async(terminar_job)(job, **resultado)
+
+    def resultado_de(lider, generado):
+        if lider.pendiente:
+            yield _evento_sse("error", {"error": "La generación en curso está tardando; revisa el proyecto más tarde."})
+        elif generado is not None:
+            yield _evento_sse("fragmento", {"texto": generado.contenido})
+            yield _evento_sse("fin", {"url": reverse('ver_artefacto', args=[generado.id])})
+        else:
+            yield _evento_sse("error", {"error": lider.error or "No se pudo generar el artefacto."})
+
+    def en_espera():
+        lider = esperar_job(job)
+        yield from resultado_de(lider, Artefacto.objects.filter(pk=lider.artefacto_id).first())
+
+    async def en_espera_async():
+        lider = await esperar_job_async(job)
+        for evento in resultado_de(lider, await Artefacto.objects.filter(pk=lider.artefacto_id).afirst()):
+            yield evento
+
+    if artefacto and not regenerar:
+        contenido = existente()
+    else:
+        decision = await sync_to_async(consultar_cuota_generacion)(proyecto, [subartefacto_nombre])
+        if decision.accion == Decision.RECHAZAR:
+            return _respuesta_cuota(decision)
+        job, nuevo = await sync_to_async(reservar_generacion)(
+            proyecto, subartefacto_nombre, estado=GenerationJob.EJECUTANDO, artefacto=artefacto, forzar=regenerar
+        )
+        asincrono = isinstance(request, ASGIRequest)
+        if not nuevo:
+            contenido = en_espera_async() if asincrono else en_espera()
+        else:
+            contenido = eventos_async() if asincrono else eventos()
+
+    response = StreamingHttpResponse(contenido, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
 # ===================== DESCARGAR_ DIAGRAMA =====================
 
 @login_required
 def descargar_diagrama(request, artefacto_id):
     artefacto = get_object_or_404(Artefacto, id=artefacto_id, proyecto__propietario=request.user)
-    
-    diagramas_validos = [
-        "Diagrama de flujo",
-        "Diagrama de clases",
-        "Diagrama de Entidad-Relacion",
-        "Diagrama de secuencia",
-        "Diagrama de estado",
-        "Diagrama de C4-contexto",
-        "Diagrama de C4-contenedor",
-        "Diagrama de C4-implementación"
-    ]
-    if artefacto.titulo not in diagramas_validos:
+
+    if not artefacto.es_mermaid:
         return HttpResponse("Este artefacto no es un diagrama válido para descarga.", status=400)
 
-    filename = f"{artefacto.titulo.replace(' ', '_')}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.mmd"
-    response = HttpResponse(artefacto.contenido, content_type='text/plain')
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    formato = request.GET.get('formato', 'mmd')
+    if formato != 'mmd' and formato not in FORMATOS_IMAGEN:
+        return HttpResponse("Formato no soportado. Usa svg, png o mmd.", status=400)
+
+    filename = f"{artefacto.titulo.replace(' ', '_')}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.{formato}"
+    if formato == 'mmd':
+        response = HttpResponse(artefacto.contenido, content_type='text/plain')
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    # Solo se sirve lo ya renderizado: mermaid-cli lo ejecuta el worker, nunca la petición
+    codigo = (artefacto.render or {}).get("codigo") or limpiar_mermaid(artefacto.contenido)
+    ruta = ruta_diagrama(clave_diagrama(codigo), formato)
+    if ruta.exists():
+        return FileResponse(open(ruta, 'rb'), as_attachment=True, filename=filename, content_type=FORMATOS_IMAGEN[formato])
+    if artefacto.render_pendiente and formato in formatos_configurados() and renderizador_disponible():
+        response = HttpResponse("El diagrama se está renderizando; vuelve a intentarlo en unos segundos.", status=202)
+        response['Retry-After'] = '5'
+        return response
+    # Sin imagen en el servidor (mermaid-cli no disponible o falló): el código Mermaid
+    response = HttpResponse(codigo, content_type='text/plain; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{filename.rsplit(".", 1)[0]}.mmd"'
     return response
 
+# ===================== MÉTRICAS =====================
+
+def metricas(request):
+    """Métricas de las llamadas a la IA en formato Prometheus."""
+    token = settings.METRICAS_TOKEN
+    if token:
+        autorizacion = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(autorizacion.encode(), f"Bearer {token}".encode()):
+            return HttpResponse("No autorizado.", status=401)
+    elif not request.user.is_staff:
+        return HttpResponse("Solo para administradores.", status=403)
+    return HttpResponse(metricas_prometheus(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
 # ===================== LOGIN =====================
 
 def check_username(request):
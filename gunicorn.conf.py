@@ -0,0 +1,17 @@
+import os
+
+# gunicorn -c gunicorn.conf.py (se lee por defecto desde este directorio)
+
+wsgi_app = "docai_project.wsgi:application"
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))  # las generaciones síncronas pueden tardar
+
+
+def post_worker_init(worker):
+    # Ya en el worker (después del fork) y con Django cargado: importa el SDK
+    # de Gemini y crea sus clientes si IA_BACKEND["PRECALENTAR"] está activo.
+    # En el proceso maestro no se importa nunca, ni siquiera con preload_app.
+    from core.proveedores import precalentar
+
+    precalentar()